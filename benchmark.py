@@ -0,0 +1,169 @@
+import argparse
+import json
+import time
+
+import OpenGL
+OpenGL.ERROR_CHECKING = __debug__  # python -O skips PyOpenGL's glGetError after every GL call
+import offscreen  # Must come before OpenGL.GL: selects the headless platform
+import numpy as np
+from OpenGL.GL import *
+
+import renderer
+from camera import flyby
+from profiler import FrameProfiler
+from resolution import DynamicResolution
+from shaders import GpuOrbits
+from simulation import SolarSystem
+from skybox import StarSkybox
+
+# Scene sizes measured by default: a baseline matching solar_system.py, then each object count
+# scaled up on its own so a regression points at one code path
+BASELINE = {"asteroids": 100, "stars": 1000, "comets": 3}
+SWEEP = {
+    "asteroids": (1000, 10000, 100000),
+    "stars": (10000, 100000),
+    "comets": (300, 3000),
+}
+
+
+# Render frames of one scene size into framebuffer along the flyby camera path and time them.
+# Each frame steps the simulation once, draws it and waits for the GL to finish, so latency
+# covers CPU and (software) GPU work. With stages=True a synchronous FrameProfiler also reports
+# the mean time, draw calls, state changes and redundant state calls skipped of each stage (slower,
+# since every stage boundary waits for the GL). shaders=True draws planets, moons and asteroids
+# with shaders.GpuOrbits; sort_state=False draws in submission order instead of sorted by state.
+# gravity=True integrates asteroids and comets under gravity ("mutual" adds their own attraction).
+# target_fps renders through resolution.DynamicResolution and reports the scale it settles on.
+# skybox=True draws the stars from a skybox.StarSkybox ("nebula" adds its nebula); the first bake
+# happens before timing starts. scene is a scene file (see scene.py); its belts, stars and comets
+# sections replace the matching counts.
+def run(framebuffer, asteroids, stars, comets, frames=300, warmup=30, seed=0, culling=True,
+        stages=False, shaders=False, sort_state=True, gravity=False, target_fps=None, skybox=False,
+        scene=None):
+    system = SolarSystem(num_asteroids=asteroids, num_stars=stars, num_comets=comets, seed=seed,
+                         gravity=bool(gravity), mutual_gravity=gravity == "mutual", scene=scene)
+    orbits = system.orbit_paths()
+    viewport = (framebuffer.width, framebuffer.height)
+    framebuffer.bind()
+
+    latencies = np.empty(frames)
+    draw_calls = np.empty(frames, dtype=np.int64)
+    profiler = FrameProfiler(history=frames, sync=True) if stages else None
+    renderer.count_state_changes(stages)
+    gpu_orbits = GpuOrbits(system) if shaders else None
+    sky = StarSkybox(system, nebula=skybox == "nebula") if skybox else None
+    scaler = DynamicResolution(viewport, 1000 / target_fps, output=framebuffer.fbo) if target_fps else None
+    scales = np.ones(frames)
+    for frame in range(warmup + frames):
+        start = time.perf_counter()
+        if profiler:
+            profiler.begin_frame()
+            profiler.stage("update")
+        system.step(1)
+        size = scaler.begin() if scaler else viewport
+        renderer.draw_scene(system, *flyby(frame), size, orbits, culling=culling,
+                            profiler=profiler, gpu_orbits=gpu_orbits, sort_state=sort_state, skybox=sky)
+        if scaler:
+            scaler.end()
+        glFinish()
+        if profiler:
+            profiler.end_frame()
+        if scaler:
+            scaler.update((time.perf_counter() - start) * 1000)
+        if frame >= warmup:
+            latencies[frame - warmup] = time.perf_counter() - start
+            counts = profiler.total("draw_calls") if profiler else renderer.frame_stats["draw_calls"]
+            draw_calls[frame - warmup] = counts
+            scales[frame - warmup] = scaler.scale if scaler else 1.0
+
+    if gpu_orbits:
+        gpu_orbits.delete()
+    if sky:
+        sky.delete()
+    if scaler:
+        scaler.delete()
+        framebuffer.bind()
+    error = glGetError()
+    if error != GL_NO_ERROR:
+        raise RuntimeError("OpenGL error 0x%x during benchmark" % error)
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+    result = {
+        "asteroids": system.asteroids.count, "stars": system.stars.count, "comets": system.comets.count,
+        "frames": frames, "fps": frames / latencies.sum(),
+        "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": latencies.max() * 1000,
+        "draw_calls": draw_calls.mean(),
+    }
+    if scaler:
+        result["scale"] = scales[-1]
+        result["mean_scale"] = scales.mean()
+    if profiler:
+        averages = profiler.averages()
+        result["stages"] = {name: {key: averages.get(f"{name}_{key}", 0)
+                                   for key in ("ms", "draw_calls", "state_changes", "redundant_state")}
+                            for name in profiler.stages()}
+        for key in ("state_changes", "redundant_state"):
+            result[key] = sum(stage[key] for stage in result["stages"].values())
+    return result
+
+
+# Baseline first, then one run per swept size with the other counts at their baseline
+def scenes(sweep=True):
+    yield dict(BASELINE)
+    if sweep:
+        for name, sizes in SWEEP.items():
+            for size in sizes:
+                yield dict(BASELINE, **{name: size})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the solar system offscreen and time it")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30, help="untimed frames before each run")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-sweep", action="store_true", help="only run the baseline scene")
+    parser.add_argument("--no-culling", action="store_true")
+    parser.add_argument("--shaders", action="store_true", help="place and light bodies in GLSL")
+    parser.add_argument("--stages", action="store_true", help="break each frame down per stage")
+    parser.add_argument("--gravity", nargs="?", const=True, choices=(True, "mutual"), default=False,
+                        help="integrate asteroids and comets under gravity; --gravity mutual adds their own attraction")
+    parser.add_argument("--target-fps", type=float,
+                        help="scale the render resolution to hold this frame rate (dynamic resolution)")
+    parser.add_argument("--skybox", nargs="?", const=True, choices=(True, "nebula"), default=False,
+                        help="draw the stars from a baked cubemap; --skybox nebula adds a nebula")
+    parser.add_argument("--unsorted", action="store_true", help="draw in submission order, not sorted by state")
+    parser.add_argument("--scene", help="build the system from this scene file")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    offscreen.create_context()
+    renderer.setup_gl_state()
+    framebuffer = offscreen.Framebuffer(args.width, args.height)
+    print(f"{glGetString(GL_RENDERER).decode()}, {args.width}x{args.height}, {args.frames} frames")
+    print(f"{'asteroids':>9} {'stars':>7} {'comets':>6} {'fps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'draws':>6}")
+
+    results = []
+    for scene in scenes(not args.no_sweep):
+        result = run(framebuffer, frames=args.frames, warmup=args.warmup, seed=args.seed,
+                     culling=not args.no_culling, stages=args.stages,
+                     shaders=args.shaders, sort_state=not args.unsorted, gravity=args.gravity,
+                     target_fps=args.target_fps, skybox=args.skybox, scene=args.scene, **scene)
+        results.append(result)
+        print(f"{result['asteroids']:>9} {result['stars']:>7} {result['comets']:>6} {result['fps']:>8.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['draw_calls']:>6.1f}")
+        if "scale" in result:
+            print(f"{'':>9} resolution scale {result['scale']:.2f} at the end, {result['mean_scale']:.2f} on average")
+        if "stages" in result:
+            print(f"{'':>9} {result['state_changes']:.1f} state changes, "
+                  f"{result['redundant_state']:.1f} redundant ones skipped per frame")
+        for name, stage in result.get("stages", {}).items():
+            print(f"{'':>9} {name:<15} {stage['ms']:>8.3f} ms {stage['draw_calls']:>6.1f} draws "
+                  f"{stage['state_changes']:>6.1f} state changes {stage['redundant_state']:>6.1f} skipped")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"renderer": glGetString(GL_RENDERER).decode(), "width": args.width,
+                       "height": args.height, "seed": args.seed, "results": results}, f, indent=2)
@@ -0,0 +1,74 @@
+import math
+import numpy as np
+
+
+# World-space eye position for the orbit camera used by the render loop:
+# glTranslatef(0, 0, -distance); glRotatef(rot_x, 1, 0, 0); glRotatef(rot_y, 0, 1, 0)
+def eye_position(rot_x, rot_y, distance):
+    rx = math.radians(rot_x)
+    ry = math.radians(rot_y)
+    return np.array([
+        -distance * math.cos(rx) * math.sin(ry),
+        distance * math.sin(rx),
+        distance * math.cos(rx) * math.cos(ry),
+    ])
+
+
+# Scripted orbit-camera path (rot_x, rot_y, distance) for offscreen runs: a slow orbit with some
+# tilt and zoom, so culling and level of detail change the way they do when a user drags the view
+def flyby(frame):
+    rot_x = 30 * math.sin(frame * 0.013)
+    rot_y = frame * 0.5
+    distance = 35 + 15 * math.sin(frame * 0.007)
+    return rot_x, rot_y, distance
+
+
+# On-screen diameter in pixels of spheres at positions, seen from eye with a vertical fov in degrees
+def projected_diameters(positions, radii, eye, viewport_height, fov=45):
+    distance = np.linalg.norm(np.asarray(positions) - eye, axis=-1)
+    return radii * viewport_height / (np.maximum(distance, 1e-6) * math.tan(math.radians(fov) / 2))
+
+
+# gluPerspective as a NumPy matrix (column-vector convention: clip = P @ eye)
+def projection_matrix(fov, aspect, near, far):
+    f = 1 / math.tan(math.radians(fov) / 2)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+        [0, 0, -1, 0],
+    ])
+
+
+# glRotatef(angle, *axis) for a unit axis along x or y
+def rotation_matrix(angle, axis):
+    c = math.cos(math.radians(angle))
+    s = math.sin(math.radians(angle))
+    if axis == "x":
+        return np.array([[1, 0, 0, 0], [0, c, -s, 0], [0, s, c, 0], [0, 0, 0, 1]])
+    return np.array([[c, 0, s, 0], [0, 1, 0, 0], [-s, 0, c, 0], [0, 0, 0, 1]])
+
+
+# Model-view matrix of the orbit camera (same transform as the render loop)
+def view_matrix(rot_x, rot_y, distance):
+    translate = np.eye(4)
+    translate[2, 3] = -distance
+    return translate @ rotation_matrix(rot_x, "x") @ rotation_matrix(rot_y, "y")
+
+
+# The six frustum planes (a, b, c, d), normals pointing inwards, from a projection @ view matrix
+def frustum_planes(clip_matrix):
+    m = np.asarray(clip_matrix)
+    planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+# Frustum planes for the orbit camera with a gluPerspective projection
+def camera_frustum(rot_x, rot_y, distance, aspect, fov=45, near=0.1, far=200.0):
+    return frustum_planes(projection_matrix(fov, aspect, near, far) @ view_matrix(rot_x, rot_y, distance))
+
+
+# Boolean mask of the bounding spheres (centers (n, 3), radii scalar or (n,)) that touch the frustum
+def spheres_visible(planes, centers, radii=0.0):
+    distances = np.asarray(centers) @ planes[:, :3].T + planes[:, 3]
+    return (distances >= -np.reshape(radii, (-1, 1))).all(axis=1)
@@ -0,0 +1,146 @@
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import OpenGL
+OpenGL.ERROR_CHECKING = __debug__  # python -O skips PyOpenGL's glGetError after every GL call
+import offscreen  # Must come before OpenGL.GL: selects the headless platform
+from OpenGL.GL import *
+
+import renderer
+from camera import flyby
+from simulation import SolarSystem
+
+
+# Minimal PNG encoder for (height, width, 4) RGBA frames stored bottom row first. zlib releases
+# the GIL while compressing, so a thread pool encodes several frames in parallel.
+def encode_png(pixels, level=6):
+    height, width = pixels.shape[:2]
+    rows = pixels[::-1].reshape(height, width * 4)
+    filtered = bytearray(height * (width * 4 + 1))  # Filter byte 0 (none) before each row
+    view = memoryview(filtered)
+    for y in range(height):
+        start = y * (width * 4 + 1) + 1
+        view[start:start + width * 4] = rows[y].tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)  # 8-bit RGBA
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(filtered, level)) + chunk(b"IEND", b""))
+
+
+# Writes numbered PNGs from a worker pool. At most 2 * workers frames are in flight; submit()
+# waits for the oldest one beyond that so memory stays bounded when encoding is the bottleneck.
+class PngSink:
+    def __init__(self, pattern, workers=4, level=6):
+        os.makedirs(os.path.dirname(pattern) or ".", exist_ok=True)
+        self.pattern = pattern
+        self.level = level
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="png")
+        self.in_flight = deque()
+        self.limit = 2 * workers
+
+    def write(self, index, pixels):
+        with open(self.pattern % index, "wb") as f:
+            f.write(encode_png(pixels, self.level))
+
+    def submit(self, index, pixels):
+        while len(self.in_flight) >= self.limit:
+            self.in_flight.popleft().result()
+        self.in_flight.append(self.pool.submit(self.write, index, pixels))
+
+    def close(self):
+        while self.in_flight:
+            self.in_flight.popleft().result()
+        self.pool.shutdown()
+
+
+# Streams raw RGBA frames into ffmpeg, which flips and encodes them. A single writer thread keeps
+# frames in order while the render loop carries on.
+class FfmpegSink:
+    def __init__(self, path, width, height, fps=60, codec_args=("-c:v", "libx264", "-crf", "18")):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg not found on PATH; export PNG frames instead")
+        command = ["ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgba",
+                   "-s", f"{width}x{height}", "-r", str(fps), "-i", "-", "-vf", "vflip",
+                   *codec_args, "-pix_fmt", "yuv420p", path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="ffmpeg")
+        self.in_flight = deque()
+
+    def submit(self, index, pixels):
+        while len(self.in_flight) >= 4:
+            self.in_flight.popleft().result()
+        self.in_flight.append(self.pool.submit(self.process.stdin.write, pixels.data))
+
+    def close(self):
+        while self.in_flight:
+            self.in_flight.popleft().result()
+        self.pool.shutdown()
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with status {self.process.returncode}")
+
+
+# Render frames offscreen along the flyby path, advancing the simulation by step frames between
+# exported frames (no wall clock involved), and hand the pixels to sink as they come back from
+# the pixel buffer ring. Returns the exported frames per second.
+def export(system, sink, frames, width, height, step=1, buffers=3, culling=True, start=0):
+    framebuffer = offscreen.Framebuffer(width, height)
+    reader = offscreen.PixelReader(width, height, buffers)
+    orbits = system.orbit_paths()
+    framebuffer.bind()
+    begin = time.perf_counter()
+    for index in range(frames):
+        renderer.draw_scene(system, *flyby(start + index * step), (width, height), orbits, culling=culling)
+        result = reader.read(index)
+        if result:
+            sink.submit(*result)
+        system.step(step)
+    for result in reader.flush():
+        sink.submit(*result)
+    sink.close()
+    elapsed = time.perf_counter() - begin
+    reader.delete()
+    framebuffer.delete()
+    return frames / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the solar system to PNG frames or a video")
+    parser.add_argument("output", help="frame pattern such as frames/frame_%%05d.png, or a video file (.mp4, .mkv...)")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--step", type=int, default=1, help="simulation frames per exported frame")
+    parser.add_argument("--start", type=int, default=0, help="simulation frame to start from")
+    parser.add_argument("--fps", type=int, default=60, help="video frame rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--asteroids", type=int, default=100)
+    parser.add_argument("--stars", type=int, default=1000)
+    parser.add_argument("--comets", type=int, default=3)
+    parser.add_argument("--buffers", type=int, default=3, help="pixel buffer objects in the readback ring")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="PNG encoder threads")
+    parser.add_argument("--compression", type=int, default=6, help="PNG zlib level (0-9)")
+    args = parser.parse_args()
+
+    offscreen.create_context()
+    renderer.setup_gl_state()
+    system = SolarSystem(num_asteroids=args.asteroids, num_stars=args.stars, num_comets=args.comets,
+                         seed=args.seed)
+    system.seek(args.start)
+    if args.output.endswith(".png"):
+        sink = PngSink(args.output, args.workers, args.compression)
+    else:
+        sink = FfmpegSink(args.output, args.width, args.height, args.fps)
+    fps = export(system, sink, args.frames, args.width, args.height, args.step, args.buffers,
+                 start=args.start)
+    print(f"Exported {args.frames} frames at {args.width}x{args.height}: {fps:.1f} frames/s")
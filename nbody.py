@@ -0,0 +1,361 @@
+import math
+import time
+
+import numpy as np
+
+# Gravity for many free bodies, NumPy only. Accelerations come either from direct summation
+# (exact, O(n * sources)) or from a Barnes-Hut octree (O(n log n) to build, about O(n) to walk).
+# Gravitational parameters (G * mass) are used throughout, so no G constant appears. The octree
+# is a linear one: bodies are sorted by Morton code, and every node at every level is a
+# contiguous run of that order, so building it is a few sorts and reductions, and the walk runs
+# over whole arrays of node pairs instead of recursing per body.
+
+MORTON_DEPTH = 16  # Octree levels below the root; 3 * 16 bits of the uint64 Morton code
+
+
+# Spread the low 21 bits of v so there are two zero bits between each of them
+def spread_bits(v):
+    v = v.astype(np.uint64)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+# Morton (Z-order) codes of positions inside the cube at low with side size, depth bits per axis
+def morton_codes(positions, low, size, depth=MORTON_DEPTH):
+    cells = 1 << depth
+    grid = np.clip(((positions - low) * (cells / size)).astype(np.int64), 0, cells - 1)
+    return spread_bits(grid[:, 0]) | (spread_bits(grid[:, 1]) << np.uint64(1)) | (spread_bits(grid[:, 2]) << np.uint64(2))
+
+
+# Accelerations on targets from point masses at sources with parameters gm, softened by
+# softening (Plummer). exclude_self skips the pair i == i when targets are the sources. Works in
+# blocks of targets so memory stays at about pairs (target, source) pairs.
+def direct_accelerations(targets, sources, gm, softening=0.0, exclude_self=False, pairs=1 << 20):
+    softening2 = softening * softening
+    if len(sources) <= 64 and not exclude_self:
+        # A few heavy sources (Sun and planets): one vectorized pass over the targets per source
+        x, y, z = (np.ascontiguousarray(column) for column in targets.T)
+        ax, ay, az = np.zeros_like(x), np.zeros_like(x), np.zeros_like(x)
+        for (sx, sy, sz), m in zip(sources, gm):
+            dx, dy, dz = sx - x, sy - y, sz - z
+            r2 = dx * dx + dy * dy + dz * dz + softening2
+            inverse = m / (r2 * np.sqrt(r2))
+            ax += dx * inverse
+            ay += dy * inverse
+            az += dz * inverse
+        return np.stack([ax, ay, az], axis=1)
+    accelerations = np.zeros_like(targets, dtype=float)
+    block = max(1, pairs // max(len(sources), 1))
+    for start in range(0, len(targets), block):
+        d = sources[None, :, :] - targets[start:start + block, None, :]
+        r2 = np.einsum("ijk,ijk->ij", d, d) + softening2
+        with np.errstate(divide="ignore"):
+            inverse = gm[None, :] / (r2 * np.sqrt(r2))
+        if exclude_self:
+            rows = np.arange(min(block, len(targets) - start))
+            inverse[rows, start + rows] = 0
+        accelerations[start:start + block] = np.einsum("ij,ijk->ik", inverse, d)
+    return accelerations
+
+
+# Linear Barnes-Hut octree over positions with gravitational parameters gm. Node arrays are flat
+# across levels (root first): mass, center of mass, size, Morton prefix, the run of bodies (in
+# Morton order) and the run of child nodes. A node is a leaf once it holds at most
+# leaf_size bodies or reaches MORTON_DEPTH.
+class Octree:
+    def __init__(self, positions, gm, leaf_size=4, depth=MORTON_DEPTH):
+        low = positions.min(axis=0)
+        size = max(float((positions.max(axis=0) - low).max()), 1e-12) * (1 + 1e-9)
+        codes = morton_codes(positions, low, size, depth)
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.positions = positions[self.order]
+        self.gm = gm[self.order]
+        count = len(positions)
+
+        levels = []
+        starts = np.zeros(1, dtype=np.int64)
+        for level in range(depth + 1):
+            shift = 3 * (depth - level)
+            keys = self.codes >> np.uint64(shift)
+            if level:
+                starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            counts = np.diff(np.r_[starts, count])
+            leaf = (counts <= leaf_size) | (level == depth)
+            levels.append((starts, counts, keys[starts], shift, leaf, size / (1 << level)))
+            if leaf.all():
+                break
+
+        # Flatten, linking each node to the contiguous run of its children on the next level
+        offsets = np.cumsum([0] + [len(level[0]) for level in levels])
+        self.first_child = np.zeros(offsets[-1], dtype=np.int64)
+        self.child_count = np.zeros(offsets[-1], dtype=np.int64)
+        for i, (starts, counts, *_) in enumerate(levels[:-1]):
+            child_starts = levels[i + 1][0]
+            first = np.searchsorted(child_starts, starts)
+            self.first_child[offsets[i]:offsets[i + 1]] = offsets[i + 1] + first
+            self.child_count[offsets[i]:offsets[i + 1]] = np.searchsorted(child_starts, starts + counts) - first
+        self.start = np.concatenate([level[0] for level in levels])
+        self.count = np.concatenate([level[1] for level in levels])
+        self.key = np.concatenate([level[2] for level in levels])
+        self.shift = np.concatenate([np.full(len(level[0]), level[3], dtype=np.uint64) for level in levels])
+        self.leaf = np.concatenate([level[4] for level in levels])
+        self.size = np.concatenate([np.full(len(level[0]), level[5]) for level in levels])
+        self.child_count[self.leaf] = 0
+        self.mass = np.add.reduceat(self.gm, self.start)
+        weighted = np.add.reduceat(self.gm[:, None] * self.positions, self.start)
+        mean = np.add.reduceat(self.positions, self.start) / self.count[:, None]  # For massless nodes
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.center = np.where(self.mass[:, None] > 0, weighted / self.mass[:, None], mean)
+        self.levels = len(levels)
+        self.level_nodes = [np.arange(offsets[i], offsets[i + 1]) for i in range(len(levels))]
+
+        # Opening radius around the center of mass: the cell's bounding radius (half its
+        # diagonal), or the farthest body from the center of mass if nearer (sparse cells in a
+        # thin ring are mostly empty space)
+        extent = np.zeros(len(self.start))
+        for i, (starts, counts, *_) in enumerate(levels):
+            nodes = np.arange(offsets[i], offsets[i + 1])
+            spread = self.positions - np.repeat(self.center[nodes], counts, axis=0)
+            extent[nodes] = np.sqrt(np.maximum.reduceat(np.einsum("ij,ij->i", spread, spread), starts))
+        self.radius = np.minimum(self.size * math.sqrt(3) / 2, extent)
+
+        # Parent of every node reached from the root, and the leaves reached (which partition
+        # the bodies, in Morton order)
+        self.parent = np.full(len(self.start), -1)
+        for i in range(len(levels) - 1):
+            parents = np.arange(offsets[i], offsets[i + 1])
+            parents = parents[(self.parent[parents] >= 0) | (parents == 0)]
+            self.parent[ragged_ranges(self.first_child[parents], self.child_count[parents])] = \
+                np.repeat(parents, self.child_count[parents])
+        self.leaves = np.flatnonzero(self.leaf & ((self.parent >= 0) | (np.arange(len(self.leaf)) == 0)))
+        self.leaves = self.leaves[np.argsort(self.start[self.leaves])]
+        self.leaf_of = np.repeat(self.leaves, self.count[self.leaves])  # Per body, Morton order
+
+    # Accelerations on every body (in the caller's order) from all the others.
+    #
+    # Dual-tree walk over pairs of (target node, source node), starting from (root, root). A
+    # well-separated pair (both bounding radii together less than theta times the distance) adds
+    # the source's pull and tidal tensor at the target's center to the target's expansion;
+    # otherwise the larger node is split. Expansions are then pushed down the tree to the leaves,
+    # and each body gets the first-order expansion of its leaf. Pairs of leaves too close to
+    # separate are summed body by body. The number of pairs grows linearly with the number of bodies.
+    def accelerations(self, theta=0.5, softening=0.0):
+        softening2 = softening * softening
+        node_count = len(self.start)
+        center = np.ascontiguousarray(self.center.T)  # Component-major: np.take along axis 1 is
+        positions = np.ascontiguousarray(self.positions.T)  # far faster than gathering rows
+        field = np.zeros((3, node_count))
+        tidal = np.zeros((6, node_count))  # xx, yy, zz, xy, xz, yz
+        near_targets, near_sources = [], []
+        radius = self.radius
+
+        targets = sources = np.zeros(1, dtype=np.int64)
+        while len(targets):
+            d = np.take(center, sources, axis=1) - np.take(center, targets, axis=1)
+            r2 = np.einsum("ij,ij->j", d, d)
+            reach = (radius[targets] + radius[sources]) / theta
+            far = reach * reach < r2
+            if far.any():
+                t, mass = targets[far], self.mass[sources[far]]
+                d, r2 = np.compress(far, d, axis=1), r2[far] + softening2
+                inverse3 = mass / (r2 * np.sqrt(r2))
+                inverse5 = 3 * inverse3 / r2
+                for axis in range(3):
+                    field[axis] += np.bincount(t, d[axis] * inverse3, minlength=node_count)
+                for column, (i, j) in enumerate(TIDAL_COMPONENTS):
+                    weights = d[i] * d[j] * inverse5
+                    if i == j:
+                        weights -= inverse3
+                    tidal[column] += np.bincount(t, weights, minlength=node_count)
+            targets, sources = targets[~far], sources[~far]
+            near = self.leaf[targets] & self.leaf[sources]
+            near_targets.append(targets[near])
+            near_sources.append(sources[near])
+            targets, sources = targets[~near], sources[~near]
+            # Split the source if it is the larger node or the target is a leaf
+            split_source = ~self.leaf[sources] & ((radius[sources] >= radius[targets]) | self.leaf[targets])
+            split = np.where(split_source, sources, targets)
+            children = self.child_count[split]
+            split = ragged_ranges(self.first_child[split], children)
+            keep = np.repeat(np.where(split_source, targets, sources), children)
+            split_source = np.repeat(split_source, children)
+            targets, sources = np.where(split_source, keep, split), np.where(split_source, split, keep)
+
+        # Push expansions down, shifting each parent's field to the child's center
+        for nodes in self.level_nodes[1:]:
+            nodes = nodes[self.parent[nodes] >= 0]
+            parents = self.parent[nodes]
+            field[:, nodes] += field[:, parents] + tidal_product(tidal[:, parents], center[:, nodes] - center[:, parents])
+            tidal[:, nodes] += tidal[:, parents]
+
+        leaf_of = self.leaf_of
+        result = np.take(field, leaf_of, axis=1) + tidal_product(
+            np.take(tidal, leaf_of, axis=1), positions - np.take(center, leaf_of, axis=1))
+
+        # Leaves too close to separate: every body of the target leaf against every body of the
+        # source leaf
+        targets, sources = np.concatenate(near_targets), np.concatenate(near_sources)
+        source_counts = self.count[sources]
+        pairs = self.count[targets] * source_counts
+        within = ragged_ranges(np.zeros(len(pairs), dtype=np.int64), pairs)
+        source_counts = np.repeat(source_counts, pairs)
+        bodies = np.repeat(self.start[targets], pairs) + within // source_counts
+        others = np.repeat(self.start[sources], pairs) + within % source_counts
+        keep = bodies != others
+        bodies, others = bodies[keep], others[keep]
+        d = np.take(positions, others, axis=1) - np.take(positions, bodies, axis=1)
+        r2 = np.einsum("ij,ij->j", d, d) + softening2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse3 = np.where(r2 > 0, self.gm[others] / (r2 * np.sqrt(r2)), 0)
+        for axis in range(3):
+            result[axis] += np.bincount(bodies, d[axis] * inverse3, minlength=result.shape[1])
+
+        accelerations = np.empty((len(self.order), 3))
+        accelerations[self.order] = result.T
+        return accelerations
+
+
+TIDAL_COMPONENTS = ((0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2))
+
+
+# Symmetric 3x3 tensors stored as (xx, yy, zz, xy, xz, yz) columns times (3, n) vectors
+def tidal_product(t, v):
+    return np.stack([t[0] * v[0] + t[3] * v[1] + t[4] * v[2],
+                     t[3] * v[0] + t[1] * v[1] + t[5] * v[2],
+                     t[4] * v[0] + t[5] * v[1] + t[2] * v[2]])
+
+
+# Concatenated ranges start[i] .. start[i] + count[i] as one index array
+def ragged_ranges(start, count):
+    ends = np.cumsum(count)
+    total = int(ends[-1]) if len(ends) else 0
+    return np.repeat(start - ends + count, count) + np.arange(total)
+
+
+# Free bodies (positions and velocities, float64) moving under an external field of point masses
+# on prescribed paths, field(t) -> (source positions, source gm), plus, with mutual=True, their
+# own attraction through gm. Integrated with kick-drift-kick leapfrog, which is symplectic and
+# time-reversible, so orbits keep their energy over long runs instead of spiralling.
+#
+# The mutual force is weak and slowly varying, so it is the slow half of a two-rate (r-RESPA)
+# leapfrog: it kicks once every mutual_interval steps with mutual_interval times the step, while
+# the field kicks every step. The splitting is still symplectic. direct=True computes it by direct
+# summation instead of the octree, as an O(n^2) reference.
+class NBody:
+    def __init__(self, positions, velocities, gm, field, mutual=False, theta=0.5, softening=0.05,
+                 field_softening=0.1, mutual_interval=8, direct=False, time=0.0):
+        self.positions = np.array(positions, dtype=float)
+        self.velocities = np.array(velocities, dtype=float)
+        self.gm = np.asarray(gm, dtype=float)
+        self.field = field
+        self.mutual = mutual
+        self.theta = theta
+        self.softening = softening
+        self.field_softening = field_softening
+        self.mutual_interval = mutual_interval
+        self.direct = direct
+        self.time = time
+        self.steps = 0
+        self.field_acceleration = None  # Field acceleration at the current positions and time
+        self.mutual_opened = False  # Whether the current slow cycle has had its opening half kick
+
+    # Call after changing positions or velocities from outside (respawns)
+    def invalidate(self):
+        self.field_acceleration = None
+
+    def field_accelerations(self, t):
+        sources, gm = self.field(t)
+        return direct_accelerations(self.positions, sources, gm, self.field_softening)
+
+    def mutual_accelerations(self):
+        if len(self.positions) < 2:
+            return np.zeros_like(self.positions)
+        if self.direct:
+            return direct_accelerations(self.positions, self.positions, self.gm, self.softening,
+                                        exclude_self=True)
+        return Octree(self.positions, self.gm).accelerations(self.theta, self.softening)
+
+    def step(self, dt=1.0):
+        if self.mutual and self.steps % self.mutual_interval == 0:
+            # Close the previous slow cycle and open the next with one combined kick
+            kick = 0.5 if not self.mutual_opened else 1.0
+            self.velocities += self.mutual_accelerations() * (kick * self.mutual_interval * dt)
+            self.mutual_opened = True
+        if self.field_acceleration is None:
+            self.field_acceleration = self.field_accelerations(self.time)
+        self.velocities += self.field_acceleration * (dt / 2)
+        self.positions += self.velocities * dt
+        self.time += dt
+        self.field_acceleration = self.field_accelerations(self.time)
+        self.velocities += self.field_acceleration * (dt / 2)
+        self.steps += 1
+
+    # Kinetic plus potential energy per unit mass summed over bodies, in a static field (for
+    # checking the integrator: it should oscillate, not drift)
+    def field_energy(self):
+        sources, gm = self.field(self.time)
+        d = self.positions[:, None, :] - sources[None, :, :]
+        r = np.sqrt(np.einsum("ijk,ijk->ij", d, d) + self.field_softening ** 2)
+        return float(0.5 * np.einsum("ij,ij->", self.velocities, self.velocities) - (gm[None, :] / r).sum())
+
+
+# Accuracy and speed of the octree against direct summation:
+# python nbody.py --bodies 50000 --theta 0.5
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare Barnes-Hut and direct-sum gravity")
+    parser.add_argument("--bodies", type=int, default=50000)
+    parser.add_argument("--theta", type=float, default=0.5)
+    parser.add_argument("--softening", type=float, default=0.05)
+    parser.add_argument("--sample", type=int, default=2000, help="bodies checked against direct summation")
+    parser.add_argument("--orbits", type=int, default=20, help="Kepler orbits for the energy check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    radius = rng.uniform(10, 11, args.bodies)
+    angle = rng.uniform(0, 2 * math.pi, args.bodies)
+    positions = np.stack([radius * np.cos(angle), rng.normal(0, 0.1, args.bodies), radius * np.sin(angle)], axis=1)
+    gm = rng.uniform(0.5, 1.5, args.bodies) * 1e-6
+
+    start = time.perf_counter()
+    tree = Octree(positions, gm)
+    built = time.perf_counter()
+    approximate = tree.accelerations(args.theta, args.softening)
+    walked = time.perf_counter()
+    print(f"{args.bodies} bodies: octree of {len(tree.mass)} nodes in {tree.levels} levels, "
+          f"built in {(built - start) * 1000:.1f} ms, walked in {(walked - built) * 1000:.1f} ms")
+
+    sample = rng.choice(args.bodies, min(args.sample, args.bodies), replace=False)
+    start = time.perf_counter()
+    exact = np.zeros((len(sample), 3))
+    for i, body in enumerate(sample):
+        exact[i] = direct_accelerations(positions[body:body + 1], np.delete(positions, body, axis=0),
+                                        np.delete(gm, body), args.softening)[0]
+    direct_ms = (time.perf_counter() - start) * 1000 * args.bodies / len(sample)
+    # Per-body error relative to the body's own force, and to the RMS force (in a ring most
+    # forces nearly cancel, which inflates the first)
+    difference = np.linalg.norm(approximate[sample] - exact, axis=1)
+    magnitude = np.linalg.norm(exact, axis=1)
+    error, rms_error = difference / magnitude, difference / np.sqrt(np.mean(magnitude ** 2))
+    print(f"direct summation for all bodies: ~{direct_ms:.0f} ms; relative error median "
+          f"{np.median(error):.2e}, 99th percentile {np.percentile(error, 99):.2e}; "
+          f"relative to RMS force median {np.median(rms_error):.2e}, max {rms_error.max():.2e}")
+
+    # Energy of eccentric orbits around a fixed unit point mass over args.orbits periods
+    sun = (np.zeros((1, 3)), np.ones(1))
+    bodies = NBody([[1.0, 0, 0]], [[0, 0, 1.2]], [0.0], lambda t: sun, field_softening=0.0)
+    period = 2 * math.pi * (1 / (2 - 1.2 ** 2)) ** 1.5
+    dt = period / 200
+    energy = bodies.field_energy()
+    energies = []
+    for _ in range(args.orbits * 200):
+        bodies.step(dt)
+        energies.append(bodies.field_energy())
+    print(f"leapfrog, e=0.44 orbit, 200 steps per period: energy error max "
+          f"{np.max(np.abs(np.array(energies) - energy)) / abs(energy):.2e} over {args.orbits} orbits, "
+          f"{abs(energies[-1] - energy) / abs(energy):.2e} at the end")
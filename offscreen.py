@@ -0,0 +1,131 @@
+import ctypes
+import os
+
+# PyOpenGL picks its platform when OpenGL is first imported, so this module has to be imported
+# before anything else touches OpenGL. EGL with a surfaceless display needs no window system or
+# GPU (Mesa falls back to llvmpipe); set PYOPENGL_PLATFORM=osmesa to use OSMesa instead.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+if os.environ["PYOPENGL_PLATFORM"] == "egl":
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION import GL_1_0 as raw  # glReadPixels into a bound pack buffer
+
+from renderer import Framebuffer  # Lives with the renderer so windowed code can use it too
+
+
+# Create and make current an offscreen desktop-GL context (fixed-function pipeline available).
+# The default framebuffer is tiny: rendering goes to a Framebuffer object of any size.
+def create_context(width=16, height=16):
+    if os.environ["PYOPENGL_PLATFORM"] == "osmesa":
+        return create_osmesa_context(width, height)
+    return create_egl_context(width, height)
+
+
+def create_egl_context(width=16, height=16):
+    from OpenGL.raw.EGL import _errors
+
+    if not hasattr(_errors, "_error_checker"):  # Missing in PyOpenGL when ERROR_CHECKING is off
+        _errors._error_checker = None
+    from OpenGL import EGL
+
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    if not EGL.eglInitialize(display, None, None):
+        raise RuntimeError("Could not initialize an EGL display")
+    attributes = (EGL.EGLint * 13)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+        EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE)
+    config = EGL.EGLConfig()
+    count = EGL.EGLint()
+    EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+    if count.value == 0:
+        raise RuntimeError("No EGL config with desktop OpenGL and a depth buffer")
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    surface_attributes = (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE)
+    surface = EGL.eglCreatePbufferSurface(display, config, surface_attributes)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not context or not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("Could not create an EGL OpenGL context")
+    return display, surface, context
+
+
+def create_osmesa_context(width=16, height=16):
+    from OpenGL import arrays, osmesa
+
+    context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    if not context:
+        raise RuntimeError("Could not create an OSMesa context")
+    buffer = arrays.GLubyteArray.zeros((height, width, 4))
+    if not osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, width, height):
+        raise RuntimeError("Could not make the OSMesa context current")
+    return context, buffer
+
+
+# Release a context returned by create_context(), on the thread it is current on
+def destroy_context(handle):
+    if os.environ["PYOPENGL_PLATFORM"] == "osmesa":
+        from OpenGL import osmesa
+
+        osmesa.OSMesaDestroyContext(handle[0])
+        return
+    from OpenGL import EGL
+
+    display, surface, context = handle
+    EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+    EGL.eglDestroySurface(display, surface)
+    EGL.eglDestroyContext(display, context)
+
+
+# Asynchronous readback through a ring of pixel buffer objects. read() starts a glReadPixels
+# into the next buffer and returns immediately; the pixels come back count - 1 frames later,
+# once the GL has finished them, so the CPU never waits for the frame it just submitted.
+class PixelReader:
+    def __init__(self, width, height, count=3):
+        self.width, self.height = width, height
+        self.size = width * height * 4
+        self.buffers = [glGenBuffers(1) for _ in range(count)]
+        self.tags = [None] * count
+        self.index = 0
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    # Queue a read of the bound read framebuffer, labelled tag. Returns (tag, pixels) for the read
+    # queued count - 1 calls ago, or None while the ring is filling up.
+    def read(self, tag):
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[self.index])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        raw.glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        self.tags[self.index] = tag
+        self.index = (self.index + 1) % len(self.buffers)
+        result = self.collect(self.index)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return result
+
+    # Remaining (tag, pixels) pairs, oldest first
+    def flush(self):
+        results = []
+        for offset in range(len(self.buffers)):
+            result = self.collect((self.index + offset) % len(self.buffers))
+            if result:
+                results.append(result)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return results
+
+    # Map one buffer and copy out its pixels: (height, width, 4) RGBA, bottom row first
+    def collect(self, index):
+        tag = self.tags[index]
+        if tag is None:
+            return None
+        self.tags[index] = None
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.size, GL_MAP_READ_BIT)
+        pixels = np.ctypeslib.as_array((ctypes.c_ubyte * self.size).from_address(pointer)).copy()
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        return tag, pixels.reshape(self.height, self.width, 4)
+
+    def delete(self):
+        glDeleteBuffers(len(self.buffers), self.buffers)
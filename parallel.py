@@ -0,0 +1,283 @@
+import multiprocessing
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Parallel update engine for the closed-form parts of SolarSystem: asteroids, stars and comets are
+# split into contiguous shards, one per worker process, and each worker writes its shard's
+# rendered arrays straight into shared memory. There are two sets of shared arrays. The renderer
+# draws from the front set (the system's arrays point into it, so nothing is copied) while the
+# workers fill the back set with the next frame; interpolate() swaps them.
+#
+# Rendered state: (group, attribute, dtype, shape of one body) for each shared array
+FIELDS = (
+    ("asteroids", "positions", np.float32, (3,)),
+    ("stars", "positions", np.float32, (3,)),
+    ("comets", "position", np.float64, (3,)),
+    ("comets", "velocity", np.float64, (3,)),
+    ("comets", "trail", np.float32, None),  # (trail_length, 3)
+    ("comets", "trail_count", np.int32, ()),
+)
+ALIGNMENT = 64  # Each array starts on its own cache line
+
+
+# One set of rendered arrays in a single shared memory block. Created by the main process
+# (name=None) and attached to by name in the workers.
+class SharedArrays:
+    def __init__(self, counts, trail_length, name=None):
+        layout = []
+        size = 0
+        for group, attribute, dtype, shape in FIELDS:
+            shape = (counts[group],) + ((trail_length, 3) if shape is None else shape)
+            layout.append(((group, attribute), dtype, shape, size))
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // ALIGNMENT) * ALIGNMENT
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.arrays = {key: np.ndarray(shape, dtype, self.memory.buf, offset)
+                       for key, dtype, shape, offset in layout}
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self, unlink=False):
+        self.arrays = {}  # Views must go before the mapping can be closed
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+# Contiguous (start, stop) ranges splitting count bodies over workers
+def shard_ranges(count, workers):
+    bounds = np.linspace(0, count, workers + 1).round().astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# Worker process: steps its own asteroid, star and comet shards and renders them into the buffer
+# each job names. Jobs are ("step", frames, alpha, buffer), ("seek", frame, alpha, buffer) or
+# None to exit; every job is answered with None, or a traceback string if it failed.
+def worker(connection, shards, ranges, names, counts, trail_length):
+    buffers = [SharedArrays(counts, trail_length, name) for name in names]
+    asteroids, stars, comets = shards
+    arrays = None
+    try:
+        while True:
+            job = connection.recv()
+            if job is None:
+                break
+            try:
+                command, frames, alpha, index = job
+                arrays = buffers[index].arrays
+                if command == "step":
+                    asteroids.time += frames
+                    stars.time += frames
+                    comets.update(frames)
+                else:
+                    asteroids.time = stars.time = frames
+                    comets.seek(frames)
+                # Asteroids and stars are written in place; the comet swarm keeps its private
+                # ring buffer, and its shard (a few kilobytes per comet) is copied across
+                start, stop = ranges["asteroids"]
+                asteroids.positions = arrays["asteroids", "positions"][start:stop]
+                asteroids.update_positions(alpha)
+                start, stop = ranges["stars"]
+                stars.positions = arrays["stars", "positions"][start:stop]
+                stars.update_positions()
+                start, stop = ranges["comets"]
+                comets.update_positions(alpha)
+                for attribute in ("position", "velocity", "trail", "trail_count"):
+                    arrays["comets", attribute][start:stop] = getattr(comets, attribute)
+                connection.send(None)
+            except Exception:
+                connection.send(traceback.format_exc())
+    finally:
+        arrays = asteroids.positions = stars.positions = None
+        for buffer in buffers:
+            buffer.close()
+
+
+# Drives a SolarSystem in place of system.step()/interpolate(), so FixedTimestep(stepper) works
+# unchanged. step() only records the frames owed; interpolate() starts computing them and hands
+# the renderer the previous result, so simulation frame N+1 computes while frame N is drawn. The
+# displayed state (system.frame, system.alpha) is therefore one call behind stepper.frame;
+# pipelined=False waits for each result instead, trading the overlap for no latency.
+#
+# workers=0, gravity mode (the bodies interact, so they cannot be sharded) and systems without
+# shared memory fall back to calling the system directly. close() stops the workers and leaves
+# the system at stepper.frame with private arrays again.
+class ParallelStepper:
+    def __init__(self, system, workers=None, pipelined=True):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.system = system
+        self.pipelined = pipelined
+        self.workers = workers if system.gravity is None else 0
+        self.processes = []
+        self.connections = []
+        self.buffers = []
+        self.front = 1
+        self.frame = system.frame  # Frame the simulation has been stepped to, displayed or not
+        self.job = None  # (frame, alpha, trail head) being computed into the back buffer
+        self.shown = None  # (frame, alpha, trail head) of the front buffer
+        if self.workers:
+            try:
+                self.start()
+            except OSError as error:  # No /dev/shm, process limits
+                print("Parallel update unavailable, stepping serially:", error)
+                self.close()
+                self.workers = 0
+
+    def start(self):
+        system = self.system
+        comets = system.comets
+        counts = {"asteroids": system.asteroids.count, "stars": system.stars.count, "comets": comets.count}
+        self.buffers = [SharedArrays(counts, comets.trail_length) for _ in range(2)]
+        names = [buffer.name for buffer in self.buffers]
+        shards = {group: shard_ranges(count, self.workers) for group, count in counts.items()}
+        # fork starts the workers without re-running the main script (solar_system.py has no
+        # __main__ guard); elsewhere spawn pickles the shards across
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        for k in range(self.workers):
+            ranges = {group: shards[group][k] for group in counts}
+            parts = (system.asteroids.shard(*ranges["asteroids"]), system.stars.shard(*ranges["stars"]),
+                     comets.shard(*ranges["comets"]))
+            parent, child = context.Pipe()
+            process = context.Process(target=worker, args=(child, parts, ranges, names, counts,
+                                                           comets.trail_length), daemon=True)
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.connections.append(parent)
+        self.run("seek", self.frame, system.alpha, 0)
+        self.collect()
+
+    @property
+    def parallel(self):
+        return bool(self.processes)
+
+    def step(self, n=1):
+        if not self.parallel:
+            self.system.step(n)
+        else:
+            self.frame += n
+
+    def interpolate(self, alpha):
+        if not self.parallel:
+            self.system.interpolate(alpha)
+            return
+        if self.pipelined:
+            self.collect()
+        if (self.frame, alpha) != self.shown[:2]:
+            shown = self.shown[0]
+            head = (self.system.comets.trail_head + self.frame - shown) % self.system.comets.trail_length
+            self.run("step", self.frame - shown, alpha, head)
+        if not self.pipelined:
+            self.collect()
+
+    # Jump to any whole frame; waits for the result, so the next draw shows it
+    def seek(self, frame):
+        if not self.parallel:
+            self.system.seek(frame)
+            return
+        self.collect()
+        self.frame = frame
+        self.run("seek", frame, 0.0, 0)
+        self.collect()
+
+    # Send one job for the back buffer to every worker. Steps are relative to the displayed frame,
+    # which is where the workers' shards stand once the previous job is collected.
+    def run(self, command, frames, alpha, head):
+        frame = frames if command == "seek" else self.shown[0] + frames
+        for connection in self.connections:
+            connection.send((command, frames, alpha, 1 - self.front))
+        self.job = (frame, alpha, head)
+
+    # Wait for the job in flight, then swap buffers and point the system's arrays at the new front
+    def collect(self):
+        if self.job is None:
+            return
+        errors = [connection.recv() for connection in self.connections]
+        for error in errors:
+            if error:
+                raise RuntimeError("Parallel update failed in a worker:\n" + error)
+        self.front = 1 - self.front
+        self.shown, self.job = self.job, None
+        self.publish(self.buffers[self.front].arrays, *self.shown)
+
+    def publish(self, arrays, frame, alpha, head):
+        system = self.system
+        for (group, attribute), array in arrays.items():
+            setattr(getattr(system, group), attribute, array)
+        system.asteroids.time = system.stars.time = system.comets.time = frame
+        system.comets.trail_head = head
+        system.frame = frame
+        system.alpha = alpha
+
+    # Stop the workers and bring the system to self.frame on its own arrays
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self.buffers and self.shown:
+            self.publish({key: array.copy() for key, array in self.buffers[self.front].arrays.items()},
+                         *self.shown)
+            alpha = self.system.alpha
+            self.system.seek(self.frame)
+            self.system.interpolate(alpha)
+        for buffer in self.buffers:
+            buffer.close(unlink=True)
+        self.processes, self.connections, self.buffers = [], [], []
+
+
+# Speed-up versus worker count: python parallel.py --asteroids 1000000 --workers 0 1 2 4
+if __name__ == "__main__":
+    import argparse
+
+    from simulation import SolarSystem
+
+    parser = argparse.ArgumentParser(description="Time the parallel update engine against worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="0 steps serially")
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--asteroids", type=int, default=1000000)
+    parser.add_argument("--stars", type=int, default=100000)
+    parser.add_argument("--comets", type=int, default=3000)
+    parser.add_argument("--draw-ms", type=float, default=0.0,
+                        help="sleep this long per frame to stand in for rendering")
+    parser.add_argument("--no-pipeline", action="store_true", help="wait for each update before drawing")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{multiprocessing.cpu_count()} CPUs, {args.asteroids} asteroids, {args.stars} stars, "
+          f"{args.comets} comets, {args.draw_ms:g} ms draw")
+    print(f"{'workers':>7} {'ms/frame':>9} {'speed-up':>9}")
+    baseline = None
+    for workers in args.workers:
+        system = SolarSystem(num_asteroids=args.asteroids, num_stars=args.stars, num_comets=args.comets,
+                             seed=args.seed)
+        stepper = ParallelStepper(system, workers, pipelined=not args.no_pipeline)
+        try:
+            for _ in range(10):  # Warm up
+                stepper.step(1)
+                stepper.interpolate(0.5)
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                stepper.step(1)
+                stepper.interpolate(0.5)
+                if args.draw_ms:
+                    time.sleep(args.draw_ms / 1000)
+            elapsed = (time.perf_counter() - start) / args.steps * 1000
+        finally:
+            stepper.close()
+        baseline = baseline or elapsed
+        print(f"{workers:>7} {elapsed:>9.2f} {baseline / elapsed:>8.2f}x")
@@ -0,0 +1,178 @@
+import csv
+import json
+import time
+from collections import deque
+
+import renderer
+
+
+# Per-stage frame timer. The main loop calls begin_frame(), then stage(name) at the start of each
+# stage (event pumping, update, each draw group, flip...) and end_frame(). A stage runs until the
+# next stage() call, so each boundary costs one perf_counter() call. The counters in
+# renderer.frame_stats (draw calls, state changes) are charged to the stage that was running and
+# zeroed at every boundary.
+#
+# sync=True calls glFinish() at each boundary so GPU work is charged to the stage that issued it
+# instead of to whichever stage next blocks on the driver (usually flip). It stalls the pipeline,
+# so only use it while hunting for the expensive stage.
+class FrameProfiler:
+    def __init__(self, history=120, sync=False, counters=renderer.frame_stats):
+        self.history = deque(maxlen=history)  # Most recent per-frame records, for the HUD
+        self.sync = sync
+        self.counters = counters
+        self.frame = 0
+        self.log = None
+        self.record = None
+        self.current = None
+        self.notes = []  # Names of per-frame values recorded with note()
+
+    def begin_frame(self):
+        self.record = {"frame": self.frame}
+        self.current = None
+        for key in self.counters:
+            self.counters[key] = 0
+        self.frame_start = self.stage_start = time.perf_counter()
+
+    def stage(self, name):
+        self.stage_start = self.close_stage()
+        self.current = name
+
+    # Store a per-frame value (for example the render scale) in the frame's record, averaged and
+    # logged like the stage times
+    def note(self, name, value):
+        if name not in self.notes:
+            self.notes.append(name)
+        self.record[name] = value
+
+    def end_frame(self):
+        now = self.close_stage()
+        self.current = None
+        self.record["total_ms"] = (now - self.frame_start) * 1000
+        self.history.append(self.record)
+        if self.log:
+            self.log.write(self.record)
+        self.frame += 1
+
+    # Charge the time and counters since the last boundary to the running stage. A stage that is
+    # entered twice in a frame accumulates.
+    def close_stage(self):
+        if self.sync:
+            renderer.glFinish()
+        now = time.perf_counter()
+        if self.current is not None:
+            record, name = self.record, self.current
+            record[name + "_ms"] = record.get(name + "_ms", 0) + (now - self.stage_start) * 1000
+            for key, value in self.counters.items():
+                record[f"{name}_{key}"] = record.get(f"{name}_{key}", 0) + value
+                self.counters[key] = 0
+        return now
+
+    # Stage names in the order they ran in the last frame
+    def stages(self):
+        if not self.history:
+            return []
+        return [key[:-3] for key in self.history[-1] if key.endswith("_ms") and key != "total_ms"]
+
+    # Sum of one counter (e.g. "draw_calls") over every stage of a record (default: last frame)
+    def total(self, counter, record=None):
+        record = record if record is not None else self.history[-1]
+        return sum(record.get(f"{name}_{counter}", 0) for name in self.stages())
+
+    # Mean of every record field over the rolling history
+    def averages(self):
+        sums = {}
+        for record in self.history:
+            for key, value in record.items():
+                sums[key] = sums.get(key, 0) + value
+        return {key: value / len(self.history) for key, value in sums.items()}
+
+    # Stream every following frame's record to path (.csv, otherwise a JSON array)
+    def open_log(self, path):
+        self.close()
+        self.log = CsvLog(path) if path.endswith(".csv") else JsonLog(path)
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+
+# One row per frame. Columns come from the first record; stages that first appear later (for
+# example the HUD once it is switched on) are left out, missing ones are written as 0.
+class CsvLog:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = None
+
+    def write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, list(record), restval=0, extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+
+# A JSON array written one record at a time, so a long run never holds all frames in memory
+class JsonLog:
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.separator = "[\n"
+
+    def write(self, record):
+        self.file.write(self.separator + json.dumps(record))
+        self.separator = ",\n"
+
+    def close(self):
+        self.file.write("[]\n" if self.separator == "[\n" else "\n]\n")
+        self.file.close()
+
+
+# Rolling text overlay with the averaged frame time and the per-stage breakdown. The text is only
+# re-rasterized every refresh frames; in between the cached pixels are blitted with one
+# glDrawPixels call.
+class ProfilerHud:
+    def __init__(self, profiler, refresh=15, font_size=18):
+        import pygame
+
+        pygame.font.init()
+        self.pygame = pygame
+        self.profiler = profiler
+        self.refresh = refresh
+        self.font = pygame.font.SysFont("monospace", font_size)  # Default font if none installed
+        self.pixels = None
+
+    def lines(self):
+        averages = self.profiler.averages()
+        total = averages.get("total_ms", 0)
+        lines = [f"frame {total:6.2f} ms  {1000 / total if total else 0:6.1f} fps"]
+        lines += [f"{name:<10}{averages.get(name, 0):6.2f}" for name in self.profiler.notes]
+        for name in self.profiler.stages():
+            lines.append(f"{name:<10}{averages.get(name + '_ms', 0):6.2f} ms"
+                         f"{averages.get(name + '_draw_calls', 0):5.0f} draws"
+                         f"{averages.get(name + '_state_changes', 0):5.0f} states"
+                         f"{averages.get(name + '_redundant_state', 0):5.0f} saved")
+        return lines
+
+    def render_text(self):
+        pygame = self.pygame
+        rendered = [self.font.render(line, True, (255, 255, 255)) for line in self.lines()]
+        width = max(surface.get_width() for surface in rendered) + 12
+        height = sum(surface.get_height() for surface in rendered) + 12
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        y = 6
+        for surface in rendered:
+            panel.blit(surface, (6, y))
+            y += surface.get_height()
+        self.size = (width, height)
+        self.pixels = pygame.image.tostring(panel, "RGBA", True)  # Bottom row first, as GL wants
+
+    def draw(self, viewport):
+        if not self.profiler.history:
+            return
+        if self.pixels is None or self.profiler.frame % self.refresh == 0:
+            self.render_text()
+        width, height = self.size
+        renderer.draw_overlay(self.pixels, width, height, 8, viewport[1] - height - 8)
@@ -0,0 +1,194 @@
+import json
+import math
+import struct
+
+import numpy as np
+
+from simulation import SolarSystem
+
+# Session recordings: one memory-mapped file holding a header and a run of fixed-size blocks. A
+# block is a keyframe (the complete SolarSystem.state() at a whole frame) followed by
+# keyframe_interval frame records. A record is what changes per rendered frame: the simulation
+# frame it shows, the interpolation alpha and the camera. Stepping is deterministic, so a record's
+# state is its block's keyframe stepped forward to the record's frame, bit for bit.
+#
+# Blocks all have the same size, so any record is found by arithmetic, and seeking costs one
+# keyframe restore plus at most keyframe_interval records of stepping, however long the session.
+# Neither side holds more than the pages it touches in memory.
+#
+# Layout: MAGIC, record count and header length (little-endian uint64), the JSON header, then
+# blocks from the next multiple of ALIGNMENT.
+MAGIC = b"SOLREC01"
+ALIGNMENT = 4096
+RECORD = np.dtype([("frame", "<i8"), ("alpha", "<f8"), ("camera", "<f8", (3,))])
+
+
+# Structured dtype of one block for a state dict layout [(name, dtype, shape), ...]
+def block_dtype(fields, keyframe_interval):
+    keyframe = np.dtype([(name, dtype, tuple(shape)) for name, dtype, shape in fields])
+    return np.dtype([("keyframe", keyframe), ("records", RECORD, (keyframe_interval,))])
+
+
+# Records rendered frames of system. Call record(camera) once per drawn frame, after the system has
+# been stepped and interpolated; camera is (rot_x, rot_y, distance). The system must step its own
+# comets and bodies, not through parallel.ParallelStepper's workers.
+class Recorder:
+    def __init__(self, path, system, keyframe_interval=300, blocks_per_chunk=16):
+        self.path = path
+        self.system = system
+        self.keyframe_interval = keyframe_interval
+        self.blocks_per_chunk = blocks_per_chunk
+        state = system.state()
+        self.fields = [(name, np.asarray(value).dtype.str, np.shape(value)) for name, value in state.items()]
+        self.dtype = block_dtype(self.fields, keyframe_interval)
+        header = json.dumps({"config": system.config, "scene_digest": system.scene_digest,
+                             "keyframe_interval": keyframe_interval, "fields": self.fields}).encode()
+        self.offset = -(-(len(MAGIC) + 16 + len(header)) // ALIGNMENT) * ALIGNMENT
+        with open(path, "wb") as f:
+            f.write(MAGIC + struct.pack("<QQ", 0, len(header)) + header)
+            f.truncate(self.offset)
+        self.count_field = np.memmap(path, np.uint64, "r+", len(MAGIC), (1,))
+        self.count = 0
+        self.blocks = None
+        self.capacity = 0
+
+    # Extend the file by blocks_per_chunk blocks and map it again
+    def grow(self):
+        if self.blocks is not None:
+            self.blocks.flush()
+        self.capacity += self.blocks_per_chunk
+        with open(self.path, "r+b") as f:
+            f.truncate(self.offset + self.capacity * self.dtype.itemsize)
+        self.blocks = np.memmap(self.path, self.dtype, "r+", self.offset, (self.capacity,))
+
+    def record(self, camera):
+        block, slot = divmod(self.count, self.keyframe_interval)
+        if block >= self.capacity:
+            self.grow()
+        if slot == 0:
+            keyframes = self.blocks["keyframe"]
+            for name, value in self.system.state().items():
+                keyframes[name][block] = value
+        self.blocks["records"][block, slot] = (self.system.frame, self.system.alpha, camera)
+        self.count += 1
+        self.count_field[0] = self.count  # Readable up to here even if the session crashes
+
+    def close(self):
+        if self.blocks is None:
+            return
+        self.blocks.flush()
+        self.count_field.flush()
+        self.blocks = self.count_field = None
+        used = math.ceil(self.count / self.keyframe_interval)
+        with open(self.path, "r+b") as f:
+            f.truncate(self.offset + used * self.dtype.itemsize)
+
+
+# Plays a recording back on a fresh SolarSystem built from its header (replayer.system), refusing
+# one whose scene file has changed since it was recorded.
+# seek(index) puts the system in the state of record index and returns its camera. Moving
+# forward within reach of the current state steps on from it instead of restoring a keyframe, so
+# playing records in order costs what the live session did.
+class Replayer:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a session recording")
+            count, header_length = struct.unpack("<QQ", f.read(16))
+            header = json.loads(f.read(header_length))
+        self.count = count
+        self.keyframe_interval = header["keyframe_interval"]
+        self.system = SolarSystem(**header["config"])
+        if self.system.scene_digest != header.get("scene_digest"):
+            raise ValueError(f"{path}: scene file {header['config']['scene']} changed since the recording")
+        dtype = block_dtype(header["fields"], self.keyframe_interval)
+        offset = -(-(len(MAGIC) + 16 + header_length) // ALIGNMENT) * ALIGNMENT
+        blocks = math.ceil(count / self.keyframe_interval)
+        self.blocks = np.memmap(path, dtype, "r", offset, (blocks,)) if blocks else None
+        self.names = [name for name, _, _ in header["fields"]]
+        self.index = None  # Record the system is at, or None before the first seek
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        block, slot = divmod(index, self.keyframe_interval)
+        return self.blocks["records"][block, slot]
+
+    def seek(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(f"record {index} outside a recording of {self.count}")
+        block = index // self.keyframe_interval
+        record = self.record(index)
+        frame = int(record["frame"])
+        keyframes = self.blocks["keyframe"]
+        if self.index is None or not int(keyframes["frame"][block]) <= self.system.frame <= frame:
+            self.system.load_state({name: keyframes[name][block] for name in self.names})
+        if frame > self.system.frame:
+            self.system.step(frame - self.system.frame)
+        self.system.interpolate(float(record["alpha"]))
+        self.index = index
+        return tuple(record["camera"].tolist())
+
+
+# Record a synthetic session, then check and time random seeks:
+# python recording.py session.rec --records 216000 --comets 300
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from camera import flyby
+
+    parser = argparse.ArgumentParser(description="Record a scripted session and time seeks in it")
+    parser.add_argument("path")
+    parser.add_argument("--records", type=int, default=216000, help="rendered frames (216000 is an hour at 60 fps)")
+    parser.add_argument("--keyframe-interval", type=int, default=300)
+    parser.add_argument("--asteroids", type=int, default=100)
+    parser.add_argument("--stars", type=int, default=1000)
+    parser.add_argument("--comets", type=int, default=3)
+    parser.add_argument("--gravity", action="store_true")
+    parser.add_argument("--seeks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Frames per rendered frame vary like a real session: mostly 1x, with pauses and bursts
+    rng = np.random.default_rng(args.seed)
+    steps = rng.choice([0, 1, 1, 1, 2, 10], args.records)
+    alphas = rng.random(args.records)
+    checks = set(rng.choice(args.records, min(args.seeks, args.records), replace=False).tolist())
+    system = SolarSystem(num_asteroids=args.asteroids, num_stars=args.stars, num_comets=args.comets,
+                         seed=args.seed, gravity=args.gravity)
+    recorder = Recorder(args.path, system, args.keyframe_interval)
+    expected = {}
+    start = time.perf_counter()
+    for index in range(args.records):
+        if steps[index]:
+            system.step(int(steps[index]))
+        system.interpolate(alphas[index])
+        recorder.record(flyby(index))
+        if index in checks:
+            trails = system.comets.ordered_trails()
+            expected[index] = (system.asteroids.positions.copy(), system.comets.position.copy(),
+                               [trail[trail.shape[0] - count:] for trail, count in
+                                zip(trails, system.comets.trail_count)])
+    recorder.close()
+    elapsed = time.perf_counter() - start
+    print(f"Recorded {args.records} frames (simulation frame {system.frame}) in {elapsed:.1f} s")
+
+    replayer = Replayer(args.path)
+    times = []
+    for index in rng.permutation(sorted(checks)).tolist():
+        start = time.perf_counter()
+        camera = replayer.seek(index)
+        times.append(time.perf_counter() - start)
+        positions, heads, trails = expected[index]
+        replayed = replayer.system.comets.ordered_trails()
+        if (camera != tuple(flyby(index)) or not np.array_equal(replayer.system.asteroids.positions, positions)
+                or not np.array_equal(replayer.system.comets.position, heads)
+                or not all(np.array_equal(trail[trail.shape[0] - len(valid):], valid)
+                           for trail, valid in zip(replayed, trails))):
+            raise SystemExit(f"Replay differs from the recording at record {index}")
+    times = np.array(times) * 1000
+    print(f"{len(times)} random seeks matched the recording exactly: median {np.median(times):.2f} ms, "
+          f"max {times.max():.2f} ms")
@@ -0,0 +1,628 @@
+import math
+import numpy as np
+
+from OpenGL.GL import *
+from OpenGL.GLU import *
+
+import camera
+
+# Per-frame counters, cleared by reset_frame_stats() (draw_scene does this every frame).
+# state_changes stays 0 unless count_state_changes() is on; redundant_state counts the calls
+# set_state() skipped because the state was already set.
+frame_stats = {"draw_calls": 0, "texture_binds": 0, "state_changes": 0, "redundant_state": 0}
+
+
+def reset_frame_stats():
+    for key in frame_stats:
+        frame_stats[key] = 0
+
+
+# GL calls that change pipeline state, counted by count_state_changes()
+STATE_FUNCTIONS = ("glEnable", "glDisable", "glEnableClientState", "glDisableClientState",
+                   "glBindBuffer", "glBindTexture", "glVertexPointer", "glColorPointer", "glPointSize",
+                   "glPointParameterf", "glPointParameterfv", "glMaterialfv")
+
+
+# Count state changes made by this module in frame_stats. The GL functions are wrapped in this
+# module's namespace only, so there is no cost while counting is off.
+def count_state_changes(enabled=True):
+    import OpenGL.GL
+
+    for name in STATE_FUNCTIONS:
+        function = getattr(OpenGL.GL, name)
+        if enabled:
+            def counted(*args, function=function):
+                frame_stats["state_changes"] += 1
+                return function(*args)
+            globals()[name] = counted
+        else:
+            globals()[name] = function
+
+
+# Fixed-function state as last set through set_state(); missing entries are unknown and are
+# always issued. Draw functions below expect their state from the caller (see the state sets
+# further down), so a sorted RenderQueue only changes what differs between neighbours.
+current_state = {}
+
+STATE_CAPABILITIES = {"lighting": GL_LIGHTING, "depth_test": GL_DEPTH_TEST, "texture": GL_TEXTURE_2D,
+                      "blend": GL_BLEND}
+
+
+# Set named state, issuing GL calls only for values that differ from the current ones:
+# lighting / depth_test / texture / blend (bool), color (tuple), material ((specular, shininess))
+# and point_size
+def set_state(**state):
+    for name, value in state.items():
+        if name in current_state and current_state[name] == value:
+            frame_stats["redundant_state"] += 1
+            continue
+        current_state[name] = value
+        if name in STATE_CAPABILITIES:
+            if value:
+                glEnable(STATE_CAPABILITIES[name])
+            else:
+                glDisable(STATE_CAPABILITIES[name])
+        elif name == "color":
+            glColor4fv(value) if len(value) == 4 else glColor3fv(value)
+        elif name == "material":
+            glMaterialfv(GL_FRONT, GL_SPECULAR, value[0])
+            glMaterialfv(GL_FRONT, GL_SHININESS, value[1])
+        elif name == "point_size":
+            glPointSize(value)
+        else:
+            raise ValueError(f"Unknown state {name!r}")
+
+
+# Mark state as unknown after GL calls that bypass set_state() (another module, glColor inside
+# glBegin, color arrays). With no names, forget everything, bound textures included.
+def forget_state(*names):
+    if names:
+        for name in names:
+            current_state.pop(name, None)
+    else:
+        current_state.clear()
+        forget_bound_texture()
+
+
+# State sets used by draw_scene. Everything is opaque and depth tested except the star
+# background (drawn first, without depth) and blended comet trails (drawn last).
+BACKGROUND = {"lighting": False, "depth_test": False, "blend": False, "texture": False}
+UNLIT = {"lighting": False, "depth_test": True, "blend": False, "texture": False}
+LIT = {"lighting": True, "depth_test": True, "blend": False}  # Spheres set texture themselves
+TRANSLUCENT = {"lighting": False, "depth_test": True, "blend": True, "texture": False}
+SPHERE_MATERIAL = ((0.5, 0.5, 0.5, 1), 20)
+
+
+# Draw requests for one frame. execute() runs them grouped by layer and then by the state they
+# need (blend, depth test, lighting), so set_state() only issues the changes between groups.
+# Order inside a group is the order of add().
+class RenderQueue:
+    SORT_KEYS = ("blend", "depth_test", "lighting")
+
+    def __init__(self):
+        self.items = []
+
+    def add(self, name, state, draw, *args, layer=1):
+        key = (layer,) + tuple(bool(state.get(k)) for k in self.SORT_KEYS) + (len(self.items),)
+        self.items.append((key, name, state, draw, args))
+
+    # stage(name) is called before each item (profiler.FrameProfiler.stage)
+    def execute(self, stage=None, sort=True):
+        items = sorted(self.items, key=lambda item: item[0]) if sort else self.items
+        for _, name, state, draw, args in items:
+            if stage:
+                stage(name)
+            set_state(**state)
+            draw(*args)
+        self.items = []
+
+
+# Unit-sphere display lists, built once per (slices, stacks) tessellation level
+sphere_lists = {}
+
+
+# Build (or fetch) the display list for a unit sphere at the given tessellation
+def get_sphere_list(slices=32, stacks=16):
+    key = (slices, stacks)
+    if key not in sphere_lists:
+        quadric = gluNewQuadric()
+        gluQuadricNormals(quadric, GLU_SMOOTH)
+        gluQuadricTexture(quadric, GL_TRUE)  # Texture coordinates are ignored when texturing is off
+        list_id = glGenLists(1)
+        glNewList(list_id, GL_COMPILE)
+        gluSphere(quadric, 1.0, slices, stacks)
+        glEndList()
+        gluDeleteQuadric(quadric)
+        sphere_lists[key] = list_id
+    return sphere_lists[key]
+
+
+# Draw the cached unit sphere scaled to radius (needs GL_RESCALE_NORMAL or GL_NORMALIZE for lighting)
+def draw_cached_sphere(radius, slices=32, stacks=16):
+    glPushMatrix()
+    glScalef(radius, radius, radius)
+    glCallList(get_sphere_list(slices, stacks))
+    glPopMatrix()
+    frame_stats["draw_calls"] += 1
+
+
+# Sphere levels of detail: (slices, stacks, smallest projected diameter in pixels that uses it).
+# Bodies smaller than the last threshold are drawn as points instead.
+SPHERE_LODS = ((32, 16, 64), (16, 8, 16), (8, 4, 4))
+POINT_LOD = len(SPHERE_LODS)
+
+
+# Level index per body from projected diameters in pixels (POINT_LOD for the point fallback)
+def select_lods(diameters):
+    thresholds = np.array([lod[2] for lod in SPHERE_LODS])
+    return (np.asarray(diameters)[:, None] < thresholds[None, :]).sum(axis=1)
+
+
+# Culling results from the most recent draw of each object group: name -> (drawn, culled)
+cull_stats = {}
+
+
+# Mask of bounding spheres inside the frustum (everything when planes is None); records the counts
+def cull(name, planes, centers, radii=0.0):
+    if planes is None:
+        visible = np.ones(len(centers), dtype=bool)
+    else:
+        visible = camera.spheres_visible(planes, centers, radii)
+    drawn = int(visible.sum())
+    cull_stats[name] = (drawn, len(visible) - drawn)
+    return visible
+
+
+# Draw spheres at positions with tessellation picked from their projected size. Each sphere goes
+# through draw_sphere(radius, color, texture_id, detail) so callers keep their own material setup.
+# Bodies outside the frustum planes (if given) are skipped, and bodies below the smallest level
+# are batched into one glDrawArrays of points, sized by their mean radius as the asteroid belt
+# is. Returns the level per body (-1 where culled).
+def draw_bodies(positions, radii, colors, eye, viewport_height, draw_sphere, texture_ids=None, fov=45,
+                planes=None, name="bodies"):
+    visible = cull(name, planes, positions, radii)
+    diameters = camera.projected_diameters(positions, radii, eye, viewport_height, fov)
+    levels = np.where(visible, select_lods(diameters), -1)
+    spheres = np.flatnonzero((levels >= 0) & (levels < POINT_LOD))
+    if texture_ids:
+        # Group bodies sharing a texture (untextured first) so each texture is bound once
+        spheres = sorted(spheres, key=lambda i: texture_order(texture_ids[i]))
+    for i in spheres:
+        slices, stacks, _ = SPHERE_LODS[levels[i]]
+        glPushMatrix()
+        glTranslatef(*positions[i])
+        draw_sphere(radii[i], colors[i], texture_ids[i] if texture_ids else None, (slices, stacks))
+        glPopMatrix()
+    points = levels == POINT_LOD
+    count = int(np.count_nonzero(points))
+    if count:
+        set_state(lighting=False, texture=False)
+        begin_sized_points(float(radii[points].mean()), viewport_height, fov)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        bind_buffer(f"{name}_points", np.ascontiguousarray(positions[points], dtype=np.float32))
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        bind_buffer(f"{name}_point_colors", np.ascontiguousarray(colors[points], dtype=np.float32))
+        glColorPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDrawArrays(GL_POINTS, 0, count)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        end_sized_points()
+        forget_state("color")
+        frame_stats["draw_calls"] += 1
+    return levels
+
+
+# Sort key grouping texture handles: untextured, then by texture id and atlas region
+def texture_order(texture):
+    if not texture:
+        return (0,)
+    return (1,) + (tuple(texture) if isinstance(texture, tuple) else (texture,))
+
+
+# Release all cached sphere geometry (call before the GL context goes away)
+def delete_sphere_lists():
+    for list_id in sphere_lists.values():
+        glDeleteLists(list_id, 1)
+    sphere_lists.clear()
+
+
+# Orbit-path display lists, keyed by the set of orbits they contain
+orbit_lists = {}
+
+
+# Vertices of one orbit around a focus at the origin, in the XZ plane
+# (eccentricity 0 gives a circle of radius semi_major)
+def orbit_vertices(semi_major, eccentricity=0, segments=100):
+    anomaly = np.linspace(0, 2 * math.pi, segments, endpoint=False)
+    semi_minor = semi_major * math.sqrt(1 - eccentricity ** 2)
+    vertices = np.zeros((segments, 3), dtype=np.float32)
+    vertices[:, 0] = semi_major * (np.cos(anomaly) - eccentricity)
+    vertices[:, 2] = semi_minor * np.sin(anomaly)
+    return vertices
+
+
+# Build (or fetch) one display list holding every orbit in orbits, a tuple of (semi_major, eccentricity)
+def get_orbit_list(orbits, segments=100):
+    key = (orbits, segments)
+    if key not in orbit_lists:
+        vertices = np.concatenate([orbit_vertices(a, e, segments) for a, e in orbits])
+        list_id = glGenLists(1)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, vertices)
+        glNewList(list_id, GL_COMPILE)  # Vertex arrays are copied into the list at compile time
+        for i in range(len(orbits)):
+            glDrawArrays(GL_LINE_LOOP, i * segments, segments)
+        glEndList()
+        glDisableClientState(GL_VERTEX_ARRAY)
+        orbit_lists[key] = list_id
+    return orbit_lists[key]
+
+
+# Draw a group of orbit paths (planets around the Sun, or moons inside their planet's transform)
+# with a single cached call (expects UNLIT state)
+def draw_orbits(orbits, color=(0.3, 0.3, 0.3), segments=100):
+    if not orbits:
+        return
+    set_state(color=color)
+    glCallList(get_orbit_list(orbits, segments))
+    frame_stats["draw_calls"] += 1
+
+
+# Release all cached orbit geometry
+def delete_orbit_lists():
+    for list_id in orbit_lists.values():
+        glDeleteLists(list_id, 1)
+    orbit_lists.clear()
+
+
+# Named vertex buffer objects; static buffers remember the array they were filled from
+vertex_buffers = {}
+static_sources = {}
+
+
+# Bind a named VBO, uploading data if given (static data is only re-uploaded when the array changes)
+def bind_buffer(name, data=None, static=False):
+    if name not in vertex_buffers:
+        vertex_buffers[name] = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, vertex_buffers[name])
+    if data is not None and not (static and static_sources.get(name) is data):
+        glBufferData(GL_ARRAY_BUFFER, data, GL_STATIC_DRAW if static else GL_STREAM_DRAW)
+        if static:
+            static_sources[name] = data
+        else:
+            static_sources.pop(name, None)
+
+
+# Release all named vertex buffers
+def delete_buffers():
+    if vertex_buffers:
+        glDeleteBuffers(len(vertex_buffers), list(vertex_buffers.values()))
+    vertex_buffers.clear()
+    static_sources.clear()
+
+
+# Drop every cached GL object name without deleting anything, for a new context in which the old
+# names mean nothing (streaming.NotebookStream renders each stream on a context of its own)
+def forget_gl_objects():
+    sphere_lists.clear()
+    orbit_lists.clear()
+    vertex_buffers.clear()
+    static_sources.clear()
+    forget_state()
+
+
+# Set up points whose pixel size matches a sphere of the given radius at any eye distance
+def begin_sized_points(radius, viewport_height, fov=45):
+    # Point size in pixels at distance 1; GL divides by eye distance
+    base_size = radius * viewport_height / math.tan(math.radians(fov) / 2)
+    glPointParameterfv(GL_POINT_DISTANCE_ATTENUATION, (0, 0, 1))
+    glPointParameterf(GL_POINT_SIZE_MIN, 1.0)
+    set_state(point_size=base_size)
+
+
+def end_sized_points():
+    glPointParameterfv(GL_POINT_DISTANCE_ATTENUATION, (1, 0, 0))
+
+
+# Draw the whole asteroid belt as one batch of distance-attenuated points, skipping rocks outside
+# the frustum planes if given (expects UNLIT state)
+def draw_asteroid_belt(belt, viewport_height, fov=45, planes=None):
+    if belt.count == 0:
+        return
+    positions = belt.positions
+    colors = belt.color
+    if planes is not None:
+        visible = cull("asteroids", planes, positions, belt.radius)
+        positions = positions[visible]
+        colors = colors[visible]
+    else:
+        cull("asteroids", None, positions)
+    count = len(positions)
+    if count == 0:
+        return
+    begin_sized_points(float(belt.radius.mean()), viewport_height, fov)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    bind_buffer("asteroid_positions", positions)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    # Colours never change, so the unculled array is uploaded once; culled subsets are streamed
+    bind_buffer("asteroid_colors", colors, static=planes is None)
+    glColorPointer(3, GL_FLOAT, 0, None)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glDrawArrays(GL_POINTS, 0, count)
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    end_sized_points()
+    forget_state("color")  # Undefined after drawing with a color array
+    frame_stats["draw_calls"] += 1
+
+
+# Draw the skybox stars from one vertex buffer with a single glDrawArrays call, skipping stars
+# outside the frustum planes if given (expects BACKGROUND state)
+def draw_stars(stars, point_size=2, planes=None):
+    visible = cull("stars", planes, stars.positions)
+    positions = stars.positions if planes is None else stars.positions[visible]
+    set_state(point_size=point_size, color=(1, 1, 1))
+    glEnableClientState(GL_VERTEX_ARRAY)
+    bind_buffer("star_positions", positions)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glDrawArrays(GL_POINTS, 0, len(positions))
+    glDisableClientState(GL_VERTEX_ARRAY)
+    frame_stats["draw_calls"] += 1
+
+
+# Draw every comet trail with one glMultiDrawArrays call, then all comet heads as one batch of points.
+# With frustum planes, comets whose head-and-trail bounding sphere is off-screen are skipped.
+def draw_comets(comets, viewport_height, head_radius=0.2, fov=45, planes=None):
+    batch = comet_batch(comets, head_radius, planes)
+    draw_comet_heads(batch, viewport_height, head_radius, fov)
+    draw_comet_trails(batch)
+
+
+# Visible comets as (trails, alpha, trail_count, heads), or None if there are none. draw_scene
+# computes this once and queues heads and trails separately, since trails need blending.
+def comet_batch(comets, head_radius=0.2, planes=None):
+    if comets.count == 0:
+        return None
+    trails = comets.ordered_trails()
+    alpha = comets.trail_alpha()
+    trail_count = comets.trail_count
+    heads = comets.position.astype(np.float32)
+    if planes is not None:
+        # The trail runs from the head back along the velocity for trail_count frames
+        half_span = comets.velocity * (trail_count / 2)[:, None]
+        radius = np.linalg.norm(half_span, axis=1) + head_radius
+        visible = cull("comets", planes, comets.position - half_span, radius)
+        trails, alpha, trail_count, heads = trails[visible], alpha[visible], trail_count[visible], heads[visible]
+    else:
+        cull("comets", None, heads)
+    if len(heads) == 0:
+        return None
+    return trails, alpha, trail_count, heads
+
+
+# Comet trails as one glMultiDrawArrays of line strips fading out through vertex alpha (expects
+# TRANSLUCENT state)
+def draw_comet_trails(batch):
+    if batch is None:
+        return
+    trails, alpha, trail_count, heads = batch
+    count, length = len(heads), trails.shape[1]
+    colors = np.ones((count, length, 4), dtype=np.float32)
+    colors[:, :, 3] = alpha
+    first = np.arange(count, dtype=np.int32) * length + (length - trail_count)
+    # Skip trails too short to form a line; some drivers drop the whole multi-draw on a zero count
+    strips = trail_count >= 2
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    bind_buffer("comet_trails", trails)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    bind_buffer("comet_trail_colors", colors)
+    glColorPointer(4, GL_FLOAT, 0, None)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glMultiDrawArrays(GL_LINE_STRIP, first[strips], trail_count[strips], int(strips.sum()))
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    forget_state("color")
+    frame_stats["draw_calls"] += 1
+
+
+# All comet heads as one batch of sized points (expects UNLIT state)
+def draw_comet_heads(batch, viewport_height, head_radius=0.2, fov=45):
+    if batch is None:
+        return
+    heads = batch[3]
+    begin_sized_points(head_radius, viewport_height, fov)
+    set_state(color=(1, 1, 1))
+    glEnableClientState(GL_VERTEX_ARRAY)
+    bind_buffer("comet_heads", heads)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glDrawArrays(GL_POINTS, 0, len(heads))
+    glDisableClientState(GL_VERTEX_ARRAY)
+    end_sized_points()
+    frame_stats["draw_calls"] += 1
+
+
+# Color + depth render target, so the scene can be drawn at any resolution, with or without a
+# window (offscreen.py re-exports it)
+class Framebuffer:
+    def __init__(self, width, height):
+        self.fbo = glGenFramebuffers(1)
+        self.color, self.depth = glGenRenderbuffers(2)
+        self.width = self.height = 0
+        self.resize(width, height)
+
+    def resize(self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+        self.width, self.height = width, height
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Incomplete framebuffer: 0x%x" % status)
+
+    def bind(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+
+    # Pixels as a (height, width, 3) uint8 array, top row first
+    def read_pixels(self):
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, np.uint8).reshape(self.height, self.width, 3)[::-1]
+
+    def delete(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteRenderbuffers(2, [self.color, self.depth])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+# Fixed-function state shared by every entry point: depth testing, one directional light,
+# glColor-driven materials and alpha blending (enabled per draw through set_state)
+def setup_gl_state():
+    glEnable(GL_DEPTH_TEST)
+    glEnable(GL_LIGHTING)
+    glEnable(GL_LIGHT0)
+    glEnable(GL_COLOR_MATERIAL)
+    glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)  # Allow glColor to affect material
+    glEnable(GL_RESCALE_NORMAL)  # Keep normals unit length on scaled cached spheres
+    glLightfv(GL_LIGHT0, GL_POSITION, (10, 5, 10, 0))  # Directional light
+    glLightfv(GL_LIGHT0, GL_AMBIENT, (0.2, 0.2, 0.2, 1))  # Softer ambient
+    glLightfv(GL_LIGHT0, GL_DIFFUSE, (0.7, 0.7, 0.7, 1))  # Balanced diffuse
+    glLightfv(GL_LIGHT0, GL_SPECULAR, (0.5, 0.5, 0.5, 1))  # Reduced specular
+    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    forget_state()
+
+
+# Load the perspective into the projection matrix and the orbit-camera transform into the
+# modelview matrix, so lighting, point attenuation and shaders see true eye-space coordinates
+def set_camera(rot_x, rot_y, distance, aspect, fov=45):
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(fov, aspect, 0.1, 200.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    glTranslatef(0, 0, -distance)
+    glRotatef(rot_x, 1, 0, 0)
+    glRotatef(rot_y, 0, 1, 0)
+
+
+# Draw a sphere with proper color application (expects LIT state)
+def draw_sphere(radius, color, texture_id=None, detail=(32, 16)):
+    set_state(texture=bool(texture_id), color=tuple(color), material=SPHERE_MATERIAL)
+    if texture_id:
+        bind_texture(texture_id)
+    draw_cached_sphere(radius, *detail)  # Unit-sphere display list, scaled per body
+
+
+# Texture and atlas region currently bound, so consecutive bodies sharing a texture (e.g. moons
+# in one atlas) skip the rebind
+bound_texture = [None, None]
+
+
+# Bind a texture handle: a texture id, or an (atlas id, u, v, width, height) region. Regions are
+# applied through the texture matrix, so the cached sphere lists keep their 0..1 coordinates.
+def bind_texture(texture):
+    texture_id, region = (texture[0], texture[1:]) if isinstance(texture, tuple) else (texture, None)
+    if texture_id != bound_texture[0]:
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        bound_texture[0] = texture_id
+        frame_stats["texture_binds"] += 1
+    if region != bound_texture[1]:
+        glMatrixMode(GL_TEXTURE)
+        glLoadIdentity()
+        if region:
+            glTranslatef(region[0], region[1], 0)
+            glScalef(region[2], region[3], 1)
+        glMatrixMode(GL_MODELVIEW)
+        bound_texture[1] = region
+
+
+# Call after binding textures outside bind_texture() (uploads, other tools). The texture matrix
+# is marked unknown too, so the next bind resets it.
+def forget_bound_texture():
+    bound_texture[:] = [None, "unknown"]
+
+
+# Draw one complete frame of the scene for system into the current framebuffer. Used by the
+# interactive scripts and by the offscreen tools, so they all render exactly the same thing.
+# profiler (a profiler.FrameProfiler) gets one stage per object group. With gpu_orbits (a
+# shaders.GpuOrbits) planets, moons and asteroids are placed and lit on the GPU instead, untextured
+# and unculled. With skybox (a skybox.StarSkybox) the stars come from its baked cubemaps.
+#
+# Draws go through a RenderQueue: the star background first, then opaque groups sorted so the
+# unlit ones (orbits, asteroids, comet heads) share one lighting state before the lit bodies, then
+# blended comet trails. sort_state=False keeps the submission order, to measure what sorting saves
+# (frame_stats["redundant_state"] counts the state calls that were skipped either way).
+def draw_scene(system, rot_x, rot_y, distance, viewport, orbits, draw_sphere=draw_sphere,
+               texture_ids=None, culling=True, fov=45, profiler=None, moon_textures=None,
+               gpu_orbits=None, sort_state=True, skybox=None):
+    width, height = viewport
+    aspect = width / height
+    stage = profiler.stage if profiler else skip_stage
+    stage("clear")
+    reset_frame_stats()
+    forget_state()
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    set_camera(rot_x, rot_y, distance, aspect, fov)
+
+    # Frustum planes for culling, from the same perspective and camera transform
+    planes = camera.camera_frustum(rot_x, rot_y, distance, aspect, fov) if culling else None
+
+    stage("queue")
+    queue = RenderQueue()
+    # Stars (skybox effect) and orbital paths for planets
+    if skybox:
+        queue.add("stars", BACKGROUND, skybox.draw, layer=0)
+    else:
+        queue.add("stars", BACKGROUND, draw_stars, system.stars, 2, planes, layer=0)
+    queue.add("orbits", UNLIT, draw_orbits, orbits)
+
+    # Sun, planets, and moons with tessellation picked from their on-screen size, then asteroids
+    # (from their integrated positions in gravity mode, which the shaders cannot compute)
+    if gpu_orbits:
+        queue.add("bodies", LIT, gpu_orbits.draw_bodies)
+    else:
+        eye = camera.eye_position(rot_x, rot_y, distance)
+        queue.add("bodies", LIT, draw_bodies, system.planet_positions(), system.planet_radius,
+                  system.planet_color, eye, height, draw_sphere, texture_ids, fov, planes, "planets")
+        queue.add("bodies", LIT, draw_bodies, system.moon_positions(), system.moon_radius,
+                  system.moon_color, eye, height, draw_sphere, moon_textures, fov, planes, "moons")
+    if gpu_orbits and system.gravity is None:
+        queue.add("asteroids", UNLIT, gpu_orbits.draw_asteroids, height)
+    else:
+        queue.add("asteroids", UNLIT, draw_asteroid_belt, system.asteroids, height, fov, planes)
+
+    # Comets, batched: opaque heads with the other unlit points, translucent trails last
+    comets = comet_batch(system.comets, planes=planes)
+    queue.add("comets", UNLIT, draw_comet_heads, comets, height, 0.2, fov)
+    queue.add("comets", TRANSLUCENT, draw_comet_trails, comets, layer=2)
+    queue.execute(stage, sort_state)
+
+    # Leave the default state for callers that draw on top with plain GL
+    set_state(lighting=True, depth_test=True, blend=False, texture=False)
+
+
+def skip_stage(name):
+    pass
+
+
+# Blit RGBA pixels (bottom row first) at window position (x, y) over the finished frame
+def draw_overlay(pixels, width, height, x, y):
+    set_state(lighting=False, depth_test=False, blend=True, texture=False)
+    glWindowPos2i(x, y)
+    glDrawPixels(width, height, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+    set_state(lighting=True, depth_test=True, blend=False)
+    frame_stats["draw_calls"] += 1
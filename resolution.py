@@ -0,0 +1,113 @@
+import math
+import statistics
+from collections import deque
+
+from OpenGL.GL import *
+
+import renderer
+
+# Dynamic resolution: the scene is drawn into a Framebuffer whose size follows the measured frame
+# time, then stretched over the window with one linear-filtered blit. Overlays drawn after end()
+# stay at full resolution. At full scale the scene goes straight to the window, with no blit.
+#
+# Fill cost grows with the pixel count, scale squared. Over budget, the scale drops at once to
+# what the median frame time predicts will fit. With headroom it climbs one step at a time, and
+# only while the prediction for the next step still leaves margin. Between those thresholds it
+# holds, and after each change it waits cooldown frames for the new size to settle, so it does not
+# oscillate around the target.
+#
+# The blit has a cost of its own that grows with the window size (on llvmpipe it is more than a
+# light scene costs to draw at 4K). If a reduced scale runs no faster than full scale did, the
+# scaler goes back to full scale and stays there for retry_frames, doubling after every failed
+# attempt, before trying again.
+class DynamicResolution:
+    def __init__(self, window, target_ms=1000 / 60, min_scale=0.25, max_scale=1.0, step=0.05,
+                 margin=0.9, sample_frames=30, cooldown=30, retry_frames=600, output=0):
+        self.window = window
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.step = step
+        self.margin = margin  # Fraction of the target that resizing aims for
+        self.samples = deque(maxlen=sample_frames)
+        self.cooldown = cooldown
+        self.retry_frames = retry_frames  # Doubles after each reduced scale that did not help
+        self.output = output  # Framebuffer the scene is stretched into (0 is the window)
+        self.scale = max_scale
+        self.wait = 0
+        self.full_ms = None  # Median frame time last measured at full scale
+        self.framebuffer = None
+
+    # Render size at the current scale
+    @property
+    def size(self):
+        width, height = self.window
+        return max(1, round(width * self.scale)), max(1, round(height * self.scale))
+
+    @property
+    def scaled(self):
+        return self.scale < self.max_scale
+
+    # Bind the scaled framebuffer (or the output at full scale); returns the viewport to draw with
+    def begin(self):
+        if not self.scaled:
+            glBindFramebuffer(GL_FRAMEBUFFER, self.output)
+            glViewport(0, 0, *self.window)
+            return tuple(self.window)
+        if self.framebuffer is None:
+            self.framebuffer = renderer.Framebuffer(*self.size)
+        self.framebuffer.resize(*self.size)
+        self.framebuffer.bind()
+        return self.size
+
+    # Stretch the frame over the output and leave it bound with a full-size viewport
+    def end(self):
+        if not self.scaled:
+            return
+        width, height = self.size
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.output)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, *self.window, GL_COLOR_BUFFER_BIT, GL_LINEAR)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.output)
+        glViewport(0, 0, *self.window)
+        renderer.frame_stats["draw_calls"] += 1
+
+    # Feed the last frame's time (excluding any frame-rate cap sleep). Returns True when the scale
+    # changed.
+    def update(self, frame_ms):
+        self.samples.append(frame_ms)
+        if self.wait:
+            self.wait -= 1
+            return False
+        if len(self.samples) < self.samples.maxlen:
+            return False
+        ms = statistics.median(self.samples)
+        goal = self.target_ms * self.margin
+        if not self.scaled:
+            self.full_ms = ms
+        if self.scaled and ms > self.target_ms and self.full_ms and ms >= self.full_ms:
+            # Scaling costs more than it saves on this display
+            self.scale = self.max_scale
+            self.samples.clear()
+            self.wait = self.retry_frames
+            self.retry_frames *= 2
+            return True
+        if ms > self.target_ms:
+            scale = self.scale * math.sqrt(goal / ms)
+            scale = math.floor(scale / self.step + 1e-9) * self.step
+        elif self.scaled and ms * ((self.scale + self.step) / self.scale) ** 2 < goal:
+            scale = self.scale + self.step
+        else:
+            return False
+        scale = round(min(max(scale, self.min_scale), self.max_scale), 6)
+        if scale == self.scale:
+            return False
+        self.scale = scale
+        self.samples.clear()
+        self.wait = self.cooldown
+        return True
+
+    def delete(self):
+        if self.framebuffer:
+            self.framebuffer.delete()
+            self.framebuffer = None
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import tomllib
+
+import numpy as np
+
+# Scene files: the bodies, belts, stars and comets of a SolarSystem, in TOML or JSON (chosen by
+# the extension). planets has the layout of simulation.PLANETS, plus optional name, angle0 and
+# texture on any body; the first planet is the central star. Moons orbit their planet; moons of
+# moons are not supported. Units are those of the simulation: scene units and radians per frame.
+#
+#   [[planets]]
+#   name = "Earth"
+#   radius = 0.5
+#   distance = 7
+#   speed = 0.02
+#   color = [0, 0.5, 1]
+#   texture = "earth.png"        # relative to the scene file
+#   moons = [{radius = 0.1, distance = 0.8, speed = 0.1, color = [0.7, 0.7, 0.7]}]
+#
+#   [[belts]]                    # generated from the system's seed; keys as in AsteroidBelt
+#   count = 100000
+#   inner = 30
+#   outer = 50
+#   speed = [0.001, 0.002]       # [low, high] of a uniform distribution, as radius and color
+#
+#   [stars]                      # count, radius, velocity: num_stars, skybox_radius, star_velocity
+#   [comets]                     # count, trail_length: num_comets, trail_length
+#
+# A scene is compiled once into packed tables with one row per body, planets first and then the
+# moons grouped by planet, and cached in cache_dir keyed on a hash of the file. Loading a cached
+# scene reads a handful of arrays, however many bodies the file lists.
+FORMAT = 1  # Part of the cache key; bump when the compiled layout changes
+ELEMENTS = ("distance", "speed", "angle0", "mass")  # Float64: angles are evaluated at any frame
+APPEARANCE = ("radius", "red", "green", "blue")  # Float32, as handed to OpenGL
+BELT = ("count", "inner", "outer", "radius_low", "radius_high", "speed_low", "speed_high",
+        "color_low", "color_high")
+BELT_DEFAULTS = {"inner": 10, "outer": 11, "radius": (0.05, 0.1), "speed": (0.01, 0.015), "color": (0.4, 0.6)}
+
+
+# Compiled scene. parent is -1 for planets and the planet's row for moons; planet_count rows
+# come first, so a moon's parent is also its planet's index among the planets. textures holds
+# None for bodies without one. belts is None when the scene leaves the belt to SolarSystem's
+# num_asteroids; options holds the stars and comets sections. digest is the SHA-1 of the file
+# a scene was loaded from, and None for one compiled from data.
+class Scene:
+    def __init__(self, names, parent, elements, appearance, textures, belts, options):
+        self.names = names
+        self.parent = parent
+        self.elements = elements
+        self.appearance = appearance
+        self.textures = textures
+        self.belts = belts
+        self.options = options
+        self.digest = None
+        self.planet_count = int(np.count_nonzero(parent < 0))
+
+
+# Element and appearance rows of one body
+def body_rows(name, body):
+    try:
+        color = [float(c) for c in body["color"]]
+        if len(color) != 3:
+            raise ValueError("color needs three components")
+        return ((float(body.get("distance", 0)), float(body.get("speed", 0)), float(body.get("angle0", 0)),
+                 float(body.get("mass", 0))), (float(body["radius"]), *color))
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f"{name}: a body needs a numeric radius and an RGB color ({error!r})") from None
+
+
+# Table row of one belt, with BELT_DEFAULTS for the keys it leaves out
+def belt_row(name, belt):
+    if "count" not in belt:
+        raise ValueError(f"{name}: a belt needs a count")
+    belt = {**BELT_DEFAULTS, **belt}
+    row = []
+    for key in ("count", "inner", "outer", "radius", "speed", "color"):
+        try:
+            value = [float(v) for v in belt[key]] if key in ("radius", "speed", "color") else [float(belt[key])]
+            if len(value) != (1 if key in ("count", "inner", "outer") else 2):
+                raise ValueError("expected [low, high]")
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"{name}: bad {key} {belt[key]!r} ({error})") from None
+        row += value
+    if row[0] < 0 or row[0] != int(row[0]):
+        raise ValueError(f"{name}: bad count {belt['count']!r} (expected a whole number of rocks)")
+    return row
+
+
+# Compile parsed scene data (the dict a scene file holds) into a Scene
+def compile_scene(data):
+    planets = data.get("planets")
+    if not planets:
+        raise ValueError("A scene needs at least one body in planets")
+    names = [planet.get("name", f"Body {i}") for i, planet in enumerate(planets)]
+    bodies = list(planets)
+    parents = [-1] * len(planets)
+    for i, planet in enumerate(planets):
+        for number, moon in enumerate(planet.get("moons", ()), 1):
+            if moon.get("moons"):
+                raise ValueError(f"{names[i]} moon {number}: moons of moons are not supported")
+            names.append(moon.get("name", f"{names[i]} moon {number}"))
+            bodies.append(moon)
+            parents.append(i)
+    rows = [body_rows(name, body) for name, body in zip(names, bodies)]
+    elements = np.array([row[0] for row in rows], dtype=float)
+    appearance = np.array([row[1] for row in rows], dtype=np.float32)
+    textures = [body.get("texture") for body in bodies]
+
+    belts = None
+    if "belts" in data:
+        rows = [belt_row(belt.get("name", f"Belt {i}"), belt) for i, belt in enumerate(data["belts"])]
+        belts = np.array(rows, dtype=float).reshape(-1, len(BELT))
+    options = {name: dict(data[name]) for name in ("stars", "comets") if name in data}
+    return Scene(names, np.array(parents, dtype=np.int32), elements, appearance, textures, belts, options)
+
+
+def parse(raw, path):
+    if path.endswith(".toml"):
+        return tomllib.loads(raw.decode())
+    return json.loads(raw)
+
+
+def write_cache(path, scene):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        np.savez(f, names=np.array(scene.names, dtype=str), parent=scene.parent, elements=scene.elements,
+                 appearance=scene.appearance, textures=np.array([t or "" for t in scene.textures], dtype=str),
+                 belts=scene.belts if scene.belts is not None else np.empty((0, 0)),
+                 options=np.array(json.dumps(scene.options)), has_belts=scene.belts is not None)
+    os.replace(temporary, path)  # Readers never see a half-written file
+
+
+def read_cache(path):
+    with np.load(path) as arrays:
+        return Scene(arrays["names"].tolist(), arrays["parent"], arrays["elements"], arrays["appearance"],
+                     [t or None for t in arrays["textures"].tolist()],
+                     arrays["belts"] if arrays["has_belts"] else None, json.loads(arrays["options"][()]))
+
+
+# Load and compile a scene file, through the cache in cache_dir (None compiles every time)
+def load_scene(path, cache_dir=".scene_cache"):
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    scene = None
+    if cache_dir is not None:
+        cached = os.path.join(cache_dir, hashlib.sha1(f"{FORMAT}:{digest}".encode()).hexdigest() + ".npz")
+        if os.path.exists(cached):
+            scene = read_cache(cached)
+    if scene is None:
+        scene = compile_scene(parse(raw, path))
+        if cache_dir is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                write_cache(cached, scene)
+            except OSError as error:
+                print(f"Could not cache scene {path}: {error}")
+    # Texture paths are relative to the scene file, which the cache key does not cover
+    folder = os.path.dirname(path)
+    scene.textures = [os.path.join(folder, texture) if texture else None for texture in scene.textures]
+    scene.digest = digest
+    return scene
+
+
+# Write a synthetic catalogue of exoplanet systems and a Kuiper belt, then time cold and cached
+# loads of it: python scene.py catalogue.json --generate 5000
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Compile a scene file and time loading it")
+    parser.add_argument("path")
+    parser.add_argument("--generate", type=int, metavar="SYSTEMS",
+                        help="first write a catalogue with this many exoplanet systems to path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.generate:
+        rng = np.random.default_rng(args.seed)
+        planets = [{"name": "Sun", "radius": 2.0, "distance": 0, "speed": 0, "mass": 1.0, "color": [1, 1, 0]}]
+        for i in range(args.generate):
+            # Host stars stand still on a disc past the Kuiper belt; their planets orbit them as moons
+            planets.append({
+                "name": f"HD {100000 + i}", "radius": rng.uniform(0.3, 0.8), "distance": rng.uniform(60, 90),
+                "speed": 0, "angle0": rng.uniform(0, 2 * np.pi), "color": rng.uniform(0.6, 1, 3).tolist(),
+                "moons": [{"radius": rng.uniform(0.02, 0.1), "distance": rng.uniform(1, 3),
+                           "speed": rng.uniform(0.01, 0.1), "color": rng.uniform(0.3, 1, 3).tolist()}
+                          for _ in range(rng.integers(1, 8))],
+            })
+        catalogue = {"planets": planets, "comets": {"count": 3},
+                     "belts": [{"count": 100}, {"count": 100000, "inner": 30, "outer": 50,
+                                               "speed": [0.001, 0.002], "color": [0.5, 0.7]}]}
+        with open(args.path, "w") as f:
+            json.dump(catalogue, f)
+
+    start = time.perf_counter()
+    scene = load_scene(args.path, cache_dir=None)
+    cold = time.perf_counter() - start
+    load_scene(args.path)  # Fill the cache
+    start = time.perf_counter()
+    scene = load_scene(args.path)
+    cached = time.perf_counter() - start
+    belts = 0 if scene.belts is None else int(scene.belts[:, 0].sum())
+    print(f"{scene.planet_count} planets, {len(scene.names) - scene.planet_count} moons, {belts} belt rocks: "
+          f"compiled in {cold * 1000:.1f} ms, loaded from the cache in {cached * 1000:.1f} ms")
@@ -0,0 +1,231 @@
+import ctypes
+import math
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileProgram, compileShader
+
+import renderer
+
+# GLSL path for the closed-form bodies. Orbital elements live in static vertex buffers and the
+# vertex shaders place every planet, moon and asteroid from one time uniform, so a frame costs a
+# few uniforms and two draw calls however many bodies there are. Lighting is per pixel, using the
+# fixed-function light set up by renderer.setup_gl_state(). Needs GL 3.3 (Mesa llvmpipe is fine).
+#
+# Orbits are (distance, speed, phase) with phase the angle at an epoch frame. time is frames since
+# that epoch; the epoch is moved (and the phases re-uploaded) every REBASE_FRAMES so the float32
+# angle in the shader stays accurate however long the simulation runs.
+REBASE_FRAMES = 4096
+
+# Per-pixel version of the fixed-function lighting: global and light ambient plus diffuse from
+# glColor (GL_COLOR_MATERIAL), and a Blinn-Phong highlight with specular 0.5, shininess 20
+LIGHTING = """
+vec3 shade(vec3 normal, vec3 position, vec3 color)
+{
+    vec3 n = normalize(normal);
+    vec3 l = normalize(gl_LightSource[0].position.xyz);  // Directional, already in eye space
+    vec3 h = normalize(l + normalize(-position));
+    float diffuse = max(dot(n, l), 0.0);
+    float specular = diffuse > 0.0 ? pow(max(dot(n, h), 0.0), 20.0) : 0.0;
+    vec3 ambient = gl_LightModel.ambient.rgb + gl_LightSource[0].ambient.rgb;
+    return color * (ambient + gl_LightSource[0].diffuse.rgb * diffuse)
+        + 0.5 * gl_LightSource[0].specular.rgb * specular;
+}
+"""
+
+ORBIT = """
+uniform float time;
+
+vec3 orbit_offset(vec3 orbit)
+{
+    float angle = orbit.z + orbit.y * time;
+    return vec3(cos(angle), 0.0, sin(angle)) * orbit.x;
+}
+"""
+
+# Planets and moons: one instanced unit sphere. Planets have a zero parent orbit; moons add their
+# orbit to their parent's.
+BODY_VERTEX = """#version 330 compatibility
+layout(location = 0) in vec3 vertex;  // Unit sphere, doubles as the normal
+layout(location = 1) in vec3 parent_orbit;
+layout(location = 2) in vec3 orbit;
+layout(location = 3) in float radius;
+layout(location = 4) in vec3 color;
+out vec3 eye_normal;
+out vec3 eye_position;
+out vec3 body_color;
+""" + ORBIT + """
+void main()
+{
+    vec3 center = orbit_offset(parent_orbit) + orbit_offset(orbit);
+    vec4 eye = gl_ModelViewMatrix * vec4(center + vertex * radius, 1.0);
+    eye_normal = gl_NormalMatrix * vertex;
+    eye_position = eye.xyz;
+    body_color = color;
+    gl_Position = gl_ProjectionMatrix * eye;
+}
+"""
+
+BODY_FRAGMENT = """#version 330 compatibility
+in vec3 eye_normal;
+in vec3 eye_position;
+in vec3 body_color;
+out vec4 fragment;
+""" + LIGHTING + """
+void main()
+{
+    fragment = vec4(shade(eye_normal, eye_position, body_color), 1.0);
+}
+"""
+
+# Asteroids: one point per rock, sized to its projected diameter. Rocks are a pixel or two across,
+# so like the fixed-function path they are drawn in their flat colour; point sprites (for
+# sphere impostors) cost about twice as much on llvmpipe for no visible difference.
+ASTEROID_VERTEX = """#version 330 compatibility
+layout(location = 0) in vec3 orbit;
+layout(location = 1) in float radius;
+layout(location = 2) in vec3 color;
+uniform float viewport_height;
+out vec3 rock_color;
+""" + ORBIT + """
+void main()
+{
+    vec4 eye = gl_ModelViewMatrix * vec4(orbit_offset(orbit), 1.0);
+    rock_color = color;
+    gl_Position = gl_ProjectionMatrix * eye;
+    gl_PointSize = max(1.0, radius * gl_ProjectionMatrix[1][1] * viewport_height / max(-eye.z, 1e-3));
+}
+"""
+
+ASTEROID_FRAGMENT = """#version 330 compatibility
+in vec3 rock_color;
+out vec4 fragment;
+
+void main()
+{
+    fragment = vec4(rock_color, 1.0);
+}
+"""
+
+
+# Indexed unit sphere: (vertices, triangle indices). Positions are also normals. Shared vertices
+# are shaded once, which matters because the vertex shader does the orbit math.
+def sphere_mesh(slices=32, stacks=16):
+    phi = np.linspace(0, math.pi, stacks + 1)
+    theta = np.linspace(0, 2 * math.pi, slices + 1)
+    vertices = np.stack([
+        np.sin(phi)[:, None] * np.cos(theta)[None, :],
+        np.cos(phi)[:, None] * np.ones_like(theta)[None, :],
+        np.sin(phi)[:, None] * np.sin(theta)[None, :],
+    ], axis=-1).reshape(-1, 3).astype(np.float32)
+    grid = np.arange((stacks + 1) * (slices + 1), dtype=np.uint32).reshape(stacks + 1, slices + 1)
+    a, b = grid[:-1, :-1], grid[:-1, 1:]
+    c, d = grid[1:, :-1], grid[1:, 1:]
+    return vertices, np.stack([a, c, b, b, c, d], axis=2).reshape(-1)
+
+
+# (distance, speed, phase at epoch) rows as float32, with the phase reduced in float64
+def orbit_table(distance, speed, angle0, epoch):
+    return np.stack([distance, speed, np.mod(angle0 + speed * epoch, 2 * math.pi)], axis=1).astype(np.float32)
+
+
+class GpuOrbits:
+    def __init__(self, system, slices=24, stacks=12):  # Per-pixel lighting hides the coarser mesh
+        self.system = system
+        self.body_program = compileProgram(compileShader(BODY_VERTEX, GL_VERTEX_SHADER),
+                                           compileShader(BODY_FRAGMENT, GL_FRAGMENT_SHADER))
+        self.asteroid_program = compileProgram(compileShader(ASTEROID_VERTEX, GL_VERTEX_SHADER),
+                                               compileShader(ASTEROID_FRAGMENT, GL_FRAGMENT_SHADER))
+        self.body_time = glGetUniformLocation(self.body_program, "time")
+        self.asteroid_time = glGetUniformLocation(self.asteroid_program, "time")
+        self.asteroid_viewport = glGetUniformLocation(self.asteroid_program, "viewport_height")
+
+        sphere, indices = sphere_mesh(slices, stacks)
+        self.sphere_indices = len(indices)
+        self.body_count = len(system.planet_radius) + len(system.moon_radius)
+        self.body_vao, self.asteroid_vao = glGenVertexArrays(2)
+
+        glBindVertexArray(self.body_vao)
+        renderer.bind_buffer("gpu_sphere", sphere, static=True)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        self.index_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)  # Recorded in the VAO
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices, GL_STATIC_DRAW)
+        renderer.bind_buffer("gpu_bodies")
+        self.attributes(((1, 3), (2, 3), (3, 1), (4, 3)), divisor=1)
+
+        glBindVertexArray(self.asteroid_vao)
+        renderer.bind_buffer("gpu_asteroids")
+        self.attributes(((0, 3), (1, 1), (2, 3)))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.epoch = None
+
+    # Interleaved float32 attributes from the bound buffer, given as (location, size) in order
+    @staticmethod
+    def attributes(layout, divisor=0):
+        stride = 4 * sum(size for _, size in layout)
+        offset = 0
+        for location, size in layout:
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+            glVertexAttribDivisor(location, divisor)
+            offset += 4 * size
+
+    # Upload orbital elements with their phases at a new epoch
+    def rebase(self, epoch):
+        system = self.system
+        planets = orbit_table(system.planet_distance, system.planet_speed, system.planet_angle0, epoch)
+        moons = orbit_table(system.moon_distance, system.moon_speed, system.moon_angle0, epoch)
+        bodies = np.concatenate([
+            np.hstack([np.zeros_like(planets), planets, system.planet_radius[:, None], system.planet_color]),
+            np.hstack([planets[system.moon_parent], moons, system.moon_radius[:, None], system.moon_color]),
+        ]).astype(np.float32)
+        belt = system.asteroids
+        asteroids = np.hstack([orbit_table(belt.distance, belt.speed, belt.angle0, epoch),
+                               belt.radius[:, None], belt.color]).astype(np.float32)
+        renderer.bind_buffer("gpu_bodies", bodies, static=True)
+        renderer.bind_buffer("gpu_asteroids", asteroids, static=True)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.epoch = epoch
+
+    # Frames since the epoch, rebasing first if the epoch is too far away
+    def elapsed(self):
+        time = self.system.time
+        if self.epoch is None or abs(time - self.epoch) > REBASE_FRAMES:
+            self.rebase(math.floor(time))
+        return time - self.epoch
+
+    # Sun, planets and moons in one instanced draw
+    def draw_bodies(self):
+        elapsed = self.elapsed()
+        glUseProgram(self.body_program)
+        glUniform1f(self.body_time, elapsed)
+        glBindVertexArray(self.body_vao)
+        glDrawElementsInstanced(GL_TRIANGLES, self.sphere_indices, GL_UNSIGNED_INT, None, self.body_count)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        renderer.frame_stats["draw_calls"] += 1
+
+    # Every asteroid as one sized point
+    def draw_asteroids(self, viewport_height):
+        if self.system.asteroids.count == 0:
+            return
+        elapsed = self.elapsed()
+        glUseProgram(self.asteroid_program)
+        glUniform1f(self.asteroid_time, elapsed)
+        glUniform1f(self.asteroid_viewport, viewport_height)
+        glEnable(GL_PROGRAM_POINT_SIZE)
+        glBindVertexArray(self.asteroid_vao)
+        glDrawArrays(GL_POINTS, 0, self.system.asteroids.count)
+        glBindVertexArray(0)
+        glDisable(GL_PROGRAM_POINT_SIZE)
+        glUseProgram(0)
+        renderer.frame_stats["draw_calls"] += 1
+
+    def delete(self):
+        glDeleteVertexArrays(2, [self.body_vao, self.asteroid_vao])
+        glDeleteBuffers(1, [self.index_buffer])
+        glDeleteProgram(self.body_program)
+        glDeleteProgram(self.asteroid_program)
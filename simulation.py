@@ -0,0 +1,648 @@
+import copy
+import math
+import time
+import numpy as np
+
+import nbody
+from scene import compile_scene, load_scene
+
+# Sun, planet, and moon data (speeds are radians per frame, masses in Suns for gravity mode)
+PLANETS = [
+    {"name": "Sun", "radius": 2.0, "distance": 0, "speed": 0, "mass": 1.0, "color": (1, 1, 0), "moons": []},
+    {"name": "Mercury", "radius": 0.2, "distance": 4, "speed": 0.03, "mass": 1.7e-7, "color": (0.5, 0.5, 0.5), "moons": []},
+    {"name": "Venus", "radius": 0.3, "distance": 5.5, "speed": 0.025, "mass": 2.4e-6, "color": (1, 0.8, 0.2), "moons": []},
+    {"name": "Earth", "radius": 0.5, "distance": 7, "speed": 0.02, "mass": 3.0e-6, "color": (0, 0.5, 1), "moons": [
+        {"radius": 0.1, "distance": 0.8, "speed": 0.1, "color": (0.7, 0.7, 0.7)}
+    ]},
+    {"name": "Mars", "radius": 0.4, "distance": 9, "speed": 0.018, "mass": 3.2e-7, "color": (1, 0.3, 0), "moons": [
+        {"radius": 0.05, "distance": 0.6, "speed": 0.12, "color": (0.6, 0.6, 0.6)},
+        {"radius": 0.05, "distance": 0.8, "speed": 0.1, "color": (0.6, 0.6, 0.6)}
+    ]},
+    {"name": "Jupiter", "radius": 1.0, "distance": 12, "speed": 0.012, "mass": 9.5e-4, "color": (1, 0.6, 0.2), "moons": [
+        {"radius": 0.15, "distance": 1.5, "speed": 0.08, "color": (0.8, 0.7, 0.6)},
+        {"radius": 0.12, "distance": 1.8, "speed": 0.07, "color": (0.8, 0.7, 0.6)},
+        {"radius": 0.1, "distance": 2.0, "speed": 0.06, "color": (0.8, 0.7, 0.6)},
+        {"radius": 0.1, "distance": 2.2, "speed": 0.05, "color": (0.8, 0.7, 0.6)}
+    ]},
+    {"name": "Saturn", "radius": 0.9, "distance": 16, "speed": 0.009, "mass": 2.9e-4, "color": (1, 1, 0.5), "moons": [
+        {"radius": 0.12, "distance": 1.5, "speed": 0.07, "color": (0.7, 0.7, 0.6)},
+        {"radius": 0.1, "distance": 1.8, "speed": 0.06, "color": (0.7, 0.7, 0.6)},
+        {"radius": 0.08, "distance": 2.0, "speed": 0.05, "color": (0.7, 0.7, 0.6)}
+    ]},
+    {"name": "Uranus", "radius": 0.7, "distance": 20, "speed": 0.006, "mass": 4.4e-5, "color": (0.5, 1, 1), "moons": []},
+    {"name": "Neptune", "radius": 0.7, "distance": 24, "speed": 0.004, "mass": 5.2e-5, "color": (0.3, 0.5, 1), "moons": []},
+]
+
+
+# Copy of obj holding only bodies start:stop of each per-body array named in names. parallel.py
+# hands such shards to its worker processes.
+def slice_bodies(obj, names, start, stop):
+    shard = copy.copy(obj)
+    shard.count = stop - start
+    for name in names:
+        setattr(shard, name, getattr(obj, name)[start:stop].copy())
+    return shard
+
+
+# One object holding the bodies of all parts (objects of one class), the inverse of slice_bodies
+def join_bodies(parts, names):
+    joined = copy.copy(parts[0])
+    joined.count = sum(part.count for part in parts)
+    for name in names:
+        setattr(joined, name, np.concatenate([getattr(part, name) for part in parts]))
+    return joined
+
+
+# Asteroid belt kept as a structure of arrays. Orbits are circular with constant angular speed,
+# so every rock's angle is angle0 + speed * t and any time can be evaluated directly. Radius,
+# speed and color are drawn uniformly from (low, high) ranges.
+class AsteroidBelt:
+    arrays = ("radius", "distance", "speed", "color", "angle0", "positions")  # Per-rock arrays
+
+    def __init__(self, count, inner=10, outer=11, rng=None, radius=(0.05, 0.1), speed=(0.01, 0.015),
+                 color=(0.4, 0.6)):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.count = count
+        self.radius = rng.uniform(*radius, count).astype(np.float32)
+        self.distance = rng.uniform(inner, outer, count)
+        self.speed = rng.uniform(*speed, count)  # Radians per frame
+        self.color = rng.uniform(*color, (count, 3)).astype(np.float32)
+        self.angle0 = rng.uniform(0, 2 * math.pi, count)
+        self.time = 0  # Frames since start
+        # Float32 xyz positions, ready to hand to glVertexPointer
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.update_positions()
+
+    # Angles at frame t (fractional t allowed), wrapped to [0, 2*pi)
+    def angles_at(self, t):
+        return np.mod(self.angle0 + self.speed * t, 2 * math.pi)
+
+    # Positions at frame t, written into out (float32, shape (count, 3)) if given
+    def positions_at(self, t, out=None):
+        if out is None:
+            out = np.zeros((self.count, 3), dtype=np.float32)
+        angle = self.angles_at(t)
+        out[:, 0] = np.cos(angle) * self.distance
+        out[:, 2] = np.sin(angle) * self.distance
+        return out
+
+    def update(self, steps=1):
+        self.time += steps
+        self.update_positions()
+
+    # Asteroids start:stop as a belt of their own
+    def shard(self, start, stop):
+        return slice_bodies(self, self.arrays, start, stop)
+
+    # Refresh the float32 positions, optionally alpha of a frame ahead for render interpolation
+    def update_positions(self, alpha=0.0):
+        self.positions_at(self.time + alpha, out=self.positions)
+
+
+# Skybox star field in spherical coordinates. Angular velocities are constant, so theta wraps and
+# phi clamps in closed form and any time can be evaluated directly.
+class StarField:
+    def __init__(self, count, radius=100, max_velocity=0.0001, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.count = count
+        self.radius = radius
+        self.theta0 = rng.uniform(0, 2 * math.pi, count)
+        self.phi0 = rng.uniform(0, math.pi, count)
+        # Angular velocities in radians per frame (small values give slow twinkling)
+        self.dtheta = rng.uniform(-max_velocity, max_velocity, count)
+        self.dphi = rng.uniform(-max_velocity, max_velocity, count)
+        self.time = 0
+        # False stops update() refreshing positions (skybox.StarSkybox bakes from positions_at)
+        self.track = True
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.update_positions()
+
+    # Positions at frame t, written into out (float32, shape (count, 3)) if given
+    def positions_at(self, t, out=None):
+        if out is None:
+            out = np.zeros((self.count, 3), dtype=np.float32)
+        theta = np.mod(self.theta0 + self.dtheta * t, 2 * math.pi)
+        # Each star drifts in one direction, so clamping once matches clamping every frame
+        phi = np.clip(self.phi0 + self.dphi * t, 0, math.pi)
+        sin_phi = np.sin(phi) * self.radius
+        out[:, 0] = sin_phi * np.cos(theta)
+        out[:, 1] = sin_phi * np.sin(theta)
+        out[:, 2] = np.cos(phi) * self.radius
+        return out
+
+    def update(self, steps=1):
+        self.time += steps
+        if self.track:
+            self.update_positions()
+
+    # Stars start:stop as a field of their own
+    def shard(self, start, stop):
+        return slice_bodies(self, ("theta0", "phi0", "dtheta", "dphi", "positions"), start, stop)
+
+    def update_positions(self, alpha=0.0):
+        self.positions_at(self.time + alpha, out=self.positions)
+
+
+MASK64 = (1 << 64) - 1  # Low half of a 128-bit random generator state
+
+
+# Comets with straight-line motion and fading trails, all held in preallocated arrays.
+# Each comet's position is spawn + velocity * age, so stepping n frames costs the same as one
+# frame until some comet leaves the scene box and respawns. Trails are ring buffers sharing one
+# write index, since every comet advances on the same step.
+# Every comet has its own random stream that uses exactly six draws per spawn. A comet's whole
+# respawn schedule can therefore be generated in bulk, which lets seek() jump to any frame without
+# replaying the frames in between.
+class CometSwarm:
+    # Scene box: a comet respawns once |x| > 150, |y| > 100 or z > 50
+    bounds_low = np.array([-150.0, -100.0, -np.inf])
+    bounds_high = np.array([150.0, 100.0, 50.0])
+    # Spawn region and velocity range for new comets
+    spawn_low = np.array([-100.0, -50.0, -100.0])
+    spawn_high = np.array([100.0, 50.0, -50.0])
+    velocity_low = np.array([-0.2, -0.2, 0.1])
+    velocity_high = np.array([0.2, 0.2, 0.4])
+
+    def __init__(self, count, trail_length=20, seed=None):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.comet_seeds = seed.spawn(count)
+        self.rngs = [np.random.default_rng(s) for s in self.comet_seeds]
+        self.count = count
+        self.trail_length = trail_length
+        self.spawn = np.zeros((count, 3))
+        self.velocity = np.zeros((count, 3))
+        self.age = np.zeros(count, dtype=np.int64)  # Frames since spawn
+        self.lifetime = np.zeros(count, dtype=np.int64)  # Age at which the comet leaves the box
+        self.position = np.zeros((count, 3))
+        self.trail = np.zeros((count, trail_length, 3), dtype=np.float32)
+        self.trail_count = np.zeros(count, dtype=np.int32)  # Valid trail points per comet
+        self.trail_head = 0  # Next ring-buffer slot to write
+        self.time = 0  # Frames since start
+        self.reset(np.ones(count, dtype=bool))
+
+    # Next n spawns from a comet's random stream: spawn points and velocities, each shape (n, 3)
+    def draw_spawns(self, rng, n):
+        u = rng.random((n, 6))
+        spawn = self.spawn_low + (self.spawn_high - self.spawn_low) * u[:, :3]
+        velocity = self.velocity_low + (self.velocity_high - self.velocity_low) * u[:, 3:]
+        return spawn, velocity
+
+    # Respawn the comets selected by mask behind the scene with fresh velocities
+    def reset(self, mask):
+        for i in np.flatnonzero(mask):
+            spawn, velocity = self.draw_spawns(self.rngs[i], 1)
+            self.spawn[i] = spawn[0]
+            self.velocity[i] = velocity[0]
+            self.lifetime[i] = self.exit_age(spawn, velocity)[0]
+        self.age[mask] = 0
+        self.position[mask] = self.spawn[mask]
+        self.trail_count[mask] = 0
+
+    # Jump straight to any frame: find each comet's current spawn from its bulk-generated
+    # schedule, then rebuild its trail from the closed-form path
+    def seek(self, frame, block=4096):
+        length = self.trail_length
+        for i in range(self.count):
+            rng = np.random.default_rng(self.comet_seeds[i])
+            start = 0  # Frame at which the current block's first spawn happened
+            spawned = 0  # Spawns drawn before the current block
+            while True:
+                spawn, velocity = self.draw_spawns(rng, block)
+                ends = start + np.cumsum(self.exit_age(spawn, velocity))
+                k = int(np.searchsorted(ends, frame, side="right"))  # First spawn still alive at frame
+                if k < block:
+                    break
+                start = int(ends[-1])
+                spawned += block
+            begin = int(ends[k - 1]) if k else start
+            self.spawn[i] = spawn[k]
+            self.velocity[i] = velocity[k]
+            self.lifetime[i] = ends[k] - begin
+            self.age[i] = frame - begin
+            # Leave the comet's stream positioned just after this spawn (six draws per spawn)
+            self.rngs[i] = np.random.default_rng(self.comet_seeds[i])
+            self.rngs[i].bit_generator.advance(6 * (spawned + k + 1))
+        # Trails hold ages 1..age of the current spawn; write the newest ones ending at slot 0
+        self.time = frame
+        self.trail_head = 0
+        np.minimum(self.age, length, out=self.trail_count)
+        ages = self.age[:, None] - np.arange(length)[None, ::-1]
+        self.trail[:] = self.spawn[:, None] + self.velocity[:, None] * ages[:, :, None]
+        self.update_positions()
+
+    # First whole frame at which spawn + velocity * age is outside the scene box
+    def exit_age(self, spawn, velocity):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            upper = np.where(velocity > 0, (self.bounds_high - spawn) / velocity, np.inf)
+            lower = np.where(velocity < 0, (self.bounds_low - spawn) / velocity, np.inf)
+        frames = np.minimum(upper, lower).min(axis=1)
+        return np.floor(np.minimum(frames, 2 ** 62)).astype(np.int64) + 1
+
+    def update(self, steps=1):
+        self.time += steps
+        length = self.trail_length
+        while steps > 0:
+            # Advance in chunks that end exactly when the next comet respawns
+            chunk = steps
+            if self.count:
+                chunk = min(steps, int((self.lifetime - self.age).min()))
+            # Only the newest trail_length points of the chunk can survive in the ring buffer
+            kept = min(chunk, length)
+            ages = self.age[:, None] + np.arange(chunk - kept + 1, chunk + 1)[None, :]
+            slots = (self.trail_head + chunk - kept + np.arange(kept)) % length
+            self.trail[:, slots] = self.spawn[:, None] + self.velocity[:, None] * ages[:, :, None]
+            self.trail_head = (self.trail_head + chunk) % length
+            np.minimum(self.trail_count + chunk, length, out=self.trail_count)
+            self.age += chunk
+            steps -= chunk
+            self.reset(self.age >= self.lifetime)
+        self.update_positions()
+
+    # Refresh head positions, optionally alpha of a frame ahead for render interpolation
+    def update_positions(self, alpha=0.0):
+        self.position = self.spawn + self.velocity * (self.age + alpha)[:, None]
+
+    # Everything update() depends on, for recording.py's keyframes. Arrays are the live ones, not
+    # copies; each comet's random stream is six words (PCG64 state and increment as 64-bit halves,
+    # then the buffered 32-bit draw).
+    def state(self):
+        words = np.zeros((self.count, 6), dtype=np.uint64)
+        for i, rng in enumerate(self.rngs):
+            state = rng.bit_generator.state
+            value, increment = state["state"]["state"], state["state"]["inc"]
+            words[i] = (value >> 64, value & MASK64, increment >> 64, increment & MASK64,
+                        state["has_uint32"], state["uinteger"])
+        return {"spawn": self.spawn, "velocity": self.velocity, "age": self.age, "lifetime": self.lifetime,
+                "trail": self.trail, "trail_count": self.trail_count, "trail_head": np.int64(self.trail_head),
+                "rng": words}
+
+    # Restore a state() taken at frame
+    def load_state(self, state, frame):
+        for name in ("spawn", "velocity", "age", "lifetime", "trail", "trail_count"):
+            getattr(self, name)[:] = state[name]
+        self.trail_head = int(state["trail_head"])
+        for rng, words in zip(self.rngs, state["rng"].tolist()):
+            rng.bit_generator.state = {
+                "bit_generator": "PCG64",
+                "state": {"state": words[0] << 64 | words[1], "inc": words[2] << 64 | words[3]},
+                "has_uint32": words[4], "uinteger": words[5],
+            }
+        self.time = frame
+        self.update_positions()
+
+    # Comets start:stop as a swarm of their own. Each comet keeps its own random stream and every
+    # shard advances the shared trail head identically, so shards step exactly like the whole swarm.
+    def shard(self, start, stop):
+        shard = slice_bodies(self, ("comet_seeds", "spawn", "velocity", "age", "lifetime", "position",
+                                    "trail", "trail_count"), start, stop)
+        shard.rngs = copy.deepcopy(self.rngs[start:stop])
+        return shard
+
+    # Trails reordered oldest to newest, shape (count, trail_length, 3); each comet's
+    # valid points are the last trail_count entries
+    def ordered_trails(self):
+        order = (self.trail_head + np.arange(self.trail_length)) % self.trail_length
+        return self.trail[:, order]
+
+    # Per-point trail alpha matching ordered_trails: 0 for the oldest point, rising toward 1
+    def trail_alpha(self):
+        first = self.trail_length - self.trail_count
+        alpha = (np.arange(self.trail_length)[None, :] - first[:, None]) / self.trail_length
+        return np.clip(alpha, 0, 1).astype(np.float32)
+
+
+# Sun's gravitational parameter in scene units (distance^3 / frame^2), chosen so the belt's mean
+# angular speed (0.0125 radians per frame) is a circular orbit at its mean distance (10.5)
+SUN_GM = 0.0125 ** 2 * 10.5 ** 3
+
+
+# Physically based motion for the asteroid belt and comets (SolarSystem(gravity=True)). Planets
+# keep their prescribed orbits and pull on the free bodies as point masses. With mutual=True the
+# free bodies also attract each other through nbody's octree; an asteroid of radius 0.1 weighs
+# asteroid_mass Suns (scaling with radius cubed) and comets are massless. options go to
+# nbody.NBody (theta, softening, mutual_interval, direct=True for the direct-sum reference).
+#
+# Asteroids start on circular orbits at their frame-0 positions and comets at their spawn point
+# and velocity. A comet that leaves the scene box respawns from its random stream as before.
+class Gravity:
+    def __init__(self, system, mutual=False, asteroid_mass=1e-9, **options):
+        self.system = system
+        self.mutual = mutual
+        self.asteroid_mass = asteroid_mass
+        self.options = options
+        planet_gm = SUN_GM * system.planet_mass
+        self.massive = np.flatnonzero(planet_gm > 0)
+        self.planet_gm = planet_gm[self.massive]
+        self.reset()
+
+    # Start again from the frame-0 state of the belt and comets
+    def reset(self):
+        belt, comets = self.system.asteroids, self.system.comets
+        cos, sin = np.cos(belt.angle0), np.sin(belt.angle0)
+        speed = np.sqrt(SUN_GM / belt.distance)
+        zeros = np.zeros(belt.count)
+        positions = np.stack([cos * belt.distance, zeros, sin * belt.distance], axis=1)
+        velocities = np.stack([-sin * speed, zeros, cos * speed], axis=1)
+        gm = np.zeros(belt.count + comets.count)
+        if self.mutual:
+            gm[:belt.count] = SUN_GM * self.asteroid_mass * (belt.radius / 0.1) ** 3
+        self.bodies = nbody.NBody(np.concatenate([positions, comets.position]),
+                                  np.concatenate([velocities, comets.velocity]), gm, self.field,
+                                  mutual=self.mutual, time=self.system.frame, **self.options)
+        self.interpolate(0.0)
+
+    # Positions and gravitational parameters of the planets with mass at frame t
+    def field(self, t):
+        return self.system.planet_positions(t)[self.massive], self.planet_gm
+
+    def step(self, n=1):
+        belt, comets = self.system.asteroids, self.system.comets
+        for _ in range(n):
+            self.bodies.step()
+            positions = self.bodies.positions[belt.count:]
+            comets.trail[:, comets.trail_head] = positions
+            comets.trail_head = (comets.trail_head + 1) % comets.trail_length
+            np.minimum(comets.trail_count + 1, comets.trail_length, out=comets.trail_count)
+            comets.age += 1
+            escaped = ((positions < comets.bounds_low) | (positions > comets.bounds_high)).any(axis=1)
+            if escaped.any():
+                comets.reset(escaped)
+                positions[escaped] = comets.spawn[escaped]
+                self.bodies.velocities[belt.count:][escaped] = comets.velocity[escaped]
+                self.bodies.invalidate()
+        belt.time += n
+        comets.time += n
+        self.interpolate(0.0)
+
+    # Integrator state for recording.py's keyframes (live arrays, not copies)
+    def state(self):
+        bodies = self.bodies
+        return {"positions": bodies.positions, "velocities": bodies.velocities, "time": np.float64(bodies.time),
+                "steps": np.int64(bodies.steps), "mutual_opened": np.bool_(bodies.mutual_opened)}
+
+    def load_state(self, state):
+        bodies = self.bodies
+        bodies.positions[:] = state["positions"]
+        bodies.velocities[:] = state["velocities"]
+        bodies.time = float(state["time"])
+        bodies.steps = int(state["steps"])
+        bodies.mutual_opened = bool(state["mutual_opened"])
+        bodies.invalidate()  # The cached field acceleration is recomputed bit for bit
+        self.interpolate(0.0)
+
+    # Rendered positions alpha of a frame ahead, extrapolated along the current velocities
+    def interpolate(self, alpha):
+        belt = self.system.asteroids
+        positions = self.bodies.positions + self.bodies.velocities * alpha
+        belt.positions[:] = positions[:belt.count]
+        self.system.comets.position = positions[belt.count:]
+
+
+# Complete simulation state: everything the renderer reads, with no pygame, GL or audio dependency.
+# The asteroids, stars and comets each draw from their own generator spawned from one seed, so a
+# seed reproduces a run exactly.
+# Planets, moons, asteroids and stars are closed-form functions of time, so positions at any frame
+# cost the same as positions now. seek() jumps anywhere without replaying frames.
+# gravity=True integrates asteroids and comets under gravity instead (see Gravity), with
+# mutual_gravity=True adding their attraction to each other. They then have no closed form:
+# seek() integrates forward, replaying from frame 0 to go back, and positions_at() leaves the
+# asteroids out.
+# scene=path builds the system from a scene file (see scene.py) in place of planets. Its belts,
+# stars and comets sections, where present, replace the matching arguments.
+class SolarSystem:
+    def __init__(self, planets=PLANETS, num_asteroids=100, num_stars=1000, num_comets=3,
+                 trail_length=20, skybox_radius=100, star_velocity=0.0001, seed=None, gravity=False,
+                 mutual_gravity=False, scene=None):
+        # An unseeded system draws fresh entropy; keep it, so the run can be rebuilt exactly
+        seed = np.random.SeedSequence(seed).entropy
+        # Constructor arguments, enough to build an identical system (recording.py stores them)
+        self.config = {"planets": planets, "num_asteroids": num_asteroids, "num_stars": num_stars,
+                       "num_comets": num_comets, "trail_length": trail_length, "skybox_radius": skybox_radius,
+                       "star_velocity": star_velocity, "seed": seed, "gravity": gravity,
+                       "mutual_gravity": mutual_gravity, "scene": scene}
+        self.seed = seed
+        asteroid_seed, star_seed, comet_seed = np.random.SeedSequence(seed).spawn(3)
+        self.frame = 0
+        self.alpha = 0.0  # Fraction of a frame past self.frame that positions are rendered at
+
+        bodies = load_scene(scene) if scene else compile_scene({"planets": planets})
+        stars = bodies.options.get("stars", {})
+        num_stars = stars.get("count", num_stars)
+        skybox_radius = stars.get("radius", skybox_radius)
+        star_velocity = stars.get("velocity", star_velocity)
+        comets = bodies.options.get("comets", {})
+        num_comets = comets.get("count", num_comets)
+        trail_length = comets.get("trail_length", trail_length)
+
+        # Planet tables (index 0 is the Sun, which has distance and speed 0) and moon tables, each
+        # moon with the index of its parent; all are slices of the compiled scene's columns
+        count = bodies.planet_count
+        elements = np.ascontiguousarray(bodies.elements.T)
+        radius = np.ascontiguousarray(bodies.appearance[:, 0])
+        color = np.ascontiguousarray(bodies.appearance[:, 1:])
+        self.planet_distance, self.planet_speed, self.planet_angle0, self.planet_mass = elements[:, :count]
+        self.planet_radius = radius[:count]
+        self.planet_color = color[:count]
+        self.moon_parent = bodies.parent[count:]
+        self.moon_distance, self.moon_speed, self.moon_angle0, _ = elements[:, count:]
+        self.moon_radius = radius[count:]
+        self.moon_color = color[count:]
+        self.body_names = bodies.names  # Planets, then moons
+        self.body_textures = bodies.textures  # Texture file per body, or None
+        self.scene_digest = bodies.digest  # SHA-1 of the scene file, or None
+
+        if bodies.belts is None:
+            self.asteroids = AsteroidBelt(num_asteroids, rng=np.random.default_rng(asteroid_seed))
+        elif len(bodies.belts):
+            belts = [AsteroidBelt(int(belt[0]), belt[1], belt[2], np.random.default_rng(belt_seed), belt[3:5],
+                                  belt[5:7], belt[7:9])
+                     for belt, belt_seed in zip(bodies.belts, asteroid_seed.spawn(len(bodies.belts)))]
+            self.asteroids = join_bodies(belts, AsteroidBelt.arrays)
+        else:
+            self.asteroids = AsteroidBelt(0)
+        self.stars = StarField(num_stars, skybox_radius, star_velocity, rng=np.random.default_rng(star_seed))
+        self.comets = CometSwarm(num_comets, trail_length, seed=comet_seed)
+        self.gravity = Gravity(self, mutual=mutual_gravity) if gravity else None
+
+    # Current render time in frames, including the interpolated fraction
+    @property
+    def time(self):
+        return self.frame + self.alpha
+
+    # Advance the whole system by n frames
+    def step(self, n=1):
+        self.stars.update(n)
+        if self.gravity:
+            self.gravity.step(n)
+        else:
+            self.asteroids.update(n)
+            self.comets.update(n)
+        self.frame += n
+        self.alpha = 0.0
+
+    # Jump to any whole frame, forwards or backwards, without stepping through the frames between
+    def seek(self, frame):
+        if self.gravity and frame >= self.frame:
+            self.step(frame - self.frame)
+            return
+        target, frame = frame, 0 if self.gravity else frame
+        self.comets.seek(frame)
+        self.asteroids.time = self.stars.time = frame
+        self.asteroids.update_positions()
+        self.stars.update_positions()
+        self.frame = frame
+        self.alpha = 0.0
+        if self.gravity:
+            self.gravity.reset()
+            self.step(target)
+
+    # Complete state at the current whole frame as a flat dict of arrays; everything else is a
+    # closed-form function of the frame. Stepping a restored state gives bit-identical results.
+    def state(self):
+        state = {"frame": np.int64(self.frame)}
+        state.update({"comets." + name: value for name, value in self.comets.state().items()})
+        if self.gravity:
+            state.update({"gravity." + name: value for name, value in self.gravity.state().items()})
+        return state
+
+    def load_state(self, state):
+        frame = int(state["frame"])
+        self.comets.load_state({name[7:]: value for name, value in state.items() if name.startswith("comets.")},
+                               frame)
+        self.asteroids.time = self.stars.time = frame
+        self.asteroids.update_positions()
+        self.stars.update_positions()
+        self.frame = frame
+        self.alpha = 0.0
+        if self.gravity:
+            self.gravity.load_state({name[8:]: value for name, value in state.items()
+                                     if name.startswith("gravity.")})
+
+    # Place rendered positions alpha (0..1) of a frame past the current state, without changing it
+    def interpolate(self, alpha):
+        self.alpha = alpha
+        if self.gravity:
+            self.gravity.interpolate(alpha)
+        else:
+            self.asteroids.update_positions(alpha)
+            self.comets.update_positions(alpha)
+
+    # Heliocentric planet positions at frame t (default: current render time), shape (planets, 3)
+    def planet_positions(self, t=None):
+        if t is None:
+            t = self.time
+        angle = self.planet_angle0 + self.planet_speed * t
+        positions = np.zeros((len(angle), 3))
+        positions[:, 0] = np.cos(angle) * self.planet_distance
+        positions[:, 2] = np.sin(angle) * self.planet_distance
+        return positions
+
+    # Planet orbit paths as (semi-major axis, eccentricity) for renderer.draw_orbits, leaving out
+    # bodies that stay put (the Sun, the host stars of a catalogue)
+    def orbit_paths(self):
+        moving = (self.planet_distance > 0) & (self.planet_speed != 0)
+        return tuple((distance, 0) for distance in self.planet_distance[moving].tolist())
+
+    # Moon positions in scene coordinates at frame t (parent position plus moon offset), shape (moons, 3)
+    def moon_positions(self, t=None):
+        if t is None:
+            t = self.time
+        angle = self.moon_angle0 + self.moon_speed * t
+        positions = self.planet_positions(t)[self.moon_parent]
+        positions[:, 0] += np.cos(angle) * self.moon_distance
+        positions[:, 2] += np.sin(angle) * self.moon_distance
+        return positions
+
+    # Every closed-form body at frame t in one call, without touching the current state
+    def positions_at(self, t):
+        positions = {
+            "planets": self.planet_positions(t),
+            "moons": self.moon_positions(t),
+            "stars": self.stars.positions_at(t),
+        }
+        if self.gravity is None:
+            positions["asteroids"] = self.asteroids.positions_at(t)
+        return positions
+
+
+# Fixed-timestep driver: converts real elapsed time into whole simulation frames at tick_rate,
+# scaled by time_scale (0 pauses). Leftover time stays in the accumulator and is used to
+# interpolate rendered positions. Many frames are taken as one step(n) call, which is analytic
+# for orbits and comets, so fast-forward costs about the same as 1x.
+#
+# In gravity mode every frame is a full integrator step, so a time warp would ask for thousands
+# of them per rendered frame. There frames are stepped one at a time, stopping after
+# max_integrated_steps or once max_step_time seconds have gone (None for no limit), and the
+# whole frames left are dropped rather than carried forward, so the simulation runs slower than
+# asked instead of freezing the window (skipped_frames counts them). At least one frame is
+# stepped per advance(), however long it takes.
+class FixedTimestep:
+    def __init__(self, system, tick_rate=60, time_scale=1.0, max_frame_time=0.25, max_integrated_steps=60,
+                 max_step_time=0.02):
+        self.system = system
+        self.tick_rate = tick_rate
+        self.time_scale = time_scale
+        self.max_frame_time = max_frame_time  # Clamp for long stalls (window drags, breakpoints)
+        self.accumulator = 0.0  # Simulation frames owed but not yet stepped
+        integrated = getattr(system, "system", system).gravity is not None  # Through a ParallelStepper too
+        self.max_steps = max_integrated_steps if integrated else None
+        self.max_step_time = max_step_time
+        self.skipped_frames = 0
+
+    @property
+    def paused(self):
+        return self.time_scale == 0
+
+    # Simulated seconds elapsed, including the interpolated fraction
+    @property
+    def sim_time(self):
+        return (self.system.frame + self.accumulator) / self.tick_rate
+
+    # Feed real elapsed seconds; steps the simulation and returns the interpolation alpha
+    def advance(self, real_dt):
+        real_dt = min(max(real_dt, 0.0), self.max_frame_time)
+        self.accumulator += real_dt * self.tick_rate * self.time_scale
+        frames = int(self.accumulator + 1e-9)  # Absorb float rounding just below a whole frame
+        if frames and self.max_steps is None:
+            self.system.step(frames)
+        elif frames:
+            start = time.perf_counter()
+            wanted, frames = frames, 0
+            while frames < min(wanted, self.max_steps):
+                self.system.step()
+                frames += 1
+                if self.max_step_time is not None and time.perf_counter() - start >= self.max_step_time:
+                    break
+            self.skipped_frames += wanted - frames
+            self.accumulator -= wanted - frames
+        self.accumulator = max(self.accumulator - frames, 0.0)
+        self.system.interpolate(self.accumulator)
+        return self.accumulator
+
+
+# Headless benchmark of the update path: python simulation.py --steps 10000 --seed 1
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Step the solar system simulation without a display")
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=1, help="frames advanced per step() call")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--asteroids", type=int, default=100)
+    parser.add_argument("--stars", type=int, default=1000)
+    parser.add_argument("--comets", type=int, default=3)
+    parser.add_argument("--gravity", action="store_true", help="integrate asteroids and comets under gravity")
+    parser.add_argument("--mutual", action="store_true", help="with --gravity, let them attract each other")
+    args = parser.parse_args()
+
+    system = SolarSystem(num_asteroids=args.asteroids, num_stars=args.stars,
+                         num_comets=args.comets, seed=args.seed, gravity=args.gravity or args.mutual,
+                         mutual_gravity=args.mutual)
+    start = time.perf_counter()
+    for _ in range(args.steps // args.batch):
+        system.step(args.batch)
+    elapsed = time.perf_counter() - start
+    print(f"{system.frame} frames in {elapsed:.3f} s ({system.frame / elapsed:,.0f} frames/s)")
@@ -0,0 +1,281 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileProgram, compileShader
+
+import renderer
+
+# Baked star sky: the star field is splatted into a cubemap on a worker thread and drawn as one
+# cube around the camera, so the sky costs one full-screen pass with a single cubemap fetch however
+# many stars there are (a million bake in about half a second). Twinkle is computed per pixel from
+# a phase baked with each star. An optional procedural nebula sits behind the stars in a small
+# cubemap of its own.
+#
+# Stars drift, so the sky is baked again every refresh_frames, ahead of time, and crossfaded: a
+# texel holds the previous bake in RG and the next one in BA, and the shader mixes the two as
+# simulation time moves between their bake times. Stars that have moved fade out at the old
+# position and in at the new one. Each transition is uploaded into a second cubemap, one face per
+# frame, which takes over when the current transition ends; its RG is the current BA, so the
+# handover is seamless. After a seek, or at time scales that outrun refresh_frames, the sky is
+# baked afresh at the current time and follows as fast as bakes complete. The sky sits at
+# infinity: it turns with the camera but shows no parallax.
+#
+# A bake stores brightness and brightness-weighted phase (8 bits each: RGBA8 samples about half
+# as fast as RGBA16F on llvmpipe, and the fetch is most of the sky's cost). Filtering and the crossfade then blend
+# phases by brightness, and dividing the two recovers a star's own phase wherever it is the only
+# star under the pixel. With the default size a texel is about two pixels at 1080p and a 45 degree
+# field of view, the size of renderer.draw_stars' points.
+SKY_VERTEX = """#version 330 compatibility
+layout(location = 0) in vec3 vertex;  // Cube corner, doubles as the lookup direction
+out vec3 direction;
+
+void main()
+{
+    direction = vertex;
+    // Rotation only, so the cube stays centred on the eye
+    gl_Position = gl_ProjectionMatrix * vec4(mat3(gl_ModelViewMatrix) * vertex, 1.0);
+}
+"""
+
+# Compiled with "#define NEBULA" when there is a nebula: llvmpipe samples a texture even in a
+# branch that is never taken
+SKY_FRAGMENT = """
+in vec3 direction;
+uniform samplerCube stars;
+uniform samplerCube nebula;
+uniform float blend;  // Crossfade from the bake in RG (0) to the one in BA (1)
+uniform float time;  // Frames
+uniform float twinkle;  // Depth of the flicker, 0 to 1
+uniform float brightness;
+out vec4 fragment;
+
+void main()
+{
+    vec4 bakes = texture(stars, direction);
+    vec2 star = mix(bakes.rg, bakes.ba, blend);
+    float phase = star.g / max(star.r, 1.0 / 255.0);
+    // A parabola per cycle instead of sin(), which costs a quarter of the frame on llvmpipe
+    float rate = (0.5 + fract(phase * 7.31)) / 60.0;  // Cycles per frame, 0.5 to 1.5 Hz at 60 fps
+    float wave = fract(time * rate + phase);
+    float flicker = 1.0 - twinkle * 4.0 * wave * (1.0 - wave);
+    vec3 sky = vec3(min(star.r * brightness, 1.0) * flicker);
+#ifdef NEBULA
+    sky += texture(nebula, direction).rgb;
+#endif
+    fragment = vec4(sky, 1.0);
+}
+"""
+
+# Unit cube as 12 triangles; seen from inside, so winding does not matter (face culling is off)
+CUBE_CORNERS = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+CUBE_TRIANGLES = np.array([0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5, 0, 4, 5, 0, 5, 1,
+                           2, 3, 7, 2, 7, 6, 0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3])
+
+# Twinkle phases come from their own stream, so a seed gives the same sky on every run
+PHASE_SEED = 0x5747
+
+
+# Face (0..5 in GL order +X, -X, +Y, -Y, +Z, -Z) and texel column and row of each direction
+def cube_texels(directions, size):
+    x, y, z = directions[:, 0], directions[:, 1], directions[:, 2]
+    ax, ay, az = np.abs(x), np.abs(y), np.abs(z)
+    face = np.where((ax >= ay) & (ax >= az), np.where(x > 0, 0, 1),
+                    np.where(ay >= az, np.where(y > 0, 2, 3), np.where(z > 0, 4, 5)))
+    major = np.maximum(np.choose(face // 2, [ax, ay, az]), 1e-12)
+    sc = np.choose(face, [-z, z, x, x, x, -x]) / major
+    tc = np.choose(face, [-y, -y, z, -z, -y, -y]) / major
+    column = np.clip(((sc + 1) * 0.5 * size).astype(np.int64), 0, size - 1)
+    row = np.clip(((tc + 1) * 0.5 * size).astype(np.int64), 0, size - 1)
+    return face, column, row
+
+
+# Unit direction through the centre of every texel, shape (6, size, size, 3) indexed [face, row, column]
+def face_directions(size):
+    tc, sc = np.meshgrid((np.arange(size) + 0.5) / size * 2 - 1, (np.arange(size) + 0.5) / size * 2 - 1,
+                         indexing="ij")
+    one = np.ones_like(sc)
+    faces = np.stack([
+        np.stack([one, -tc, -sc], axis=-1), np.stack([-one, -tc, sc], axis=-1),
+        np.stack([sc, one, tc], axis=-1), np.stack([sc, -one, -tc], axis=-1),
+        np.stack([sc, -tc, one], axis=-1), np.stack([-sc, -tc, -one], axis=-1),
+    ])
+    return faces / np.linalg.norm(faces, axis=-1, keepdims=True)
+
+
+# Stars at frame t as cube faces of (brightness, phase * brightness), uint8 (6, size, size, 2).
+# Runs on the bake thread. Every star lands on its nearest texel; a texel with stars is fully
+# bright and has their mean phase.
+def bake_stars(stars, phases, t, size):
+    faces = np.zeros((6 * size * size, 2), dtype=np.uint8)
+    if stars.count:
+        face, column, row = cube_texels(stars.positions_at(t), size)
+        # Sums over the texels that have stars only, so a sparse field bakes in a few milliseconds
+        texel, slot, count = np.unique((face * size + row) * size + column, return_inverse=True,
+                                       return_counts=True)
+        faces[texel, 0] = 255
+        faces[texel, 1] = np.round(np.bincount(slot, weights=phases) / count * 255)
+    return faces.reshape(6, size, size, 2)
+
+
+# Faces for one crossfade: previous in RG and a new bake at frame t in BA, uint8 (6, size, size, 4).
+# previous=None starts afresh, with the new bake in both. Returns (new bake, crossfade faces).
+def bake_transition(stars, phases, previous, t, size):
+    faces = bake_stars(stars, phases, t, size)
+    return faces, np.concatenate([faces if previous is None else previous, faces], axis=-1)
+
+
+# Faint procedural nebula, float16 (6, size, size, 3): a few soft coloured clouds and a band
+# across the sky, broken up by summed plane waves
+def bake_nebula(size=128, seed=0, clouds=10, waves=24, intensity=0.12):
+    rng = np.random.default_rng(seed)
+    directions = face_directions(size)
+    palette = np.array([[0.45, 0.25, 0.75], [0.2, 0.35, 0.85], [0.75, 0.25, 0.35], [0.25, 0.55, 0.65]])
+
+    centers = rng.normal(size=(clouds, 3))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    density = np.exp((directions @ centers.T - 1) / rng.uniform(0.05, 0.4, clouds))
+    colors = palette[rng.integers(len(palette), size=clouds)]
+    band = rng.normal(size=3)
+    band_density = np.exp(-(directions @ (band / np.linalg.norm(band))) ** 2 / 0.02)
+
+    wave_directions = rng.normal(size=(waves, 3))
+    wave_directions /= np.linalg.norm(wave_directions, axis=1, keepdims=True)
+    phase = directions @ wave_directions.T * rng.uniform(2, 14, waves) + rng.uniform(0, 2 * math.pi, waves)
+    turbulence = np.clip(1 + 2 * np.sin(phase).mean(axis=-1, keepdims=True), 0, None)
+
+    sky = (density @ colors + band_density[..., None] * palette[1] * 0.6) * turbulence * intensity
+    return sky.astype(np.float16)
+
+
+# A cube map texture with linear filtering, allocated for size x size faces
+def create_cubemap(size, internal_format, data_format, data_type, faces=None):
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_CUBE_MAP, texture)
+    for face in range(6):
+        glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, 0, internal_format, size, size, 0, data_format,
+                     data_type, None if faces is None else faces[face])
+    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    for wrap in (GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_TEXTURE_WRAP_R):
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, wrap, GL_CLAMP_TO_EDGE)
+    glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
+    return texture
+
+
+# Draws system.stars from baked cubemaps in place of renderer.draw_stars (pass it to
+# renderer.draw_scene as skybox). While it exists the star field stops computing per-frame
+# positions; delete() turns them back on. refresh_frames=None bakes once and never again.
+class StarSkybox:
+    def __init__(self, system, size=1024, refresh_frames=600, twinkle=0.5, brightness=2.0, nebula=False,
+                 nebula_size=128):
+        self.system = system
+        self.size = size
+        self.refresh_frames = refresh_frames
+        self.twinkle = twinkle
+        self.brightness = brightness  # Filtering spreads a star over about four pixels; this restores its peak
+        self.phases = np.random.default_rng([PHASE_SEED, system.seed or 0]).random(system.stars.count)
+        header = "#version 330 compatibility\n" + ("#define NEBULA\n" if nebula else "")
+        self.program = compileProgram(compileShader(SKY_VERTEX, GL_VERTEX_SHADER),
+                                      compileShader(header + SKY_FRAGMENT, GL_FRAGMENT_SHADER))
+        self.uniforms = {name: glGetUniformLocation(self.program, name) for name in
+                         ("stars", "nebula", "blend", "time", "twinkle", "brightness")}
+        glUseProgram(self.program)
+        glUniform1i(self.uniforms["stars"], 0)
+        glUniform1i(self.uniforms["nebula"], 1)
+        glUseProgram(0)
+        glEnable(GL_TEXTURE_CUBE_MAP_SEAMLESS)  # Filter across face edges
+
+        # The first bake is waited for, so the sky is there from the first frame
+        time = system.time
+        self.latest, faces = bake_transition(system.stars, self.phases, None, time, size)
+        self.latest_time = time  # Frame of the newest bake shown
+        self.cubemaps = [create_cubemap(size, GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE, faces),
+                         create_cubemap(size, GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE)]
+        self.span = (time, time)  # Bake times of the current cubemap's RG and BA
+        self.nebula = None
+        if nebula:  # Half floats, since 8 bits band at its faint levels
+            self.nebula = create_cubemap(nebula_size, GL_RGB16F, GL_RGB, GL_HALF_FLOAT,
+                                         bake_nebula(nebula_size, system.seed or 0))
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="skybox")
+        self.pending = None  # (span, future) of the bake being computed
+        self.uploading = None  # (span, new bake, crossfade faces, faces uploaded so far)
+        self.ready = None  # (span, new bake) waiting in the second cubemap
+        system.stars.track = False
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        renderer.bind_buffer("skybox_cube", CUBE_CORNERS[CUBE_TRIANGLES], static=True)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    # Move bakes along: start the next one, upload a finished one a face per frame, and switch
+    # cubemaps when the current crossfade is over
+    def refresh(self, time):
+        if self.refresh_frames is None:
+            return
+        work = self.pending or self.uploading or self.ready
+        fresh = work is not None and work[0][0] == work[0][1]
+        if (time < self.span[0] or time >= self.latest_time + self.refresh_frames) and not fresh:
+            # Seeked back, or fell behind: drop any crossfade in flight and bake the present
+            self.uploading = self.ready = None
+            self.pending = ((time, time), self.pool.submit(bake_transition, self.system.stars, self.phases,
+                                                           None, time, self.size))
+        if self.pending and self.pending[1].done():
+            span, future = self.pending
+            self.uploading = (span, *future.result(), 0)
+            self.pending = None
+        if self.uploading:
+            span, latest, faces, face = self.uploading
+            glBindTexture(GL_TEXTURE_CUBE_MAP, self.cubemaps[1])
+            glTexSubImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, 0, 0, 0, self.size, self.size, GL_RGBA,
+                            GL_UNSIGNED_BYTE, faces[face])
+            glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
+            self.uploading = (span, latest, faces, face + 1) if face < 5 else None
+            if face == 5:
+                self.ready = (span, latest)
+        if self.ready and (time >= self.ready[0][0] or self.ready[0][0] == self.ready[0][1]):
+            (self.span, self.latest), self.ready = self.ready, None
+            self.latest_time = self.span[1]
+            self.cubemaps.reverse()
+        if not (self.pending or self.uploading or self.ready):
+            end = self.latest_time + self.refresh_frames
+            self.pending = ((self.latest_time, end), self.pool.submit(
+                bake_transition, self.system.stars, self.phases, self.latest, end, self.size))
+
+    # Draw the sky (expects BACKGROUND state)
+    def draw(self):
+        time = self.system.time
+        self.refresh(time)
+        start, end = self.span
+        blend = min(max((time - start) / (end - start), 0.0), 1.0) if end > start else 0.0
+        glUseProgram(self.program)
+        glUniform1f(self.uniforms["blend"], blend)
+        glUniform1f(self.uniforms["time"], math.fmod(time, 1 << 20))  # Keeps float32 precision
+        glUniform1f(self.uniforms["twinkle"], self.twinkle)
+        glUniform1f(self.uniforms["brightness"], self.brightness)
+        glBindTexture(GL_TEXTURE_CUBE_MAP, self.cubemaps[0])
+        if self.nebula:
+            glActiveTexture(GL_TEXTURE1)
+            glBindTexture(GL_TEXTURE_CUBE_MAP, self.nebula)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLES, 0, len(CUBE_TRIANGLES))
+        glBindVertexArray(0)
+        if self.nebula:
+            glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
+            glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
+        glUseProgram(0)
+        renderer.frame_stats["draw_calls"] += 1
+
+    def delete(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        glDeleteTextures([texture for texture in self.cubemaps + [self.nebula] if texture])
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteProgram(self.program)
+        stars = self.system.stars
+        stars.track = True
+        stars.update_positions()
@@ -1,11 +1,21 @@
 import pygame
 from pygame.locals import *
+import OpenGL
+OpenGL.ERROR_CHECKING = __debug__  # python -O skips PyOpenGL's glGetError after every GL call
 from OpenGL.GL import *
 from OpenGL.GLU import *
-import math
-import random
 import numpy as np
 
+from renderer import draw_cached_sphere, bind_texture, set_state, SPHERE_MATERIAL, setup_gl_state, draw_scene, cull_stats, count_state_changes
+from profiler import FrameProfiler, ProfilerHud
+from simulation import SolarSystem, FixedTimestep
+from parallel import ParallelStepper
+from collisions import CollisionDetector
+from recording import Recorder, Replayer
+from resolution import DynamicResolution
+from skybox import StarSkybox
+from textures import TextureLoader
+
 # Initialize Pygame and OpenGL
 pygame.init()
 display = pygame.display.list_modes()[0]
@@ -21,176 +31,107 @@ try:
 except:
     print("Could not load music.")
 
-# Set up perspective and initial camera
-gluPerspective(45, (display[0] / display[1]), 0.1, 200.0)
-glEnable(GL_DEPTH_TEST)
-glEnable(GL_LIGHTING)
-glEnable(GL_LIGHT0)
-glEnable(GL_COLOR_MATERIAL)
-glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
+# Set up depth testing, lighting and materials
+setup_gl_state()
 glEnable(GL_TEXTURE_2D)  # Enable texture mapping
 
-# Set up lighting
-glLightfv(GL_LIGHT0, GL_POSITION, (10, 5, 10, 0))
-glLightfv(GL_LIGHT0, GL_AMBIENT, (0.2, 0.2, 0.2, 1))
-glLightfv(GL_LIGHT0, GL_DIFFUSE, (0.7, 0.7, 0.7, 1))
-glLightfv(GL_LIGHT0, GL_SPECULAR, (0.5, 0.5, 0.5, 1))
-
-# Function to load texture (commented out for Pyodide)
-def load_texture(filename):
-    try:
-        surface = pygame.image.load(filename)
-        texture_data = pygame.image.tostring(surface, "RGB", 1)
-        width, height = surface.get_size()
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, texture_data)
-        return texture_id
-    except:
-        print(f"Failed to load texture: {filename}")
-        return None
-
-# Sun, planet, and moon data with texture files
-planets = [
-    {"name": "Sun", "radius": 2.0, "distance": 0, "speed": 0, "color": (1, 1, 0), "texture_file": "sun.png", "texture_id": None, "moons": []},
-    {"name": "Mercury", "radius": 0.2, "distance": 4, "speed": 0.03, "color": (0.5, 0.5, 0.5), "texture_file": "mercury.png", "texture_id": None, "moons": []},
-    {"name": "Venus", "radius": 0.3, "distance": 5.5, "speed": 0.025, "color": (1, 0.8, 0.2), "texture_file": "venus.png", "texture_id": None, "moons": []},
-    {"name": "Earth", "radius": 0.5, "distance": 7, "speed": 0.02, "color": (0, 0.5, 1), "texture_file": "earth.png", "texture_id": None, "moons": [
-        {"radius": 0.1, "distance": 0.8, "speed": 0.1, "color": (0.7, 0.7, 0.7)}
-    ]},
-    {"name": "Mars", "radius": 0.4, "distance": 9, "speed": 0.018, "color": (1, 0.3, 0), "texture_file": "mars.png", "texture_id": None, "moons": [
-        {"radius": 0.05, "distance": 0.6, "speed": 0.12, "color": (0.6, 0.6, 0.6)},
-        {"radius": 0.05, "distance": 0.8, "speed": 0.1, "color": (0.6, 0.6, 0.6)}
-    ]},
-    {"name": "Jupiter", "radius": 1.0, "distance": 12, "speed": 0.012, "color": (1, 0.6, 0.2), "texture_file": "jupiter.png", "texture_id": None, "moons": [
-        {"radius": 0.15, "distance": 1.5, "speed": 0.08, "color": (0.8, 0.7, 0.6)},
-        {"radius": 0.12, "distance": 1.8, "speed": 0.07, "color": (0.8, 0.7, 0.6)},
-        {"radius": 0.1, "distance": 2.0, "speed": 0.06, "color": (0.8, 0.7, 0.6)},
-        {"radius": 0.1, "distance": 2.2, "speed": 0.05, "color": (0.8, 0.7, 0.6)}
-    ]},
-    {"name": "Saturn", "radius": 0.9, "distance": 16, "speed": 0.009, "color": (1, 1, 0.5), "texture_file": "saturn.png", "texture_id": None, "moons": [
-        {"radius": 0.12, "distance": 1.5, "speed": 0.07, "color": (0.7, 0.7, 0.6)},
-        {"radius": 0.1, "distance": 1.8, "speed": 0.06, "color": (0.7, 0.7, 0.6)},
-        {"radius": 0.08, "distance": 2.0, "speed": 0.05, "color": (0.7, 0.7, 0.6)}
-    ]},
-    {"name": "Uranus", "radius": 0.7, "distance": 20, "speed": 0.006, "color": (0.5, 1, 1), "texture_file": "uranus.png", "texture_id": None, "moons": []},
-    {"name": "Neptune", "radius": 0.7, "distance": 24, "speed": 0.004, "color": (0.3, 0.5, 1), "texture_file": "neptune.png", "texture_id": None, "moons": []},
-]
-
-# Load textures (commented out for Pyodide; uncomment in desktop environment)
-for p in planets:
-    if p["texture_file"]:
-        p["texture_id"] = load_texture(p["texture_file"])
-
-# Asteroid belt
+# Simulation state (Sun, planets, moons, asteroid belt, comets and star field) lives in
+# simulation.py and runs without pygame or OpenGL; pass seed=... for a reproducible run
+scene_file = None  # Bodies, belts, stars and comets from a scene file (e.g. "solar_system.toml")
 num_asteroids = 100
-asteroids = [
-    {
-        "radius": random.uniform(0.05, 0.1),
-        "distance": random.uniform(10, 11),
-        "speed": random.uniform(0.01, 0.015),
-        "color": (random.uniform(0.4, 0.6), random.uniform(0.4, 0.6), random.uniform(0.4, 0.6)),
-        "angle": random.uniform(0, 2 * math.pi)
-    }
-    for _ in range(num_asteroids)
-]
-
-# Planet, asteroid, and moon angle state
-planet_angles = [0 for _ in planets]
-asteroid_angles = [a["angle"] for a in asteroids]
-moon_angles = [[0 for _ in p["moons"]] for p in planets]
+num_comets = 3
+num_stars = 1000
+gravity = False  # Integrate asteroids and comets under the Sun's and planets' gravity
+mutual_gravity = False  # With gravity, also let them attract each other (Barnes-Hut octree)
+workers = 0  # Update processes for asteroids, stars and comets (0 steps them on this thread)
+skybox_radius = 100
+record_path = None  # Record the session to this file (e.g. "session.rec") for exact replay
+replay_path = None  # Play a recorded session back instead (Left / Right seek 10 seconds)
+if replay_path:
+    replayer = Replayer(replay_path)  # Builds the recorded system
+    system = replayer.system
+    replay_index = 0
+else:
+    system = SolarSystem(num_asteroids=num_asteroids, num_stars=num_stars, num_comets=num_comets,
+                         skybox_radius=skybox_radius, star_velocity=0.0005, gravity=gravity,
+                         mutual_gravity=mutual_gravity, scene=scene_file)
+# Keyframes read the comet state, so a recorded session steps in this process
+recorder = Recorder(record_path, system) if record_path and not replay_path else None
+
+# Texture files for the Sun and planets
+texture_files = {
+    "Sun": "sun.png", "Mercury": "mercury.png", "Venus": "venus.png", "Earth": "earth.png",
+    "Mars": "mars.png", "Jupiter": "jupiter.png", "Saturn": "saturn.png", "Uranus": "uranus.png",
+    "Neptune": "neptune.png",
+}
+
+# Moon textures by parent planet; these are small, so they share one atlas texture
+moon_texture_files = {"Earth": "moon.png", "Mars": "phobos.png", "Jupiter": "io.png", "Saturn": "titan.png"}
+
+# Load textures in the background (decoded images are cached in .texture_cache); bodies are drawn
+# in their flat colors until their texture arrives, and loader.poll() uploads one per frame.
+# Textures named in a scene file take precedence over these.
+planet_count = len(system.planet_radius)
+loader = TextureLoader([texture or texture_files.get(name)
+                        for name, texture in zip(system.body_names, system.body_textures[:planet_count])],
+                       [texture or moon_texture_files.get(system.body_names[parent])
+                        for parent, texture in zip(system.moon_parent, system.body_textures[planet_count:])])
+texture_ids = loader.textures
+moon_texture_ids = loader.atlas_regions
+
+# Impact and close-approach events of comets with the Sun, planets and moons, printed as they
+# happen (add "asteroids" to groups to include the belt)
+collisions = CollisionDetector(system, threshold=0.5, groups=("comets",))
+
+# Fixed-timestep clock: the simulation runs at 60 frames per simulated second whatever the
+# render rate; time_scale 0 pauses and large values fast-forward with analytic steps. With
+# workers, the next frame's update runs in those processes while this one is drawn.
+stepper = ParallelStepper(system, 0 if recorder else workers)
+timestep = FixedTimestep(stepper, tick_rate=60)
+time_scales = {K_1: 1, K_2: 10, K_3: 100, K_4: 1000}
+paused_scale = 1
+max_fps = 0  # Render-rate cap for clock.tick (0 = uncapped)
+
+# Dynamic resolution: draw the scene at whatever fraction of the window holds target_fps and
+# stretch it to fit (toggle with R); the scale is printed when it changes and shown in the HUD
+dynamic_resolution = True
+target_fps = 60
+scaler = DynamicResolution(display, 1000 / target_fps)
+
+# Orbit paths as (semi-major axis, eccentricity), skipping the Sun
+planet_orbits = system.orbit_paths()
 
 # Camera control variables
 camera_rot_x = 0
 camera_rot_y = 0
 camera_distance = 40
 last_mouse_pos = None
-
-# Draw a sphere with texture or color
-def draw_sphere(radius, color, texture_id=None):
+culling = True  # Skip bodies outside the view frustum (toggle with C)
+star_skybox = None  # Stars baked into a twinkling cubemap, for huge star counts (toggle with B)
+skybox_nebula = True  # Faint procedural nebula behind the baked stars
+
+# Per-stage frame profiling: H toggles the overlay (and GL state-change counting); set
+# profile_log to "profile.csv" or "profile.json" to stream per-frame records to a file.
+# check_gl_errors is off under python -O, skipping the synchronous glGetError each frame.
+profiler = FrameProfiler()
+hud = ProfilerHud(profiler)
+show_hud = False
+profile_log = None
+if profile_log:
+    profiler.open_log(profile_log)
+    count_state_changes()
+check_gl_errors = __debug__
+
+# Draw a sphere with texture or color. set_state() only issues what differs from the previous
+# body (draw_bodies groups bodies by texture), so texturing is not toggled per sphere.
+def draw_sphere(radius, color, texture_id=None, detail=(32, 16)):
     if texture_id:
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
+        set_state(texture=True, color=(1, 1, 1), material=SPHERE_MATERIAL)
+        bind_texture(texture_id)  # Texture id or atlas region; skips rebinding the same texture
     else:
-        glDisable(GL_TEXTURE_2D)
-        glColor3fv(color)  # Fallback to color if no texture
-    glMaterialfv(GL_FRONT, GL_SPECULAR, (0.5, 0.5, 0.5, 1))
-    glMaterialfv(GL_FRONT, GL_SHININESS, 20)
-    
-    quadric = gluNewQuadric()
-    gluQuadricTexture(quadric, GL_TRUE)  # Enable texture coordinates
-    gluSphere(quadric, radius, 32, 16)
-    glDisable(GL_TEXTURE_2D)
-    gluDeleteQuadric(quadric)
-
-# Draw orbital path
-def draw_orbit(distance):
-    glDisable(GL_LIGHTING)
-    glColor3f(0.3, 0.3, 0.3)
-    glBegin(GL_LINE_LOOP)
-    for i in range(100):
-        theta = i * 2 * math.pi / 100
-        x = distance * math.cos(theta)
-        z = distance * math.sin(theta)
-        glVertex3f(x, 0, z)
-    glEnd()
-    glEnable(GL_LIGHTING)
-
-# Comet class with trail effect
-class Comet:
-    def __init__(self):
-        self.trail = []
-        self.trail_length = 20
-        self.reset()
-
-    def reset(self):
-        self.x = random.uniform(-100, 100)
-        self.y = random.uniform(-50, 50)
-        self.z = random.uniform(-100, -50)
-        self.dx = random.uniform(-0.2, 0.2)
-        self.dy = random.uniform(-0.2, 0.2)
-        self.dz = random.uniform(0.1, 0.4)
-        self.trail = []
-
-    def update(self):
-        self.x += self.dx
-        self.y += self.dy
-        self.z += self.dz
-        self.trail.append((self.x, self.y, self.z))
-        if len(self.trail) > self.trail_length:
-            self.trail.pop(0)
-        if abs(self.x) > 150 or abs(self.y) > 100 or self.z > 50:
-            self.reset()
-
-    def draw(self):
-        glDisable(GL_LIGHTING)
-        glBegin(GL_LINE_STRIP)
-        for i, pos in enumerate(self.trail):
-            alpha = i / self.trail_length
-            glColor4f(1, 1, 1, alpha)
-            glVertex3f(*pos)
-        glEnd()
-        glEnable(GL_LIGHTING)
-
-        glPushMatrix()
-        glTranslatef(self.x, self.y, self.z)
-        draw_sphere(0.2, (1, 1, 1))
-        glPopMatrix()
+        set_state(texture=False, color=tuple(color), material=SPHERE_MATERIAL)  # Fallback to color if no texture
 
-comets = [Comet() for _ in range(3)]
-
-# Star field for skybox with movement
-num_stars = 1000
-star_positions = []
-star_velocities = []
-skybox_radius = 100
-for _ in range(num_stars):
-    theta = random.uniform(0, 2 * math.pi)
-    phi = random.uniform(0, math.pi)
-    star_positions.append([theta, phi])
-    star_velocities.append([random.uniform(-0.0005, 0.0005), random.uniform(-0.0005, 0.0005)])
+    draw_cached_sphere(radius, *detail)  # Unit-sphere display list (with texture coordinates), scaled per body
 
 # OpenGL error checking
 def check_opengl_error():
@@ -200,11 +141,46 @@ def check_opengl_error():
 
 # Main loop
 clock = pygame.time.Clock()
+frame_time = 0.0
 while True:
+    profiler.begin_frame()
+    profiler.stage("events")
     for event in pygame.event.get():
         if event.type == pygame.QUIT or (event.type == KEYDOWN and event.key == pygame.K_ESCAPE):
+            profiler.close()
+            stepper.close()
+            if recorder:
+                recorder.close()
+            loader.close()
             pygame.quit()
             quit()
+        elif event.type == KEYDOWN and event.key == K_SPACE:  # Pause / resume
+            if timestep.paused:
+                timestep.time_scale = paused_scale
+            else:
+                paused_scale, timestep.time_scale = timestep.time_scale, 0
+        elif event.type == KEYDOWN and event.key in (K_LEFT, K_RIGHT) and replay_path:  # Seek 10 s
+            replay_index += 600 if event.key == K_RIGHT else -600
+            replay_index = max(0, min(replay_index, len(replayer) - 1))
+        elif event.type == KEYDOWN and event.key in time_scales:  # 1x, 10x, 100x, 1000x
+            timestep.time_scale = time_scales[event.key]
+        elif event.type == KEYDOWN and event.key == K_c:  # Toggle culling and report last frame's counts
+            print("Drawn / culled:", cull_stats)
+            culling = not culling
+        elif event.type == KEYDOWN and event.key == K_b:  # Toggle the baked star skybox
+            if star_skybox:
+                star_skybox.delete()
+                star_skybox = None
+            else:
+                try:
+                    star_skybox = StarSkybox(system, nebula=skybox_nebula)
+                except Exception as error:  # Shader compile/link errors, GL < 3.3
+                    print("Star skybox unavailable:", error)
+        elif event.type == KEYDOWN and event.key == K_r:  # Toggle dynamic resolution
+            dynamic_resolution = not dynamic_resolution
+        elif event.type == KEYDOWN and event.key == K_h:  # Toggle the profiler overlay
+            show_hud = not show_hud
+            count_state_changes(show_hud or profile_log is not None)
         elif event.type == MOUSEBUTTONDOWN:
             if event.button == 4:  # Scroll up
                 camera_distance = max(10, camera_distance - 2)
@@ -219,81 +195,45 @@ while True:
         elif event.type == MOUSEBUTTONUP:
             last_mouse_pos = None
 
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-    # Set up camera
-    glLoadIdentity()
-    gluPerspective(45, (display[0] / display[1]), 0.1, 200.0)
-    glTranslatef(0, 0, -camera_distance)
-    glRotatef(camera_rot_x, 1, 0, 0)
-    glRotatef(camera_rot_y, 0, 1, 0)
-
-    # Update star positions for twinkling
-    for i in range(num_stars):
-        theta, phi = star_positions[i]
-        dtheta, dphi = star_velocities[i]
-        theta += dtheta
-        phi += dphi
-        phi = max(0, min(math.pi, phi))
-        theta = theta % (2 * math.pi)
-        star_positions[i] = [theta, phi]
-
-    # Draw stars (skybox effect)
-    glDisable(GL_DEPTH_TEST)
-    glDisable(GL_LIGHTING)
-    glPointSize(2)
-    glBegin(GL_POINTS)
-    glColor3f(1, 1, 1)
-    for theta, phi in star_positions:
-        x = skybox_radius * math.sin(phi) * math.cos(theta)
-        y = skybox_radius * math.sin(phi) * math.sin(theta)
-        z = skybox_radius * math.cos(phi)
-        glVertex3f(x, y, z)
-    glEnd()
-    glEnable(GL_DEPTH_TEST)
-    glEnable(GL_LIGHTING)
-
-    # Draw orbital paths for planets
-    for p in planets[1:]:
-        draw_orbit(p["distance"])
-
-    # Draw Sun, planets, and moons
-    for i, p in enumerate(planets):
-        glPushMatrix()
-        if i != 0:
-            planet_angles[i] += p["speed"]
-            x = math.cos(planet_angles[i]) * p["distance"]
-            z = math.sin(planet_angles[i]) * p["distance"]
-            glTranslatef(x, 0, z)
-        draw_sphere(p["radius"], p["color"], p["texture_id"])
-
-        # Draw moons
-        for j, moon in enumerate(p["moons"]):
-            glPushMatrix()
-            moon_angles[i][j] += moon["speed"]
-            mx = math.cos(moon_angles[i][j]) * moon["distance"]
-            mz = math.sin(moon_angles[i][j]) * moon["distance"]
-            glTranslatef(mx, 0, mz)
-            draw_sphere(moon["radius"], moon["color"])
-            glPopMatrix()
-
-        glPopMatrix()
-
-    # Draw asteroids
-    for i, a in enumerate(asteroids):
-        glPushMatrix()
-        asteroid_angles[i] += a["speed"]
-        x = math.cos(asteroid_angles[i]) * a["distance"]
-        z = math.sin(asteroid_angles[i]) * a["distance"]
-        glTranslatef(x, 0, z)
-        draw_sphere(a["radius"], a["color"])
-        glPopMatrix()
-
-    # Draw comets
-    for comet in comets:
-        comet.update()
-        comet.draw()
-
-    check_opengl_error()
+    # Advance the simulation by the real time since the last frame (interpolating the remainder),
+    # or show the next recorded frame with its camera
+    profiler.stage("update")
+    if replay_path:
+        camera_rot_x, camera_rot_y, camera_distance = replayer.seek(replay_index)
+        if not timestep.paused:
+            replay_index = min(replay_index + 1, len(replayer) - 1)
+    else:
+        timestep.advance(frame_time)
+        if recorder:
+            recorder.record((camera_rot_x, camera_rot_y, camera_distance))
+    profiler.stage("collisions")
+    for event in collisions.update():
+        print(f"Frame {event['frame']}: comet {event['index']} {event['kind']} with {event['body']} "
+              f"({event['distance']:+.2f})")
+    if loader.loading:
+        profiler.stage("textures")
+        loader.poll()
+
+    # Draw stars, orbits, Sun, planets, moons, asteroids and comets (culled, level-of-detail)
+    viewport = scaler.begin() if dynamic_resolution else display
+    draw_scene(system, camera_rot_x, camera_rot_y, camera_distance, viewport, planet_orbits,
+               draw_sphere, texture_ids, culling, profiler=profiler, moon_textures=moon_texture_ids,
+               skybox=star_skybox)
+    if dynamic_resolution:
+        profiler.stage("upscale")
+        scaler.end()
+
+    if show_hud:
+        profiler.stage("hud")
+        hud.draw(display)
+
+    profiler.stage("errors")
+    if check_gl_errors:
+        check_opengl_error()
+    profiler.stage("flip")
     pygame.display.flip()
-    clock.tick(60)
\ No newline at end of file
+    frame_time = clock.tick(max_fps) / 1000
+    if dynamic_resolution and scaler.update(clock.get_rawtime()):  # Frame time without the cap's sleep
+        print(f"Resolution scale {scaler.scale:.0%} ({scaler.size[0]}x{scaler.size[1]})")
+    profiler.note("scale", scaler.scale if dynamic_resolution else 1.0)
+    profiler.end_frame()
\ No newline at end of file
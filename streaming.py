@@ -0,0 +1,385 @@
+import base64
+import io
+import statistics
+import threading
+import time
+import traceback
+from collections import deque
+
+import OpenGL
+OpenGL.ERROR_CHECKING = __debug__  # python -O skips PyOpenGL's glGetError after every GL call
+import offscreen  # Must come before OpenGL.GL: selects the headless platform
+import numpy as np
+from OpenGL.GL import *
+
+import renderer
+from export import encode_png
+from shaders import GpuOrbits
+from simulation import FixedTimestep
+from skybox import StarSkybox
+
+try:
+    from PIL import Image
+except ImportError:  # JPEG through pygame at its fixed quality, PNG through export.encode_png
+    Image = None
+
+# Inline display for Jupyter: the scene is rendered offscreen on a thread of its own and streamed
+# into the notebook as compressed images, so it runs on notebook servers with no display. Frames
+# go to an ipywidgets Image, with mouse input through ipyevents; without ipywidgets they replace
+# one display() output instead, and without ipyevents there is no mouse control.
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+# Encode a (height, width, 4) RGBA frame stored bottom row first. With Pillow, quality (1-100)
+# applies to JPEG and WebP; without it only JPEG (at pygame's fixed quality) and PNG are available.
+def encode_frame(pixels, format="jpeg", quality=80):
+    height, width = pixels.shape[:2]
+    if Image is not None:
+        image = Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, -1).convert("RGB")
+        out = io.BytesIO()
+        if format == "png":
+            image.save(out, "PNG", compress_level=1)
+        else:
+            image.save(out, format.upper(), quality=quality)
+        return out.getvalue()
+    if format == "png":
+        return encode_png(pixels, level=1)
+    if format == "jpeg":
+        import pygame
+
+        surface = pygame.image.frombuffer(np.ascontiguousarray(pixels[::-1]).tobytes(), (width, height), "RGBA")
+        out = io.BytesIO()
+        pygame.image.save(surface, out, "frame.jpg")
+        return out.getvalue()
+    raise ValueError(f"Streaming {format} frames needs Pillow")
+
+
+# Encodes frames on a background thread and hands the results to deliver(frame, data) there.
+# submit() never waits: a frame still waiting when the next one arrives is dropped, so when
+# encoding or sending falls behind the stream skips frames instead of building up latency. Frames
+# are (pixels, quality, input time); a dropped frame's input time carries over to the one that
+# replaces it, so latency is measured to the first frame that actually shows the input.
+class FrameEncoder:
+    def __init__(self, deliver, format="jpeg"):
+        self.deliver = deliver
+        self.format = format
+        self.condition = threading.Condition()
+        self.waiting = None
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="stream-encoder", daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        with self.condition:
+            if self.waiting is not None:
+                self.dropped += 1
+                if self.waiting[2] is not None:
+                    frame = frame[:2] + (self.waiting[2],)
+            self.waiting = frame
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.waiting is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                frame, self.waiting = self.waiting, None
+            pixels, quality, _ = frame
+            try:
+                self.deliver(frame, encode_frame(pixels, self.format, quality))
+            except Exception:
+                traceback.print_exc()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+# Chooses the resolution scale and encoder quality that keep frames within a bandwidth budget
+# (bytes per second) at the target frame rate. Like resolution.DynamicResolution it acts on the
+# median of recent frame sizes and waits after every change. Over budget it lowers quality
+# first, then resolution; with room to spare it restores resolution first, then quality.
+class AdaptiveQuality:
+    def __init__(self, bandwidth, fps, quality=80, min_quality=30, quality_step=5, min_scale=0.25,
+                 scale_step=0.125, margin=0.8, sample_frames=10, cooldown=10, adjust_quality=True):
+        self.bandwidth = bandwidth
+        self.fps = fps
+        self.quality = self.max_quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.quality_step = quality_step
+        self.scale = 1.0
+        self.min_scale = min_scale
+        self.scale_step = scale_step
+        self.margin = margin  # Fraction of the budget that stepping up aims for
+        self.samples = deque(maxlen=sample_frames)
+        self.cooldown = cooldown
+        self.wait = 0
+        self.adjust_quality = adjust_quality  # False for PNG, or JPEG without Pillow
+
+    # Render size for a full-scale width and height
+    def size(self, width, height):
+        return max(16, round(width * self.scale)), max(16, round(height * self.scale))
+
+    # Feed the encoded size of a frame in bytes. Returns True when the scale or quality changed.
+    def update(self, size):
+        self.samples.append(size)
+        if self.wait:
+            self.wait -= 1
+            return False
+        if len(self.samples) < self.samples.maxlen:
+            return False
+        median = statistics.median(self.samples)
+        goal = self.bandwidth / self.fps
+        if median > goal:
+            if self.adjust_quality and self.quality > self.min_quality:
+                step = self.quality - self.min_quality if median > 2 * goal else self.quality_step
+                self.quality = max(self.quality - step, self.min_quality)
+            elif self.scale > self.min_scale:
+                # Encoded size grows with the pixel count, scale squared
+                scale = np.floor(self.scale * np.sqrt(goal / median) / self.scale_step) * self.scale_step
+                self.scale = float(max(min(scale, self.scale - self.scale_step), self.min_scale))
+            else:
+                return False
+        elif self.scale < 1.0 and median * ((self.scale + self.scale_step) / self.scale) ** 2 < goal * self.margin:
+            self.scale = min(self.scale + self.scale_step, 1.0)
+        elif self.adjust_quality and self.quality < self.max_quality and median * 1.15 < goal * self.margin:
+            self.quality = min(self.quality + self.quality_step, self.max_quality)
+        else:
+            return False
+        self.samples.clear()
+        self.wait = self.cooldown
+        return True
+
+
+# Streams a SolarSystem into the notebook. show() displays the view and starts rendering; drag
+# to rotate and scroll to zoom, as in the scripts (camera_rot_x, camera_rot_y and camera_distance
+# can also be set from code). The simulation advances in real time at time_scale (0 pauses).
+# stop() ends the stream; report() returns the last second's statistics, which are also shown
+# under the view:
+# - fps: frames shown per second, next to the frames rendered and dropped (encoder busy, or over
+#   the bandwidth budget)
+# - latency: time from an input event reaching the kernel to the first frame showing it being
+#   sent, median and 95th percentile of the last 100 inputs. The browser's share (the event's
+#   trip to the kernel and the frame's trip back) is not included, since only the kernel's clock
+#   is available.
+#
+# The stream renders on its own GL context, so shaders=True and skybox=True build a
+# shaders.GpuOrbits and a skybox.StarSkybox there; other keyword arguments go to
+# renderer.draw_scene.
+class NotebookStream:
+    def __init__(self, system, width=960, height=540, fps=30, format="jpeg", quality=80,
+                 bandwidth=2_000_000, shaders=False, skybox=False, **draw_options):
+        if format not in MIME_TYPES:
+            raise ValueError(f"format must be one of {', '.join(MIME_TYPES)}")
+        if format == "webp" and Image is None:
+            raise ValueError("Streaming webp frames needs Pillow")
+        self.system = system
+        self.width, self.height = width, height
+        self.fps = fps
+        self.format = format
+        self.quality = AdaptiveQuality(bandwidth, fps, quality,
+                                       adjust_quality=Image is not None and format != "png")
+        self.orbits = system.orbit_paths()
+        self.shaders = shaders
+        self.skybox = skybox
+        self.draw_options = draw_options
+        self.time_scale = 1.0
+
+        self.camera_rot_x = 0
+        self.camera_rot_y = 0
+        self.camera_distance = 40
+        self.last_mouse_pos = None
+        self.input_time = None  # Oldest input not yet in a rendered frame
+        self.unshown_input = None  # Input time of a frame dropped over the budget, for the next one
+
+        self.rendered = 0
+        self.shown = 0
+        self.dropped_bandwidth = 0
+        self.sent = deque()  # (time, bytes) of frames sent in the last second
+        self.latencies = deque(maxlen=100)
+        self.stats = {}
+        self.last_stats = (time.perf_counter(), 0, 0, 0, 0)
+        self.image = self.label = self.events = self.handles = None
+        self.encoder = None
+        self.thread = None
+        self.running = False
+
+    # Display the view in the current cell's output and start streaming
+    def show(self):
+        from IPython.display import HTML, display
+
+        try:
+            import ipywidgets
+        except ImportError:
+            ipywidgets = None
+        if ipywidgets:
+            self.image = ipywidgets.Image(format=self.format, width=self.width, height=self.height)
+            self.label = ipywidgets.HTML()
+            try:
+                from ipyevents import Event
+                self.events = Event(source=self.image, prevent_default_action=True,
+                                    watched_events=["mousedown", "mouseup", "mousemove", "mouseleave", "wheel"],
+                                    throttle_or_debounce="throttle", wait=1000 // self.fps)
+                self.events.on_dom_event(self.handle_event)
+            except ImportError:
+                print("Install ipyevents for mouse control of the view")
+            display(ipywidgets.VBox([self.image, self.label]))
+        else:
+            print("Install ipywidgets for a faster view with mouse control")
+            self.handles = (display(HTML(""), display_id=True), display(HTML(""), display_id=True))
+        self.start()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.encoder = FrameEncoder(self.deliver, self.format)
+        self.thread = threading.Thread(target=self.run, name="stream-render", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.encoder:
+            self.encoder.close()
+            self.encoder = None
+
+    # ipyevents DOM event: the same drag and scroll mapping as solar_system.py
+    def handle_event(self, event):
+        kind = event["type"]
+        position = (event.get("relativeX", 0), event.get("relativeY", 0))
+        if kind == "wheel":
+            step = 2 if event.get("deltaY", 0) > 0 else -2  # Scroll down zooms out
+            self.camera_distance = max(10, min(60, self.camera_distance + step))
+        elif kind == "mousedown" and event.get("button", 0) == 0:
+            self.last_mouse_pos = position
+            return
+        elif kind == "mousemove" and self.last_mouse_pos and event.get("buttons", 1) & 1:
+            dx, dy = position[0] - self.last_mouse_pos[0], position[1] - self.last_mouse_pos[1]
+            self.camera_rot_y += dx * 0.2
+            self.camera_rot_x = max(-90, min(90, self.camera_rot_x + dy * 0.2))
+            self.last_mouse_pos = position
+        elif kind in ("mouseup", "mouseleave"):
+            self.last_mouse_pos = None
+            return
+        else:
+            return
+        if self.input_time is None:
+            self.input_time = time.perf_counter()
+
+    # Render thread: its own context, paced to fps; frames go to the encoder
+    def run(self):
+        context = framebuffer = gpu_orbits = sky = None
+        try:
+            context = offscreen.create_context()
+            renderer.forget_gl_objects()  # Names cached for another context
+            renderer.setup_gl_state()
+            framebuffer = renderer.Framebuffer(self.width, self.height)
+            gpu_orbits = GpuOrbits(self.system) if self.shaders else None
+            sky = StarSkybox(self.system) if self.skybox else None
+            timestep = FixedTimestep(self.system, tick_rate=60)
+            last = time.perf_counter()
+            while self.running:
+                start = time.perf_counter()
+                timestep.time_scale = self.time_scale
+                timestep.advance(start - last)
+                last = start
+                input_time, self.input_time = self.input_time, None
+                width, height = self.quality.size(self.width, self.height)
+                framebuffer.resize(width, height)
+                framebuffer.bind()
+                renderer.draw_scene(self.system, self.camera_rot_x, self.camera_rot_y, self.camera_distance,
+                                    (width, height), self.orbits, gpu_orbits=gpu_orbits, skybox=sky,
+                                    **self.draw_options)
+                glPixelStorei(GL_PACK_ALIGNMENT, 1)
+                pixels = np.frombuffer(glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE),
+                                       np.uint8).reshape(height, width, 4)
+                self.encoder.submit((pixels, self.quality.quality, input_time))
+                self.rendered += 1
+                time.sleep(max(0.0, start + 1 / self.fps - time.perf_counter()))
+        except Exception:
+            traceback.print_exc()
+            self.running = False
+        finally:
+            if context:
+                for resource in (gpu_orbits, sky, framebuffer):
+                    if resource:
+                        resource.delete()
+                renderer.delete_buffers()
+                offscreen.destroy_context(context)
+                renderer.forget_gl_objects()
+
+    # Encoder thread: send the frame unless it would exceed the budget, then update statistics
+    def deliver(self, frame, data):
+        input_time = frame[2] if self.unshown_input is None else self.unshown_input
+        now = time.perf_counter()
+        self.quality.update(len(data))
+        while self.sent and self.sent[0][0] < now - 1:
+            self.sent.popleft()
+        if self.sent and sum(size for _, size in self.sent) + len(data) > self.quality.bandwidth:
+            self.dropped_bandwidth += 1
+            self.unshown_input = input_time
+        else:
+            self.send(data)
+            self.sent.append((now, len(data)))
+            self.shown += 1
+            self.unshown_input = None
+            if input_time is not None:
+                self.latencies.append(time.perf_counter() - input_time)
+        if now - self.last_stats[0] >= 1:
+            self.update_stats(now)
+
+    def send(self, data):
+        if self.image is not None:
+            self.image.value = data
+        elif self.handles:
+            from IPython.display import HTML
+
+            source = f"data:{MIME_TYPES[self.format]};base64,{base64.b64encode(data).decode()}"
+            self.handles[0].update(HTML(f'<img src="{source}" width="{self.width}" height="{self.height}">'))
+
+    def update_stats(self, now):
+        start, rendered, shown, busy, over = self.last_stats
+        elapsed = now - start
+        encoder_dropped = self.encoder.dropped if self.encoder else busy
+        latencies = np.array(self.latencies) * 1000
+        width, height = self.quality.size(self.width, self.height)
+        self.stats = {
+            "fps": (self.shown - shown) / elapsed,
+            "rendered_fps": (self.rendered - rendered) / elapsed,
+            "dropped_encoder": (encoder_dropped - busy) / elapsed,
+            "dropped_bandwidth": (self.dropped_bandwidth - over) / elapsed,
+            "bytes_per_second": sum(size for _, size in self.sent),
+            "width": width, "height": height, "scale": self.quality.scale, "quality": self.quality.quality,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        }
+        self.last_stats = (now, self.rendered, self.shown, encoder_dropped, self.dropped_bandwidth)
+        text = self.summary()
+        if self.label is not None:
+            self.label.value = f"<code>{text}</code>"
+        elif self.handles:
+            from IPython.display import HTML
+
+            self.handles[1].update(HTML(f"<code>{text}</code>"))
+
+    # Last second's statistics (see the class comment)
+    def report(self):
+        return dict(self.stats)
+
+    def summary(self):
+        stats = self.stats
+        quality = f" quality {stats['quality']}" if self.quality.adjust_quality else ""
+        latency = (f"input to frame {stats['latency_p50_ms']:.0f} ms (p95 {stats['latency_p95_ms']:.0f} ms)"
+                   if stats["latency_p50_ms"] is not None else "no input yet")
+        return (f"{stats['fps']:.1f} fps shown of {stats['rendered_fps']:.1f} rendered "
+                f"({stats['dropped_encoder']:.1f}/s dropped encoding, {stats['dropped_bandwidth']:.1f}/s over budget) | "
+                f"{stats['width']}x{stats['height']} {self.format}{quality} | "
+                f"{stats['bytes_per_second'] / 1e6:.2f} of {self.quality.bandwidth / 1e6:.2f} MB/s | {latency}")
@@ -0,0 +1,19 @@
+import numpy as np
+
+from nbody import Octree, direct_accelerations
+
+
+# Barnes-Hut at the default theta against direct summation on a uniform cube: per-body error
+# relative to the body's own acceleration. About 1% median and 4% p99; with half the cell side as
+# the opening radius it was about 2% and 11-15%.
+def test_octree_error_against_direct_sum():
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-10, 10, (20000, 3))
+    gm = rng.uniform(0.5, 1.5, len(positions)) * 1e-6
+    approximate = Octree(positions, gm).accelerations(softening=0.05)
+    sample = rng.choice(len(positions), 500, replace=False)
+    exact = np.array([direct_accelerations(positions[i:i + 1], np.delete(positions, i, axis=0),
+                                           np.delete(gm, i), 0.05)[0] for i in sample])
+    error = np.linalg.norm(approximate[sample] - exact, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(error) < 0.015
+    assert np.percentile(error, 99) < 0.06
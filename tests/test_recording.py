@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from recording import Recorder, Replayer
+from simulation import SolarSystem
+
+
+def record(path, system, frames=5):
+    recorder = Recorder(str(path), system, keyframe_interval=4)
+    for _ in range(frames):
+        system.step()
+        system.interpolate(0.5)
+        recorder.record((0.0, 0.0, 40.0))
+    recorder.close()
+
+
+# An unseeded session draws its own seed, which the recording keeps, so it replays exactly
+def test_unseeded_session_replays_exactly(tmp_path):
+    system = SolarSystem(num_asteroids=50, num_stars=50)
+    record(tmp_path / "session.rec", system)
+    replayer = Replayer(str(tmp_path / "session.rec"))
+    replayer.seek(len(replayer) - 1)
+    assert replayer.system.frame == system.frame
+    assert np.array_equal(replayer.system.asteroids.positions, system.asteroids.positions)
+    assert np.array_equal(replayer.system.stars.positions, system.stars.positions)
+    assert np.array_equal(replayer.system.comets.position, system.comets.position)
+
+
+# A recording of a scene file will not replay on a different file at the same path
+def test_changed_scene_is_refused(tmp_path):
+    scene = tmp_path / "scene.toml"
+    scene.write_text('[[planets]]\nradius = 2.0\ncolor = [1, 1, 0]\n')
+    record(tmp_path / "session.rec", SolarSystem(num_asteroids=10, num_stars=10, scene=str(scene)))
+    Replayer(str(tmp_path / "session.rec"))
+    scene.write_text('[[planets]]\nradius = 3.0\ncolor = [1, 1, 0]\n')
+    with pytest.raises(ValueError, match="changed since the recording"):
+        Replayer(str(tmp_path / "session.rec"))
@@ -0,0 +1,26 @@
+import re
+
+import pytest
+
+from scene import compile_scene
+
+SUN = {"name": "Sun", "radius": 2.0, "color": [1, 1, 0]}
+
+
+# Malformed belts are reported by belt and field, as malformed bodies are
+@pytest.mark.parametrize("belt, message", [
+    ({"inner": 30, "outer": 50}, "Belt 0: a belt needs a count"),
+    ({"name": "Kuiper", "count": "many"}, "Kuiper: bad count 'many'"),
+    ({"count": 10, "speed": [0.001]}, "Belt 0: bad speed [0.001]"),
+    ({"count": 10, "color": ["grey", 0.6]}, "Belt 0: bad color ['grey', 0.6]"),
+    ({"count": 2.5}, "Belt 0: bad count 2.5"),
+])
+def test_malformed_belt(belt, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        compile_scene({"planets": [SUN], "belts": [belt]})
+
+
+def test_belt_defaults():
+    scene = compile_scene({"planets": [SUN], "belts": [{"count": 100}, {"count": 5, "inner": 30, "outer": 50}]})
+    assert scene.belts.tolist() == [[100, 10, 11, 0.05, 0.1, 0.01, 0.015, 0.4, 0.6],
+                                    [5, 30, 50, 0.05, 0.1, 0.01, 0.015, 0.4, 0.6]]
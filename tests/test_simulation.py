@@ -0,0 +1,33 @@
+from simulation import FixedTimestep, SolarSystem
+
+
+# A 1000x time warp in gravity mode takes at most max_integrated_steps integrator steps per
+# rendered frame and drops the rest instead of owing them to later frames
+def test_gravity_time_warp_is_bounded():
+    for mutual in (False, True):
+        system = SolarSystem(seed=0, gravity=True, mutual_gravity=mutual)
+        timestep = FixedTimestep(system, tick_rate=60, time_scale=1000, max_step_time=None)
+        for _ in range(3):
+            alpha = timestep.advance(0.25)
+        assert system.gravity.bodies.steps == system.frame == 3 * timestep.max_steps
+        assert timestep.skipped_frames == 3 * (15000 - timestep.max_steps)
+        assert 0 <= alpha < 1
+
+
+# Out of time, gravity mode still takes one step per rendered frame and drops the rest
+def test_gravity_step_time_budget():
+    system = SolarSystem(seed=0, gravity=True)
+    timestep = FixedTimestep(system, tick_rate=60, time_scale=10, max_step_time=0)
+    for _ in range(3):
+        timestep.advance(0.1)
+    assert system.gravity.bodies.steps == system.frame == 3
+    assert timestep.skipped_frames == 3 * (60 - 1)
+
+
+# Closed-form stepping is cheap at any rate, so it keeps every frame
+def test_time_warp_without_gravity_is_exact():
+    system = SolarSystem(seed=0)
+    timestep = FixedTimestep(system, tick_rate=60, time_scale=1000)
+    timestep.advance(0.25)
+    assert system.frame == 15000
+    assert timestep.skipped_frames == 0
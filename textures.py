@@ -0,0 +1,163 @@
+import hashlib
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pygame
+from OpenGL.GL import *
+
+import renderer
+
+
+# Decoded images are cached as raw RGBA .npy files keyed by source path, modification time, size
+# and target size. Later runs memory-map them instead of decoding the PNG again.
+def cache_path(cache_dir, filename, size):
+    stat = os.stat(filename)
+    key = f"{os.path.abspath(filename)}:{stat.st_mtime_ns}:{stat.st_size}:{size}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+
+# Decode filename to a (height, width, 4) uint8 array, bottom row first as glTexImage2D expects.
+# size=(w, h) rescales to exactly that size (atlas cells); an int caps the longest side.
+def decode(filename, size=None):
+    surface = pygame.image.load(filename)
+    surface = pygame.image.frombuffer(pygame.image.tostring(surface, "RGBA"), surface.get_size(), "RGBA")
+    width, height = surface.get_size()
+    if isinstance(size, int) and max(width, height) > size:
+        scale = size / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if isinstance(size, tuple) and size != (width, height):
+        surface = pygame.transform.smoothscale(surface, size)
+    width, height = surface.get_size()
+    return np.frombuffer(pygame.image.tostring(surface, "RGBA", True), np.uint8).reshape(height, width, 4)
+
+
+# decode() through the on-disk cache. Runs on the loader's worker threads.
+def load_cached(filename, size=None, cache_dir=None):
+    if cache_dir is None:
+        return decode(filename, size)
+    path = cache_path(cache_dir, filename, size)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    pixels = decode(filename, size)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.save(f, pixels)
+        os.replace(temporary, path)  # Readers never see a half-written file
+    except OSError as error:
+        print(f"Could not cache texture {filename}: {error}")
+    return pixels
+
+
+# Loads textures in the background so the scene can start untextured. Images are decoded (or read
+# from the cache) on a thread pool; poll() uploads finished ones on the GL thread, a few per
+# frame, with mipmaps. Large body textures get one GL texture each; small ones (moons) are packed
+# into a single atlas so all of them draw with one bind.
+#
+# textures and atlas_regions are lists parallel to files and atlas_files. Their entries stay None
+# until loaded and are then a texture id or an (atlas id, u, v, width, height) region, the handle
+# renderer.bind_texture() takes. Files that fail to load stay None and are listed in failed.
+# Entries given as None (bodies without a texture) stay None too.
+class TextureLoader:
+    def __init__(self, files, atlas_files=(), cache_dir=".texture_cache", workers=4, max_size=2048,
+                 atlas_cell=256):
+        self.files = list(files)
+        self.atlas_files = list(atlas_files)
+        self.textures = [None] * len(self.files)
+        self.atlas_regions = [None] * len(self.atlas_files)
+        self.failed = {}
+        self.atlas = None
+        self.atlas_cell = atlas_cell
+        self.owned = []  # GL textures to delete on close()
+
+        # One job per distinct file; the same image used by several bodies is decoded once
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="texture")
+        self.pending = {}
+        for filename in dict.fromkeys(self.files):
+            if filename is not None:
+                self.pending[("texture", filename)] = self.pool.submit(load_cached, filename, max_size, cache_dir)
+        atlas_unique = [filename for filename in dict.fromkeys(self.atlas_files) if filename is not None]
+        self.atlas_columns = max(1, math.ceil(math.sqrt(len(atlas_unique))))
+        self.atlas_cells = {filename: i for i, filename in enumerate(atlas_unique)}
+        for filename in atlas_unique:
+            self.pending[("atlas", filename)] = self.pool.submit(
+                load_cached, filename, (atlas_cell, atlas_cell), cache_dir)
+
+    @property
+    def loading(self):
+        return bool(self.pending)
+
+    # Upload up to max_uploads finished images. Call once per frame from the thread that owns the
+    # GL context.
+    def poll(self, max_uploads=1):
+        done = [job for job, future in self.pending.items() if future.done()][:max_uploads]
+        for job in done:
+            kind, filename = job
+            future = self.pending.pop(job)
+            try:
+                pixels = future.result()
+            except Exception as error:
+                self.failed[filename] = error
+                print(f"Failed to load texture {filename}: {error}")
+                continue
+            if kind == "texture":
+                texture_id = upload(pixels)
+                self.owned.append(texture_id)
+                for i, name in enumerate(self.files):
+                    if name == filename:
+                        self.textures[i] = texture_id
+            else:
+                region = self.pack(filename, pixels)
+                for i, name in enumerate(self.atlas_files):
+                    if name == filename:
+                        self.atlas_regions[i] = region
+        if done:
+            renderer.forget_bound_texture()
+        return len(done)
+
+    # Copy one cell into the atlas, allocating the atlas on first use. Cells sit on a grid of
+    # atlas_cell-sized squares, so mip levels down to the cell size never mix neighbouring images.
+    def pack(self, filename, pixels):
+        size = self.atlas_columns * self.atlas_cell
+        if self.atlas is None:
+            self.atlas = upload(None, size, size)
+            self.owned.append(self.atlas)
+        row, column = divmod(self.atlas_cells[filename], self.atlas_columns)
+        x, y = column * self.atlas_cell, row * self.atlas_cell
+        glBindTexture(GL_TEXTURE_2D, self.atlas)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, self.atlas_cell, self.atlas_cell, GL_RGBA, GL_UNSIGNED_BYTE,
+                        np.ascontiguousarray(pixels))
+        glGenerateMipmap(GL_TEXTURE_2D)
+        return (self.atlas, x / size, y / size, self.atlas_cell / size, self.atlas_cell / size)
+
+    # Block until everything is uploaded (tools that need textures on the first frame)
+    def wait(self):
+        for future in list(self.pending.values()):
+            future.exception()  # Waits without raising; poll() reports failures
+        self.poll(len(self.pending))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
+        if self.owned:
+            glDeleteTextures(len(self.owned), self.owned)
+        self.owned = []
+
+
+# Create a mipmapped RGBA texture from pixels (or empty storage of width x height)
+def upload(pixels, width=None, height=None):
+    if pixels is not None:
+        height, width = pixels.shape[:2]
+        pixels = np.ascontiguousarray(pixels)
+    texture_id = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture_id)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+    glGenerateMipmap(GL_TEXTURE_2D)
+    return texture_id